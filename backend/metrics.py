@@ -0,0 +1,196 @@
+"""
+Lock-light metrics with a text exposition in the Prometheus format, shared by the
+load balancer and the backends.
+
+Counters and histograms keep one shard per thread, so recording a value never
+waits on another thread; the per-metric lock is only taken when a thread records
+its first value and when the metrics are rendered. Shards of threads that have
+exited are folded into a single retired shard. Gauges are read from callbacks
+at render time and cost nothing in between.
+"""
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+MAX_LIVE_SHARDS = 64
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _ShardedMetric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > MAX_LIVE_SHARDS:
+                    self._retire_dead()
+        return shard
+
+    def _retire_dead(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._merge(self._retired, key, value)
+        self._shards = live
+
+    def _snapshot(self):
+        with self._lock:
+            self._retire_dead()
+            merged = {}
+            for key, value in self._retired.items():
+                self._merge(merged, key, value)
+            for _, shard in self._shards:
+                for key, value in list(shard.items()):
+                    self._merge(merged, key, value)
+        return merged
+
+    def _merge(self, target, key, value):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples(self._snapshot()))
+        return lines
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = _label_key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def _render_samples(self, values):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = _label_key(labels)
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _merge(self, target, key, value):
+        series = target.get(key)
+        if series is None:
+            series = target[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        for index, count in enumerate(value[0]):
+            series[0][index] += count
+        series[1] += value[1]
+
+    def _render_samples(self, values):
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read at render time from callback(), which returns a number or a dict
+    mapping label tuples ((name, value), ...) to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+
+        if isinstance(value, dict):
+            for key, sample in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(sample)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def bucket_label(number):
+    """Label for a Fibonacci number: its bit length, as used by the wait-time estimator."""
+    return str(max(0, int(number)).bit_length())
@@ -1,3 +1,4 @@
+import hashlib
 import os
 from pathlib import Path
 from datetime import timedelta
@@ -19,11 +20,11 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
-    'background_task',
     'tasks',
 ]
 
 MIDDLEWARE = [
+    'tasks.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,6 +81,24 @@ USE_I18N = True
 
 USE_TZ = True
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'task_channel': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.task_channel',
+        'TIMEOUT': 24 * 3600,
+        'OPTIONS': {
+            # shared by every backend: up to three keys (progress, cancel flag,
+            # followers) per running task on any of them. Past MAX_ENTRIES entries
+            # are culled at random, live cancel flags included, so the default 300
+            # would be reached by about a hundred running tasks
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
 STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -103,9 +122,71 @@ STATICFILES_DIRS = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
-BACKGROUND_TASK_RUN_ASYNC = True
-MAX_RUN_TIME = 3600
 MAX_FIBONACCI_NUMBER = 100000
 MAX_TASKS_PER_USER = 8
 MAX_TASKS_PER_SERVER = 2
-AVERAGE_TASK_TIME = 300
\ No newline at end of file
+TASK_EXECUTOR_WORKERS = MAX_TASKS_PER_SERVER
+AVERAGE_TASK_TIME = 300
+SIMULATED_WORK_DELAY = 0
+FIBONACCI_CACHE_SIZE = 10000
+TASK_STREAM_POLL_INTERVAL = 1
+TASK_STREAM_MAX_DURATION = 300
+TASK_CHANNEL_CACHE = 'task_channel'
+TASK_PROGRESS_FLUSH_INTERVAL = 2
+TASK_CHECKPOINT_INTERVAL = 30
+# a running task not written for this long, on a backend that no longer answers,
+# is taken over by another backend; checked every TASK_RECLAIM_INTERVAL seconds
+TASK_STALE_AFTER = 300
+TASK_RECLAIM_INTERVAL = 60
+TASK_STATS_SAMPLE_SIZE = 1000
+TASK_PAGE_SIZE = 50
+TASK_MAX_PAGE_SIZE = 200
+# seconds the changes (delta sync) token stays behind the newest change
+TASK_SYNC_LAG = 2
+
+LOAD_BALANCER_URL = 'http://127.0.0.1:3000'
+# sent by the backends as X-Internal-Token with their slot-release callbacks;
+# the balancer rejects callbacks without it
+INTERNAL_API_TOKEN = os.environ.get(
+    'INTERNAL_API_TOKEN',
+    hashlib.sha256(f'internal-api:{SECRET_KEY}'.encode('utf-8')).hexdigest()
+)
+LOAD_BALANCER_PORT = int(os.environ.get('LOAD_BALANCER_PORT', 3000))
+LOAD_BALANCER_WORKERS = 32
+LOAD_BALANCER_MAX_PENDING = 64
+LOAD_BALANCER_MAX_STREAMS = 512
+UPSTREAM_POOL_SIZE = 10
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = 32
+UPSTREAM_IDLE_TIMEOUT = 60
+PROXY_CHUNK_SIZE = 64 * 1024
+PROXY_READ_TIMEOUT = 300
+# backends of the load balancer; with BACKEND_REGISTRY_FILE set they are read from
+# that JSON file instead ({"main": url, "workers": [url, ...]}), re-read when it changes
+BACKEND_MAIN_SERVER = 'http://127.0.0.1:8000'
+BACKEND_WORKERS = ['http://127.0.0.1:8001', 'http://127.0.0.1:8002']
+BACKEND_REGISTRY_FILE = os.environ.get('BACKEND_REGISTRY_FILE')
+BACKEND_HEALTH_CHECK_INTERVAL = 5
+BACKEND_HEALTH_CHECK_TIMEOUT = 1
+BACKEND_HEALTH_CHECK_CONCURRENCY = 8
+# a backend failing this many times in a row is skipped for CIRCUIT_OPEN_SECONDS
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 30
+TASK_STATS_REFRESH_INTERVAL = 60
+DISPATCH_CONCURRENCY = 8
+DISPATCH_IDLE_TIMEOUT = 5
+# how long a user turned away by a backend's quota (429) is passed over when no
+# finished task of theirs is reported first
+DISPATCH_DEFER_SECONDS = 30
+# fifo, sjf (smallest number first), aging (shortest expected time first, with
+# QUEUE_AGING_RATE seconds of cost forgiven per second waited) or fair_share (per user)
+QUEUE_SCHEDULING_POLICY = 'fair_share'
+QUEUE_AGING_RATE = 1.0
+# memory: one balancer process, queue journaled to QUEUE_JOURNAL_PATH;
+# database: any number of balancers sharing the QueuedTask table, each claimed
+# task leased for QUEUE_LEASE_SECONDS (longer than a send may take)
+QUEUE_BACKEND = os.environ.get('QUEUE_BACKEND', 'memory')
+QUEUE_LEASE_SECONDS = 60
+# queued requests are journaled with their Authorization headers; the file (and
+# its -wal/-shm) is kept at mode 0600, so put it on a local disk that only the
+# balancer's user can reach, never a shared or world-readable directory
+QUEUE_JOURNAL_PATH = BASE_DIR / 'queue_journal.sqlite3'
\ No newline at end of file
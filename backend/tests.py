@@ -0,0 +1,50 @@
+from threading import Thread
+
+from django.test import SimpleTestCase
+
+from .metrics import Registry
+
+
+class RegistryTests(SimpleTestCase):
+    def test_counter_sums_shards_of_every_thread(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests')
+
+        threads = [Thread(target=lambda: [requests.inc(route='a') for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        requests.inc(2, route='b "x"')
+
+        self.assertEqual(registry.render(), (
+            '# HELP requests_total Requests\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{route="a"} 400\n'
+            'requests_total{route="b \\"x\\""} 2\n'
+        ))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            latency.observe(value)
+
+        self.assertEqual(registry.render().splitlines()[2:], [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 4.05',
+            'latency_seconds_count 4',
+        ])
+
+    def test_gauge_is_read_at_render_time(self):
+        registry = Registry()
+        values = {(('server', 'a'),): 1}
+        registry.gauge('slots', 'Free slots', lambda: values)
+        registry.gauge('broken', 'Fails', lambda: 1 / 0)
+
+        values[(('server', 'b'),)] = 2
+
+        self.assertIn('slots{server="b"} 2\n', registry.render())
+        self.assertIn('# TYPE broken gauge\n', registry.render())
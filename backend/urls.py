@@ -5,16 +5,21 @@ from django.urls import path, include
 from django.views.generic import TemplateView
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from tasks.views import TaskViewSet, UserRegistrationView, server_status
+from tasks.views import TaskViewSet, UserRegistrationView, server_status, task_stats
+from tasks.stream import task_stream
+from tasks.metrics import metrics_view
 
 router = DefaultRouter()
 router.register(r'tasks', TaskViewSet, basename='task')
 router.register(r'auth', UserRegistrationView, basename='auth')
 
 urlpatterns = [
+    path('api/tasks/stream/', task_stream, name='task_stream'),
     path('api/', include(router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/server-status/', server_status, name='server_status'),
+    path('api/task-stats/', task_stats, name='task_stats'),
+    path('metrics', metrics_view, name='metrics'),
     path('', TemplateView.as_view(template_name='frontend.html'), name='index'),
 ]
\ No newline at end of file
@@ -0,0 +1,70 @@
+import time
+from threading import Lock
+
+
+def cost_bucket(number):
+    """Tasks are grouped by the bit length of their number (powers of two)."""
+    return max(0, int(number)).bit_length()
+
+
+class WaitTimeEstimator:
+    """
+    Learns how long a task takes as a function of its number.
+
+    Each number bucket keeps an exponentially weighted mean of observed run times,
+    seeded from completed Task rows (load()) and updated online as backends report
+    finished tasks (observe()). Buckets with no data borrow the nearest bucket
+    that has some; with no data at all the configured default is used.
+    """
+
+    def __init__(self, default_cost, alpha=0.2):
+        self.default_cost = default_cost
+        self.alpha = alpha
+        self._costs = {}
+        self._lock = Lock()
+
+    def load(self, buckets):
+        with self._lock:
+            for bucket, stats in buckets.items():
+                if stats.get('count'):
+                    self._costs[int(bucket)] = float(stats['avg_seconds'])
+
+    def observe(self, number, seconds):
+        bucket = cost_bucket(number)
+        with self._lock:
+            previous = self._costs.get(bucket)
+            if previous is None:
+                self._costs[bucket] = seconds
+            else:
+                self._costs[bucket] = previous + self.alpha * (seconds - previous)
+
+    def cost(self, number):
+        if number is None:
+            return self.default_cost
+
+        bucket = cost_bucket(number)
+        with self._lock:
+            if bucket in self._costs:
+                return self._costs[bucket]
+            if not self._costs:
+                return self.default_cost
+            nearest = min(self._costs, key=lambda known: (abs(known - bucket), -known))
+            return self._costs[nearest]
+
+    def remaining(self, in_flight):
+        """Expected seconds left for tasks already running: [(number, started_monotonic)]."""
+        now = time.monotonic()
+        return sum(max(0.0, self.cost(number) - (now - started)) for number, started in in_flight)
+
+    def wait_seconds(self, cost_ahead, in_flight, total_slots):
+        """
+        Time until a task with cost_ahead seconds of queued work in front of it
+        starts: all that work plus what is left of the running tasks, spread over
+        every slot.
+        """
+        if total_slots <= 0:
+            return float(cost_ahead)
+        busy = self.remaining(in_flight)
+        if cost_ahead == 0 and len(in_flight) < total_slots:
+            return 0.0
+        return (busy + cost_ahead) / total_slots
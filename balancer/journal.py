@@ -0,0 +1,153 @@
+import base64
+import json
+import os
+import sqlite3
+import traceback
+from datetime import datetime
+from threading import Condition, Event, Thread
+
+
+class JournalWrite:
+    """One submission to the journal; wait() is True once it is durable, False if the write failed."""
+
+    def __init__(self):
+        self.ok = False
+        self._done = Event()
+
+    def finish(self, ok):
+        self.ok = ok
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout) and self.ok
+
+
+class QueueJournal:
+    """
+    Crash-safe record of the balancer's pending queue in a local SQLite file.
+
+    An entry is written when a task is accepted and deleted once it has been
+    handed to a backend, so after a restart load() returns exactly the accepted
+    but undispatched tasks, in acceptance order.
+
+    All writes go through one writer thread. Whatever operations pile up while a
+    commit (and its fsync) is running are written together in the next
+    transaction, so concurrent submissions share fsyncs instead of queueing on them.
+
+    Entries keep the headers needed to send the task, the client's bearer token
+    included, so the file and its WAL are readable by the balancer's user only.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._cond = Condition()
+        self._pending = []
+        self._thread = None
+        self._closed = False
+
+    def _protect(self):
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        # SQLite gives the -wal and -shm files it creates the database file's mode
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            if os.path.exists(path):
+                os.chmod(path, 0o600)
+
+    def _connect(self):
+        self._protect()
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS pending_tasks ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' dispatch_id TEXT NOT NULL UNIQUE,'
+            ' payload TEXT NOT NULL)'
+        )
+        return conn
+
+    def load(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT payload FROM pending_tasks ORDER BY seq').fetchall()
+        finally:
+            conn.close()
+        return [self._decode(payload) for (payload,) in rows]
+
+    def record_enqueue(self, entry):
+        """Returns a JournalWrite for the entry."""
+        return self._submit(('enqueue', entry['dispatch_id'], self._encode(entry)))
+
+    def record_enqueue_many(self, entries):
+        """One JournalWrite for all the entries; they are written in the same transaction."""
+        return self._submit(*[('enqueue', entry['dispatch_id'], self._encode(entry)) for entry in entries])
+
+    def record_dequeue(self, dispatch_id):
+        return self._submit(('dequeue', dispatch_id, None))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _submit(self, *ops):
+        write = JournalWrite()
+        with self._cond:
+            if self._thread is None:
+                self._thread = Thread(target=self._writer, daemon=True, name='queue-journal')
+                self._thread.start()
+            self._pending.extend((op, write) for op in ops)
+            self._cond.notify()
+        return write
+
+    def _writer(self):
+        conn = None
+
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                if not batch and self._closed:
+                    break
+
+            try:
+                if conn is None:
+                    conn = self._connect()
+                with conn:
+                    for (kind, dispatch_id, payload), _ in batch:
+                        if kind == 'enqueue':
+                            conn.execute(
+                                'INSERT OR IGNORE INTO pending_tasks (dispatch_id, payload) VALUES (?, ?)',
+                                (dispatch_id, payload)
+                            )
+                        else:
+                            conn.execute('DELETE FROM pending_tasks WHERE dispatch_id = ?', (dispatch_id,))
+                ok = True
+            except Exception as e:
+                print(f"Помилка запису журналу черги: {e}")
+                traceback.print_exc()
+                ok = False
+
+            for _, write in batch:
+                write.finish(ok)
+
+        if conn is not None:
+            conn.close()
+
+    def _encode(self, entry):
+        return json.dumps({
+            'body': base64.b64encode(entry['body']).decode('ascii'),
+            'headers': entry['headers'],
+            'queued_at': entry['queued_at'].isoformat(),
+            'number': entry['number'],
+            'user_id': entry['user_id'],
+            'dispatch_id': entry['dispatch_id'],
+        })
+
+    def _decode(self, payload):
+        data = json.loads(payload)
+        data['body'] = base64.b64decode(data['body'])
+        data['queued_at'] = datetime.fromisoformat(data['queued_at'])
+        return data
@@ -0,0 +1,185 @@
+import time
+from threading import Lock
+
+
+class SlotLedger:
+    """
+    In-memory count of the tasks the balancer has placed on each backend.
+
+    A slot is reserved while a task is being sent, kept when the backend accepts
+    it and released when the backend reports the task finished (completed,
+    failed or cancelled).
+    reconcile() replaces a backend's entries with what the backend itself
+    reports, correcting drift from lost callbacks or restarts; the health check
+    calls it when the backend's task count no longer matches task_count().
+
+    Tasks for the same number on one backend share a single computation there
+    (see tasks.executor), so they take one slot between them, and reserve()
+    sends a task to the backend already computing its number.
+    """
+
+    def __init__(self, server_urls, capacity):
+        self.capacity = capacity
+        self._lock = Lock()
+        self._tasks = {url: {} for url in server_urls}
+        self._reachable = {url: False for url in server_urls}
+
+    def set_servers(self, server_urls):
+        """
+        Adds backends (unreachable until their first reconcile) and forgets the ones
+        no longer listed; sends still in flight to a removed backend settle as no-ops.
+        """
+        with self._lock:
+            for url in server_urls:
+                self._tasks.setdefault(url, {})
+                self._reachable.setdefault(url, False)
+            for url in [url for url in self._tasks if url not in server_urls]:
+                del self._tasks[url]
+                del self._reachable[url]
+
+    def _used(self, tasks):
+        """Slots taken by tasks: one per number, one per task whose number is unknown."""
+        return len({
+            ('number', info['number']) if info['number'] is not None else ('task', task_id)
+            for task_id, info in tasks.items()
+        })
+
+    def free_slots(self, server_url):
+        with self._lock:
+            if not self._reachable.get(server_url):
+                return 0
+            return max(0, self.capacity - self._used(self._tasks[server_url]))
+
+    def total_free_slots(self):
+        with self._lock:
+            return sum(
+                max(0, self.capacity - self._used(tasks))
+                for url, tasks in self._tasks.items() if self._reachable[url]
+            )
+
+    def total_slots(self):
+        with self._lock:
+            return self.capacity * sum(1 for reachable in self._reachable.values() if reachable)
+
+    def in_flight(self):
+        """[(number, taken_at)] for every taken slot; number is None while unknown."""
+        with self._lock:
+            slots = {}
+            for url, tasks in self._tasks.items():
+                if not self._reachable[url]:
+                    continue
+                for task_id, info in tasks.items():
+                    key = (url, info['number']) if info['number'] is not None else (url, 'task', task_id)
+                    if key not in slots or info['taken_at'] < slots[key][1]:
+                        slots[key] = (info['number'], info['taken_at'])
+            return list(slots.values())
+
+    def running_numbers(self):
+        """Numbers with a task placed or being sent on a reachable backend."""
+        with self._lock:
+            return {
+                info['number']
+                for url, tasks in self._tasks.items() if self._reachable[url]
+                for info in tasks.values() if info['number'] is not None
+            }
+
+    def reserve(self, tasks):
+        """
+        tasks is [(dispatch_id, number)]. A task whose number already has a slot on
+        a reachable backend joins it there; the others each hold a slot on the
+        least loaded reachable backend, for as many as there are free slots.
+        Returns [(dispatch_id, server_url)]. A reservation counts as a taken slot
+        until confirm() or cancel().
+        """
+        assignments = []
+        now = time.monotonic()
+
+        with self._lock:
+            reachable = [url for url in self._tasks if self._reachable[url]]
+            used = {url: self._used(self._tasks[url]) for url in reachable}
+            placed = {
+                info['number']: url
+                for url in reachable for info in self._tasks[url].values() if info['number'] is not None
+            }
+
+            for dispatch_id, number in tasks:
+                server_url = placed.get(number)
+                if server_url is None:
+                    candidates = [(used[url], url) for url in reachable if used[url] < self.capacity]
+                    if not candidates:
+                        continue
+                    _, server_url = min(candidates)
+                    used[server_url] += 1
+                    placed[number] = server_url
+                self._tasks[server_url][('dispatch', dispatch_id)] = {'number': number, 'taken_at': now}
+                assignments.append((dispatch_id, server_url))
+
+        return assignments
+
+    def confirm(self, server_url, dispatch_id, task_id, number=None):
+        with self._lock:
+            tasks = self._tasks.get(server_url)
+            if tasks is not None:
+                tasks.pop(('dispatch', dispatch_id), None)
+                tasks[task_id] = {'number': number, 'taken_at': time.monotonic()}
+
+    def cancel(self, server_url, dispatch_id):
+        with self._lock:
+            if server_url in self._tasks:
+                self._tasks[server_url].pop(('dispatch', dispatch_id), None)
+
+    def release(self, task_id):
+        with self._lock:
+            for tasks in self._tasks.values():
+                if tasks.pop(task_id, None) is not None:
+                    return True
+        return False
+
+    def task_count(self, server_url):
+        """Tasks the backend has confirmed; reservations still being sent are not counted."""
+        with self._lock:
+            return sum(1 for task_id in self._tasks.get(server_url, ()) if not isinstance(task_id, tuple))
+
+    def mark_reachable(self, server_url):
+        with self._lock:
+            if server_url in self._reachable:
+                self._reachable[server_url] = True
+
+    def mark_unreachable(self, server_url):
+        with self._lock:
+            if server_url in self._reachable:
+                self._reachable[server_url] = False
+
+    def reconcile(self, server_url, tasks, probed_at):
+        """
+        tasks is the backend's own list of in-progress (task_id, number) as of
+        probed_at (a time.monotonic() taken before the probe was sent). Slots taken
+        after that moment and reservations still being sent are kept, since the
+        backend could not have reported them yet.
+        """
+        with self._lock:
+            if server_url not in self._tasks:
+                return 0
+            current = self._tasks[server_url]
+            reconciled = {
+                task_id: info for task_id, info in current.items()
+                if info['taken_at'] >= probed_at or isinstance(task_id, tuple)
+            }
+            for task_id, number in tasks:
+                reconciled.setdefault(task_id, current.get(task_id, {'number': number, 'taken_at': probed_at}))
+
+            drift = len(set(current) ^ set(reconciled))
+            self._tasks[server_url] = reconciled
+            self._reachable[server_url] = True
+        return drift
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                url: {
+                    'in_progress': self._used(tasks),
+                    'available_slots': max(0, self.capacity - self._used(tasks)) if self._reachable[url] else 0,
+                    'reachable': self._reachable[url],
+                }
+                for url, tasks in self._tasks.items()
+            }
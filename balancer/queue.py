@@ -0,0 +1,264 @@
+import random
+from collections import OrderedDict
+from itertools import count
+
+from .scheduling import FifoPolicy
+
+
+class _Node:
+    __slots__ = ('key', 'entry', 'weight', 'left', 'right', 'size', 'cost')
+
+    def __init__(self, key, entry):
+        self.key = key
+        self.entry = entry
+        self.weight = random.random()
+        self.left = self.right = None
+        self.size = 1
+        self.cost = entry.get('cost', 0)
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _cost(node):
+    return node.cost if node is not None else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+    node.cost = node.entry.get('cost', 0) + _cost(node.left) + _cost(node.right)
+    return node
+
+
+def _split(node, key):
+    """(nodes with keys below key, the rest)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, rest = _split(node.right, key)
+        return _update(node), rest
+    below, node.left = _split(node.left, key)
+    return below, _update(node)
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.weight > right.weight:
+        left.right = _merge(left.right, right)
+        return _update(left)
+    right.left = _merge(left, right.left)
+    return _update(right)
+
+
+def _remove(node, key):
+    if node is None:
+        return None
+    if node.key == key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    else:
+        node.right = _remove(node.right, key)
+    return _update(node)
+
+
+class _RankTree:
+    """
+    Treap of entries ordered by key, each node carrying the entry count and the
+    cost sum of its subtree: insert, remove, the first entry and the count and
+    cost in front of a key are all O(log n) expected.
+    """
+
+    def __init__(self):
+        self._root = None
+
+    def insert(self, key, entry):
+        below, rest = _split(self._root, key)
+        self._root = _merge(_merge(below, _Node(key, entry)), rest)
+
+    def remove(self, key):
+        self._root = _remove(self._root, key)
+
+    def first(self):
+        node = self._root
+        if node is None:
+            return None
+        while node.left is not None:
+            node = node.left
+        return node.entry
+
+    def ahead(self, key):
+        """(count, cost) of the entries with keys below key."""
+        entries = cost = 0
+        node = self._root
+        while node is not None:
+            if node.key < key:
+                entries += _size(node.left) + 1
+                cost += _cost(node.left) + node.entry.get('cost', 0)
+                node = node.right
+            else:
+                node = node.left
+        return entries, cost
+
+    def total_cost(self):
+        return _cost(self._root)
+
+    def __iter__(self):
+        stack, node = [], self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.entry
+            node = node.right
+
+
+class TaskQueue:
+    """
+    Pending tasks, dispatched in the order given by a scheduling policy, with
+    per-user and per-number indexes.
+
+    Entries are dicts with at least 'dispatch_id', 'user_id' and 'number', and
+    optionally 'cost' (expected run time in seconds). The policy stamps each entry
+    with a priority key once, on its first enqueue; entries are kept in a rank
+    tree ordered by (priority, arrival), so popleft() and the position and
+    cost-ahead queries are exact under every policy. Enqueue, dequeue, the
+    per-user count used for quota checks and those queries are all O(log n);
+    listing or removing one user's entries is O(k log n) in that user's entry
+    count, and likewise for one number's entries. Not thread-safe on its own:
+    callers hold the lock of the MemoryQueueStore that owns it.
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or FifoPolicy()
+        self._entries = {}
+        self._by_user = {}
+        self._by_number = {}
+        self._tree = _RankTree()
+        self._seq = count(1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, dispatch_id):
+        return dispatch_id in self._entries
+
+    def __iter__(self):
+        return iter(self._tree)
+
+    def _index(self, entry):
+        self._by_user.setdefault(entry['user_id'], OrderedDict())[entry['dispatch_id']] = entry
+        self._by_number.setdefault(entry['number'], OrderedDict())[entry['dispatch_id']] = entry
+
+    def _unindex(self, entry):
+        number_entries = self._by_number.get(entry['number'])
+        if number_entries is not None:
+            number_entries.pop(entry['dispatch_id'], None)
+            if not number_entries:
+                del self._by_number[entry['number']]
+
+        user_entries = self._by_user.get(entry['user_id'])
+        if user_entries is None:
+            return
+        user_entries.pop(entry['dispatch_id'], None)
+        if not user_entries:
+            del self._by_user[entry['user_id']]
+            self.policy.forget_user(entry['user_id'])
+
+    @staticmethod
+    def _key(entry):
+        return (entry['priority'], entry['seq'])
+
+    def _push(self, entry):
+        self._entries[entry['dispatch_id']] = entry
+        self._index(entry)
+        self._tree.insert(self._key(entry), entry)
+
+    def append(self, entry):
+        entry['seq'] = next(self._seq)
+        entry['priority'] = self.policy.key(entry, entry['seq'])
+        self._push(entry)
+
+    def requeue(self, entry):
+        """Puts back an entry taken with popleft(), with its original priority."""
+        if 'priority' not in entry:
+            self.append(entry)
+        else:
+            self._push(entry)
+
+    def popleft(self):
+        entry = self._tree.first()
+        if entry is None:
+            raise IndexError('pop from an empty queue')
+
+        del self._entries[entry['dispatch_id']]
+        self._unindex(entry)
+        self._tree.remove(self._key(entry))
+        self.policy.on_dequeue(entry)
+        return entry
+
+    def popleft_many(self, limit, skip_users=()):
+        """
+        Takes up to limit entries off the front like popleft(), passing over the
+        entries of skip_users, which keep their places.
+        """
+        taken = []
+        for entry in self._tree:
+            if len(taken) == limit:
+                break
+            if entry['user_id'] not in skip_users:
+                taken.append(entry)
+
+        for entry in taken:
+            self.take(entry['dispatch_id'])
+        return taken
+
+    def take(self, dispatch_id):
+        """Takes a queued entry out for dispatch from wherever it is, like popleft()."""
+        entry = self.remove(dispatch_id)
+        if entry is not None:
+            self.policy.on_dequeue(entry)
+        return entry
+
+    def remove(self, dispatch_id):
+        entry = self._entries.pop(dispatch_id, None)
+        if entry is not None:
+            self._unindex(entry)
+            self._tree.remove(self._key(entry))
+        return entry
+
+    def position(self, entry):
+        """1-based position of a queued entry."""
+        return self._tree.ahead(self._key(entry))[0] + 1
+
+    def cost_ahead(self, entry):
+        """Total cost of the entries queued in front of this one."""
+        return self._tree.ahead(self._key(entry))[1]
+
+    def total_cost(self):
+        return self._tree.total_cost()
+
+    def count_for_user(self, user_id):
+        return len(self._by_user.get(user_id, ()))
+
+    def entries_for_user(self, user_id):
+        return list(self._by_user.get(user_id, {}).values())
+
+    def entries_for_number(self, number):
+        return list(self._by_number.get(number, {}).values())
+
+    def remove_user(self, user_id):
+        user_entries = self._by_user.pop(user_id, {})
+        for dispatch_id in user_entries:
+            entry = self._entries.pop(dispatch_id)
+            self._tree.remove(self._key(entry))
+            self._by_number[entry['number']].pop(dispatch_id)
+            if not self._by_number[entry['number']]:
+                del self._by_number[entry['number']]
+        self.policy.forget_user(user_id)
+        return list(user_entries.values())
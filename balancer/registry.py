@@ -0,0 +1,202 @@
+import json
+import os
+import time
+from threading import Lock
+
+
+class CircuitBreaker:
+    """
+    closed    - requests go through; failure_threshold failures in a row open it
+    open      - requests are refused without trying, for open_seconds
+    half_open - the open period is over: allow() lets a single probe through,
+                whose success closes the breaker and whose failure reopens it.
+                A probe that never reports back is given up after open_seconds
+                and the next allow() sends another.
+    """
+
+    def __init__(self, failure_threshold, open_seconds):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._lock = Lock()
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at < self.open_seconds:
+            return 'open'
+        if self._probe_started is not None and now - self._probe_started < self.open_seconds:
+            # a probe is out: everything else waits for its outcome
+            return 'open'
+        return 'half_open'
+
+    @property
+    def state(self):
+        """The current state, without claiming the half-open probe."""
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self):
+        """Whether a request may go through now; in half_open the caller becomes the probe."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == 'half_open':
+                self._probe_started = now
+            return state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        """Returns True when this failure opened (or reopened) the breaker."""
+        with self._lock:
+            self._failures += 1
+            probe_failed = self._probe_started is not None
+            if probe_failed or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                return True
+            return False
+
+
+class Backend:
+    def __init__(self, url, role, breaker):
+        self.url = url
+        self.role = role
+        self.breaker = breaker
+        self.healthy = False
+        self.checked_at = None
+
+
+class BackendRegistry:
+    """
+    The main (database) server and the worker servers the balancer talks to,
+    with the cached result of the last health check and a circuit breaker per
+    backend.
+
+    The backends come from config_file when it is set - a JSON object
+    {"main": url, "workers": [url, ...]} that is re-read by reload() whenever it
+    changes on disk - and from main_url / worker_urls otherwise. A backend keeps
+    its health state and breaker across reloads as long as its URL stays listed.
+    """
+
+    def __init__(self, main_url, worker_urls, failure_threshold, open_seconds, config_file=None):
+        self.default_config = {'main': main_url, 'workers': list(worker_urls)}
+        self.config_file = config_file
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._config_mtime = None
+        self._main = None
+        self._workers = {}
+        self._lock = Lock()
+        self.reload()
+
+    def _read_config(self):
+        if not self.config_file:
+            return self.default_config, None
+
+        mtime = os.stat(self.config_file).st_mtime
+        if mtime == self._config_mtime:
+            return None, mtime
+        with open(self.config_file, encoding='utf-8') as f:
+            config = json.load(f)
+        if not config.get('main') or not isinstance(config.get('workers'), list):
+            raise ValueError(f"{self.config_file}: expected {{\"main\": url, \"workers\": [url, ...]}}")
+        return config, mtime
+
+    def _backend(self, url, role, current):
+        backend = current.get(url)
+        if backend is None:
+            backend = Backend(url, role, CircuitBreaker(self.failure_threshold, self.open_seconds))
+        backend.role = role
+        return backend
+
+    def reload(self):
+        """
+        Applies the configuration if it changed. Returns (added, removed) worker
+        URLs; raises OSError or ValueError on an unreadable file and keeps the
+        previous backends.
+        """
+        config, mtime = self._read_config()
+        with self._lock:
+            if config is None or (mtime is None and self._main is not None):
+                return [], []
+
+            current = dict(self._workers)
+            if self._main is not None:
+                current.setdefault(self._main.url, self._main)
+
+            workers = {}
+            for url in dict.fromkeys(url.rstrip('/') for url in config['workers']):
+                workers[url] = self._backend(url, 'worker', current)
+            main_url = config['main'].rstrip('/')
+            main = workers.get(main_url) or self._backend(main_url, 'main', current)
+
+            added = [url for url in workers if url not in self._workers]
+            removed = [url for url in self._workers if url not in workers]
+            self._main, self._workers, self._config_mtime = main, workers, mtime
+        return added, removed
+
+    @property
+    def main_url(self):
+        return self._main.url
+
+    def worker_urls(self):
+        with self._lock:
+            return list(self._workers)
+
+    def get(self, url):
+        with self._lock:
+            if self._main.url == url:
+                return self._main
+            return self._workers.get(url)
+
+    def due_for_check(self):
+        """
+        Every backend whose breaker is not open; open ones wait out open_seconds.
+        Only peeks: the health check request itself claims a half-open probe.
+        """
+        with self._lock:
+            backends = [self._main] + [
+                backend for url, backend in self._workers.items() if url != self._main.url
+            ]
+        return [backend for backend in backends if backend.breaker.state != 'open']
+
+    def is_available(self, url):
+        """Whether a request to url may be sent now; the caller has to report its outcome."""
+        backend = self.get(url)
+        return backend is not None and backend.breaker.allow()
+
+    def record_success(self, url):
+        backend = self.get(url)
+        if backend is not None:
+            backend.healthy = True
+            backend.checked_at = time.monotonic()
+            backend.breaker.record_success()
+
+    def record_failure(self, url):
+        """Returns True when the failure opened the backend's breaker."""
+        backend = self.get(url)
+        if backend is None:
+            return False
+        backend.healthy = False
+        backend.checked_at = time.monotonic()
+        return backend.breaker.record_failure()
+
+    def snapshot(self):
+        with self._lock:
+            backends = [self._main] + list(self._workers.values())
+        return {
+            backend.url: {
+                'role': backend.role,
+                'healthy': backend.healthy,
+                'circuit': backend.breaker.state,
+            }
+            for backend in backends
+        }
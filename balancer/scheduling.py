@@ -0,0 +1,90 @@
+"""
+Scheduling policies for the pending queue.
+
+A policy gives every entry a priority key when it is enqueued; the queue always
+dispatches the entry with the lowest key. Keys never change afterwards, so a
+task that goes back to the queue after a failed send keeps its place.
+"""
+
+
+class FifoPolicy:
+    """Arrival order."""
+
+    def key(self, entry, seq):
+        return seq
+
+    def on_dequeue(self, entry):
+        pass
+
+    def forget_user(self, user_id):
+        pass
+
+    def resume_user(self, user_id, last_key):
+        """Sets what the policy remembers of a user from a shared queue (last_key of their newest entry, or None)."""
+        pass
+
+
+class ShortestJobFirstPolicy(FifoPolicy):
+    """Smallest number first; equal numbers in arrival order."""
+
+    def key(self, entry, seq):
+        return entry['number']
+
+
+class AgingPolicy(FifoPolicy):
+    """
+    Shortest expected run time first, but every second spent waiting takes
+    `rate` seconds off a task's cost, so large tasks are not starved.
+    cost - rate * (now - queued_at) orders the same as cost + rate * queued_at.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def key(self, entry, seq):
+        return entry.get('cost', 0) + self.rate * entry['queued_at'].timestamp()
+
+
+class FairSharePolicy(FifoPolicy):
+    """
+    Start-time fair queuing over users: each user's tasks are stamped with a
+    virtual finish time (the later of the user's previous finish and the
+    current virtual time, plus the task's expected cost). Users with a backlog
+    get turns in proportion to the work they ask for, not the count of
+    tasks they queued.
+    """
+
+    def __init__(self):
+        self.virtual_time = 0.0
+        self._finish = {}
+
+    def key(self, entry, seq):
+        start = max(self.virtual_time, self._finish.get(entry['user_id'], 0.0))
+        finish = start + entry.get('cost', 0)
+        entry['virtual_start'] = start
+        self._finish[entry['user_id']] = finish
+        return finish
+
+    def on_dequeue(self, entry):
+        self.virtual_time = max(self.virtual_time, entry.get('virtual_start', 0.0))
+
+    def forget_user(self, user_id):
+        self._finish.pop(user_id, None)
+
+    def resume_user(self, user_id, last_key):
+        if last_key is None:
+            self._finish.pop(user_id, None)
+        else:
+            self._finish[user_id] = last_key
+
+
+def create_policy(name, aging_rate=1.0):
+    if name == 'fifo':
+        return FifoPolicy()
+    if name == 'sjf':
+        return ShortestJobFirstPolicy()
+    if name == 'aging':
+        return AgingPolicy(aging_rate)
+    if name == 'fair_share':
+        return FairSharePolicy()
+    raise ValueError(f"Unknown queue scheduling policy: {name}")
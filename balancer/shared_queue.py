@@ -0,0 +1,277 @@
+"""
+Pending queue shared by several balancer processes through the QueuedTask table.
+
+Each balancer claims rows with SELECT ... FOR UPDATE SKIP LOCKED, so two of them
+never take the same row, and leases what it claimed for lease_seconds. A row
+placed on a backend is deleted; one that could not be placed gets its lease
+cleared. A balancer that dies while sending just lets its leases run out and
+the rows become visible again; the retry is safe because backends deduplicate
+on the dispatch id.
+
+Quota checks take a per-user advisory lock, and positions are ranked in the
+table with one window query, so every balancer gives the same answers.
+
+The store is used from the balancer's handler and dispatch threads, outside
+Django's request cycle, so every operation first drops a connection that broke
+or outlived CONN_MAX_AGE, as request_started would.
+"""
+import os
+import socket
+import uuid
+from datetime import timedelta
+from functools import wraps
+from threading import Event, Lock
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from tasks.models import QueuedTask
+
+# first key of the two-key advisory locks that serialize one user's submissions
+USER_LOCK_NAMESPACE = 0x71756575
+
+
+def fresh_connection(method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        # inside a transaction the connection is in use and must not be closed
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+        return method(*args, **kwargs)
+    return wrapper
+
+
+def durable_now():
+    event = Event()
+    event.set()
+    return event
+
+
+class DatabaseQueueStore:
+    """Same interface as balancer.store.MemoryQueueStore."""
+
+    def __init__(self, policy, lease_seconds):
+        self.policy = policy
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._policy_lock = Lock()
+
+    def _visible(self):
+        return QueuedTask.objects.filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=timezone.now()))
+
+    def _ranked(self, user_id):
+        """
+        The user's visible rows in queue order, each with .position and
+        .cost_ahead among all visible rows by (priority, id), in a single query.
+        """
+        table = connection.ops.quote_name(QueuedTask._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        return list(QueuedTask.objects.raw(
+            f"""
+            SELECT * FROM (
+                SELECT {table}.*,
+                       ROW_NUMBER() OVER (ORDER BY priority, id) AS position,
+                       COALESCE(SUM(cost) OVER (
+                           ORDER BY priority, id ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                       ), 0) AS cost_ahead
+                FROM {table}
+                WHERE lease_expires_at IS NULL OR lease_expires_at <= %s
+            ) ranked
+            WHERE user_id = %s
+            ORDER BY position
+            """,
+            [now, user_id]
+        ))
+
+    def _summary(self):
+        """(queue_length, total_cost) of the visible rows."""
+        summary = self._visible().aggregate(length=Count('id'), total_cost=Sum('cost'))
+        return summary['length'], summary['total_cost'] or 0
+
+    def _entry(self, row):
+        return {
+            'id': row.id,
+            'dispatch_id': row.dispatch_id,
+            'user_id': row.user_id,
+            'number': row.number,
+            'cost': row.cost,
+            'body': bytes(row.body),
+            'headers': row.headers,
+            'queued_at': row.queued_at,
+            'priority': row.priority,
+            'virtual_start': row.virtual_start,
+        }
+
+    @fresh_connection
+    def __len__(self):
+        return self._visible().count()
+
+    def _aware(self, entry):
+        queued_at = entry['queued_at']
+        if timezone.is_naive(queued_at):
+            entry['queued_at'] = queued_at.astimezone()
+
+    def _lock_user(self, user_id):
+        """Serializes this user's submissions across balancers until the transaction ends."""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s::int, %s::int)', [USER_LOCK_NAMESPACE, user_id])
+        # SQLite has no row or advisory locks, but it lets only one transaction write
+        # at a time, so it takes no more than one balancer per database file anyway
+
+    def _prioritize(self, entries, user_rows):
+        head = self._visible().order_by('priority', 'id').values_list('virtual_start', flat=True).first()
+        last_key = user_rows.order_by('-priority').values_list('priority', flat=True).first()
+        with self._policy_lock:
+            if head is not None:
+                self.policy.on_dequeue({'virtual_start': head})
+            self.policy.resume_user(entries[0]['user_id'], last_key)
+            for entry in entries:
+                entry['priority'] = self.policy.key(entry, entry['queued_at'].timestamp())
+
+    def _row(self, entry):
+        return QueuedTask(
+            dispatch_id=entry['dispatch_id'],
+            user_id=entry['user_id'],
+            number=entry['number'],
+            body=entry['body'],
+            headers=entry['headers'],
+            cost=entry.get('cost', 0),
+            priority=entry['priority'],
+            virtual_start=entry.get('virtual_start', 0),
+            queued_at=entry['queued_at'],
+        )
+
+    @fresh_connection
+    def enqueue(self, entry, max_per_user):
+        self._aware(entry)
+
+        with transaction.atomic():
+            self._lock_user(entry['user_id'])
+
+            user_rows = self._visible().filter(user_id=entry['user_id'])
+            user_tasks = user_rows.count()
+            if user_tasks >= max_per_user:
+                return {'accepted': False, 'user_tasks': user_tasks}
+
+            self._prioritize([entry], user_rows)
+            row = self._row(entry)
+            row.save()
+            entry['id'] = row.id
+
+            ranked = next(ranked for ranked in self._ranked(entry['user_id']) if ranked.id == row.id)
+            return {
+                'accepted': True,
+                'user_tasks': user_tasks + 1,
+                'position': ranked.position,
+                'queue_length': self._summary()[0],
+                'cost_ahead': ranked.cost_ahead,
+                'durable': durable_now(),
+            }
+
+    @fresh_connection
+    def enqueue_many(self, entries, max_per_user):
+        for entry in entries:
+            self._aware(entry)
+
+        with transaction.atomic():
+            self._lock_user(entries[0]['user_id'])
+
+            user_rows = self._visible().filter(user_id=entries[0]['user_id'])
+            user_tasks = user_rows.count()
+            if user_tasks + len(entries) > max_per_user:
+                return {'accepted': False, 'user_tasks': user_tasks}
+
+            self._prioritize(entries, user_rows)
+            rows = QueuedTask.objects.bulk_create([self._row(entry) for entry in entries])
+            for entry, row in zip(entries, rows):
+                entry['id'] = row.id
+
+            ranked = {row.id: row for row in self._ranked(entries[0]['user_id'])}
+            return {
+                'accepted': True,
+                'user_tasks': user_tasks + len(entries),
+                'positions': [ranked[entry['id']].position for entry in entries],
+                'queue_length': self._summary()[0],
+                'costs_ahead': [ranked[entry['id']].cost_ahead for entry in entries],
+                'durable': durable_now(),
+            }
+
+    @fresh_connection
+    def discard(self, entries):
+        """Rows are committed on enqueue, so this is only reached if a caller gives up anyway."""
+        with transaction.atomic():
+            ids = list(QueuedTask.objects.select_for_update().filter(
+                dispatch_id__in=[entry['dispatch_id'] for entry in entries],
+                lease_owner__isnull=True
+            ).values_list('id', flat=True))
+            if len(ids) != len(entries):
+                return False
+            QueuedTask.objects.filter(id__in=ids).delete()
+            return True
+
+    def _lease(self, queryset):
+        with transaction.atomic():
+            rows = list(queryset.select_for_update(skip_locked=True))
+            QueuedTask.objects.filter(id__in=[row.id for row in rows]).update(
+                lease_owner=self.owner,
+                lease_expires_at=timezone.now() + timedelta(seconds=self.lease_seconds)
+            )
+        return [self._entry(row) for row in rows]
+
+    @fresh_connection
+    def claim(self, limit, skip_users=()):
+        if limit <= 0:
+            return []
+
+        entries = self._lease(self._visible().exclude(user_id__in=skip_users).order_by('priority', 'id')[:limit])
+        with self._policy_lock:
+            for entry in entries:
+                self.policy.on_dequeue(entry)
+        return entries
+
+    @fresh_connection
+    def claim_numbers(self, numbers, skip_users=()):
+        entries = self._lease(
+            self._visible().filter(number__in=numbers).exclude(user_id__in=skip_users).order_by('priority', 'id')
+        )
+        with self._policy_lock:
+            for entry in entries:
+                self.policy.on_dequeue(entry)
+        return entries
+
+    @fresh_connection
+    def requeue(self, entries):
+        QueuedTask.objects.filter(
+            dispatch_id__in=[entry['dispatch_id'] for entry in entries],
+            lease_owner=self.owner
+        ).update(lease_owner=None, lease_expires_at=None)
+
+    @fresh_connection
+    def complete(self, entry):
+        QueuedTask.objects.filter(dispatch_id=entry['dispatch_id']).delete()
+
+    @fresh_connection
+    def remove_user(self, user_id):
+        with transaction.atomic():
+            rows = list(
+                self._visible().filter(user_id=user_id).order_by('priority', 'id').select_for_update(skip_locked=True)
+            )
+            QueuedTask.objects.filter(id__in=[row.id for row in rows]).delete()
+        return [self._entry(row) for row in rows]
+
+    @fresh_connection
+    def status(self, user_id):
+        queue_length, total_cost = self._summary()
+        user_entries = []
+        if user_id is not None:
+            user_entries = [(self._entry(row), row.position, row.cost_ahead) for row in self._ranked(user_id)]
+        return queue_length, total_cost, user_entries
+
+    def restore(self, cost):
+        """The table is the journal: nothing to reload, rows leased by a dead balancer come back on expiry."""
+        return len(self)
+
+    def close(self):
+        pass
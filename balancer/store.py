@@ -0,0 +1,135 @@
+from threading import Lock
+
+
+class MemoryQueueStore:
+    """
+    The pending queue of a single balancer process: a TaskQueue guarded by one
+    lock, with every change recorded in the local QueueJournal.
+
+    Entries are dicts with 'dispatch_id', 'user_id', 'number', 'cost', 'body',
+    'headers' and 'queued_at'. The balancer talks to the queue only through the
+    methods below, which DatabaseQueueStore (balancer.shared_queue) implements
+    the same way for several balancer processes sharing one queue.
+    """
+
+    def __init__(self, queue, journal):
+        self.queue = queue
+        self.journal = journal
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.queue)
+
+    def enqueue(self, entry, max_per_user):
+        """
+        Appends entry unless its user already has max_per_user queued tasks.
+        Returns {'accepted', 'user_tasks'} plus, when accepted, 'position',
+        'queue_length', 'cost_ahead' and 'durable', whose wait(timeout) is True
+        once the entry survives a restart and False if recording it failed.
+        """
+        with self._lock:
+            user_tasks = self.queue.count_for_user(entry['user_id'])
+            if user_tasks >= max_per_user:
+                return {'accepted': False, 'user_tasks': user_tasks}
+
+            self.queue.append(entry)
+            return {
+                'accepted': True,
+                'user_tasks': user_tasks + 1,
+                'position': self.queue.position(entry),
+                'queue_length': len(self.queue),
+                'cost_ahead': self.queue.cost_ahead(entry),
+                'durable': self.journal.record_enqueue(entry),
+            }
+
+    def enqueue_many(self, entries, max_per_user):
+        """
+        All or nothing: appends every entry (all of one user) unless that would
+        take the user past max_per_user queued tasks. Returns {'accepted',
+        'user_tasks'} plus, when accepted, 'positions' and 'costs_ahead' in the
+        order of entries, 'queue_length' and one 'durable' for the batch.
+        """
+        with self._lock:
+            user_tasks = self.queue.count_for_user(entries[0]['user_id'])
+            if user_tasks + len(entries) > max_per_user:
+                return {'accepted': False, 'user_tasks': user_tasks}
+
+            for entry in entries:
+                self.queue.append(entry)
+            return {
+                'accepted': True,
+                'user_tasks': user_tasks + len(entries),
+                'positions': [self.queue.position(entry) for entry in entries],
+                'queue_length': len(self.queue),
+                'costs_ahead': [self.queue.cost_ahead(entry) for entry in entries],
+                'durable': self.journal.record_enqueue_many(entries),
+            }
+
+    def discard(self, entries):
+        """
+        Takes back entries that could not be made durable. Returns False, leaving
+        them all in place, when one was already claimed for dispatch.
+        """
+        with self._lock:
+            if any(entry['dispatch_id'] not in self.queue for entry in entries):
+                return False
+            for entry in entries:
+                self.queue.remove(entry['dispatch_id'])
+                self.journal.record_dequeue(entry['dispatch_id'])
+            return True
+
+    def claim(self, limit, skip_users=()):
+        """
+        Takes up to limit entries off the front of the queue for dispatch. The
+        entries of skip_users are passed over and keep their places.
+        """
+        with self._lock:
+            return self.queue.popleft_many(limit, skip_users)
+
+    def claim_numbers(self, numbers, skip_users=()):
+        """Takes every queued entry for one of numbers, wherever it is in the queue, except those of skip_users."""
+        with self._lock:
+            return [
+                self.queue.take(entry['dispatch_id'])
+                for number in numbers for entry in self.queue.entries_for_number(number)
+                if entry['user_id'] not in skip_users
+            ]
+
+    def requeue(self, entries):
+        """Puts back claimed entries that could not be placed, keeping their priority."""
+        with self._lock:
+            for entry in entries:
+                self.queue.requeue(entry)
+
+    def complete(self, entry):
+        """A claimed entry reached a backend and leaves the queue for good."""
+        self.journal.record_dequeue(entry['dispatch_id'])
+
+    def remove_user(self, user_id):
+        with self._lock:
+            removed = self.queue.remove_user(user_id)
+            for entry in removed:
+                self.journal.record_dequeue(entry['dispatch_id'])
+        return removed
+
+    def status(self, user_id):
+        """(queue_length, total_cost, [(entry, position, cost_ahead)] for the user's entries)"""
+        with self._lock:
+            user_entries = [
+                (entry, self.queue.position(entry), self.queue.cost_ahead(entry))
+                for entry in (self.queue.entries_for_user(user_id) if user_id is not None else [])
+            ]
+            return len(self.queue), self.queue.total_cost(), user_entries
+
+    def restore(self, cost):
+        """Reloads the journal after a restart; cost(number) re-estimates each entry."""
+        entries = self.journal.load()
+        with self._lock:
+            for entry in entries:
+                entry['cost'] = cost(entry['number'])
+                self.queue.append(entry)
+        return len(entries)
+
+    def close(self):
+        self.journal.close()
@@ -0,0 +1,989 @@
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from unittest.mock import patch
+
+import requests
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+import load_balancer
+from backend.metrics import Registry
+from balancer.estimator import WaitTimeEstimator
+from balancer.journal import QueueJournal
+from balancer.ledger import SlotLedger
+from balancer.queue import TaskQueue
+from balancer.registry import BackendRegistry, CircuitBreaker
+from balancer.scheduling import AgingPolicy, FairSharePolicy, FifoPolicy, ShortestJobFirstPolicy
+from balancer.store import MemoryQueueStore
+from balancer.upstream import UpstreamPool
+from load_balancer import DispatchDeferred, LoadBalancer, ThreadPoolHTTPServer, token_user_id
+
+WORKER = 'http://127.0.0.1:8001'
+
+
+def serve(server):
+    Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def queue_entry(user_id, number=10, cost=1.0):
+    return {
+        'dispatch_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'number': number,
+        'cost': cost,
+        'body': b'{"number": %d}' % number,
+        'headers': {'Authorization': f'Bearer token-{user_id}'},
+        'queued_at': timezone.now(),
+    }
+
+
+def bearer(user_id, token_class=AccessToken):
+    token = token_class()
+    token['user_id'] = user_id
+    return {'Authorization': f"Bearer {token}"}
+
+
+def memory_store(test, policy=None):
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    store = MemoryQueueStore(TaskQueue(policy), QueueJournal(os.path.join(directory, 'journal.sqlite3')))
+    test.addCleanup(store.close)
+    return store
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def start_balancer(test):
+    """Serves LoadBalancer on a free port for the test; returns its URL."""
+    server = ThreadPoolHTTPServer(('127.0.0.1', 0), LoadBalancer, max_workers=4, max_pending=4, max_streams=4)
+    test.addCleanup(stop, server)
+    return serve(server)
+
+
+class PortEchoHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive handler that answers with the client's port and sleeps for ?delay=
+    seconds; paths under /events are answered as text/event-stream.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if '?delay=' in self.path:
+            time.sleep(float(self.path.split('?delay=', 1)[1]))
+        body = str(self.client_address[1]).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if self.path.startswith('/events') else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadPoolHTTPServerTests(SimpleTestCase):
+    def test_workers_bound_concurrent_requests(self):
+        lock = Lock()
+        seen = {'active': 0, 'peak': 0}
+
+        class SlowHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with lock:
+                    seen['active'] += 1
+                    seen['peak'] = max(seen['peak'], seen['active'])
+                time.sleep(0.05)
+                with lock:
+                    seen['active'] -= 1
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        server = ThreadPoolHTTPServer(('127.0.0.1', 0), SlowHandler, max_workers=2, max_pending=1, max_streams=1)
+        url = serve(server)
+        self.addCleanup(stop, server)
+
+        with ThreadPoolExecutor(max_workers=8) as clients:
+            statuses = list(clients.map(lambda _: requests.get(url, timeout=5).status_code, range(8)))
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(seen['peak'], 2)
+
+    def test_streams_beyond_max_streams_are_refused(self):
+        server = ThreadPoolHTTPServer(('127.0.0.1', 0), BaseHTTPRequestHandler, max_workers=1, max_pending=0, max_streams=1)
+        self.addCleanup(server.server_close)
+        release = Event()
+        first, first_peer = socket.socketpair()
+        second, second_peer = socket.socketpair()
+        self.addCleanup(first_peer.close)
+        self.addCleanup(second_peer.close)
+        self.addCleanup(second.close)
+
+        self.assertTrue(server.start_stream(first, lambda request: release.wait(5)))
+        self.assertFalse(server.start_stream(second, lambda request: None))
+
+        release.set()
+        self.assertEqual(first_peer.recv(1), b'')
+
+
+class UpstreamPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PortEchoHandler)
+        self.server.daemon_threads = True
+        self.url = serve(self.server)
+        self.addCleanup(stop, self.server)
+
+    def pool(self, **kwargs):
+        options = {'pool_size': 4, 'max_per_host': 4, 'idle_timeout': 60}
+        options.update(kwargs)
+        pool = UpstreamPool(**options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_sequential_requests_reuse_one_connection(self):
+        pool = self.pool()
+
+        ports = {pool.get(self.url, '/', timeout=5).text for _ in range(5)}
+
+        self.assertEqual(len(ports), 1)
+
+    def test_max_per_host_limits_concurrent_requests(self):
+        pool = self.pool(max_per_host=1)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3) as clients:
+            list(clients.map(lambda _: pool.get(self.url, '/?delay=0.1', timeout=5), range(3)))
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    def test_streamed_response_holds_its_place_until_the_block_exits(self):
+        pool = self.pool(max_per_host=1)
+
+        with pool.stream('GET', self.url, '/', timeout=5) as response:
+            limit = pool._hosts[self.url].limit
+            self.assertFalse(limit.acquire(blocking=False))
+            response.content
+
+        self.assertTrue(limit.acquire(blocking=False))
+        limit.release()
+
+    def test_event_stream_does_not_count_against_max_per_host(self):
+        pool = self.pool(max_per_host=1)
+
+        with pool.stream('GET', self.url, '/events', timeout=5):
+            self.assertEqual(pool.get(self.url, '/', timeout=5).status_code, 200)
+
+    def test_idle_backend_is_closed(self):
+        pool = self.pool(idle_timeout=0)
+        first = pool.get(self.url, '/', timeout=5).text
+        time.sleep(0.01)
+
+        second = pool.get(self.url, '/', timeout=5).text
+
+        self.assertNotEqual(first, second)
+
+    def test_failures_and_latency_are_recorded_per_backend(self):
+        registry = Registry()
+        pool = self.pool(latency=registry.histogram('latency', 'latency'), errors=registry.counter('errors', 'errors'))
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            dead_url = f"http://127.0.0.1:{unused.getsockname()[1]}"
+
+        pool.get(self.url, '/', timeout=5)
+        with self.assertRaises(requests.ConnectionError):
+            pool.get(dead_url, '/', timeout=5)
+
+        rendered = registry.render()
+        self.assertIn(f'latency_count{{backend="{self.url}"}} 1', rendered)
+        self.assertIn(f'errors{{backend="{dead_url}"}} 1', rendered)
+
+
+class DispatchTests(SimpleTestCase):
+    def setUp(self):
+        self.store = memory_store(self, FifoPolicy())
+        self.ledger = SlotLedger([WORKER], capacity=1)
+        self.ledger.reconcile(WORKER, [], time.monotonic())
+        for name, value in (('task_queue', self.store), ('slot_ledger', self.ledger), ('deferred_users', {})):
+            patcher = patch.object(load_balancer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sends_run_outside_the_queue_lock(self):
+        release = Event()
+        first = queue_entry(1)
+        self.store.enqueue(first, max_per_user=8)
+
+        def blocked_send(server_url, task):
+            release.wait(5)
+            return True, {'id': 7, 'status': 'in_progress'}
+
+        with patch.object(load_balancer, 'send_task', blocked_send):
+            self.assertEqual(load_balancer.dispatch_cycle(), 1)
+            # the send is still in flight, yet the queue takes new tasks
+            self.assertTrue(self.store.enqueue(queue_entry(2, number=20), max_per_user=8)['accepted'])
+            release.set()
+            # the slot is confirmed under the backend's task id once the send settles
+            wait_for(lambda: self.ledger.release(7))
+
+        self.assertEqual(len(self.store), 1)
+
+    def test_failed_send_is_requeued_ahead_of_later_tasks(self):
+        first, second = queue_entry(1), queue_entry(2, number=20)
+        self.store.enqueue(first, max_per_user=8)
+        self.store.enqueue(second, max_per_user=8)
+        claimed = self.store.claim(1)
+        self.ledger.reserve([(first['dispatch_id'], first['number'])])
+
+        with patch.object(load_balancer, 'send_task', return_value=(False, None)):
+            load_balancer.send_and_settle(WORKER, claimed)
+
+        self.assertEqual([entry['dispatch_id'] for entry in self.store.claim(2)], [first['dispatch_id'], second['dispatch_id']])
+        self.assertFalse(self.ledger.snapshot()[WORKER]['reachable'])
+
+    def test_quota_refusal_leaves_the_task_queued_and_the_backend_up(self):
+        entry = queue_entry(1)
+        self.store.enqueue(entry, max_per_user=8)
+        claimed = self.store.claim(1)
+        self.ledger.reserve([(entry['dispatch_id'], entry['number'])])
+
+        with patch.object(load_balancer, 'send_task', side_effect=DispatchDeferred('quota')):
+            load_balancer.send_and_settle(WORKER, claimed)
+
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.ledger.free_slots(WORKER), 1)
+        self.assertTrue(self.ledger.snapshot()[WORKER]['reachable'])
+
+    def test_user_at_quota_does_not_hold_up_the_users_behind(self):
+        blocked = [queue_entry(1, number=1), queue_entry(1, number=2)]
+        waiting = queue_entry(2, number=3)
+        for entry in blocked + [waiting]:
+            self.store.enqueue(entry, max_per_user=8)
+        sent = []
+
+        def quota_send(server_url, task):
+            sent.append(task['number'])
+            if task['user_id'] == 1:
+                raise DispatchDeferred('quota')
+            return True, {'id': 7, 'status': 'in_progress'}
+
+        with patch.object(load_balancer, 'send_task', quota_send):
+            load_balancer.send_and_settle(WORKER, load_balancer.claim_tasks(1))
+            # user 1 keeps the front of the queue but is passed over
+            load_balancer.send_and_settle(WORKER, load_balancer.claim_tasks(1))
+            self.assertEqual(load_balancer.claim_tasks(1), [])
+
+            load_balancer.undefer_user(1)
+            self.assertEqual([entry['number'] for entry in load_balancer.claim_tasks(1)], [1])
+
+        self.assertEqual(sent, [1, 3])
+
+
+class ServerStatusHandler(BaseHTTPRequestHandler):
+    """
+    server-status stand-in reporting the tasks in .running, listed only for the
+    internal token; records each path it is asked for.
+    """
+    protocol_version = 'HTTP/1.1'
+    running = []
+    paths = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        ServerStatusHandler.paths.append(self.path)
+        data = {'in_progress_tasks': len(self.running)}
+        if self.path.endswith('?tasks=1'):
+            if self.headers.get('X-Internal-Token') != settings.INTERNAL_API_TOKEN:
+                self.send_response(403)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data['tasks'] = self.running
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HealthCheckTests(SimpleTestCase):
+    def setUp(self):
+        ServerStatusHandler.running = []
+        ServerStatusHandler.paths = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ServerStatusHandler)
+        server.daemon_threads = True
+        self.url = serve(server)
+        self.addCleanup(stop, server)
+
+        self.ledger = SlotLedger([self.url], capacity=2)
+        for name, value in (
+            ('backend_registry', BackendRegistry(self.url, [self.url], 3, 30)),
+            ('slot_ledger', self.ledger),
+        ):
+            patcher = patch.object(load_balancer, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_matching_count_skips_the_task_list(self):
+        load_balancer.reconcile_slots()
+
+        self.assertEqual(ServerStatusHandler.paths, ['/api/server-status/'])
+        self.assertEqual(self.ledger.free_slots(self.url), 2)
+
+    def test_mismatch_reconciles_from_the_task_list(self):
+        ServerStatusHandler.running = [[7, 10], [8, 10]]
+
+        load_balancer.reconcile_slots()
+
+        self.assertEqual(ServerStatusHandler.paths, ['/api/server-status/', '/api/server-status/?tasks=1'])
+        self.assertEqual(self.ledger.task_count(self.url), 2)
+        self.assertEqual(self.ledger.free_slots(self.url), 1)
+
+
+class SlotLedgerTests(SimpleTestCase):
+    def setUp(self):
+        self.ledger = SlotLedger([WORKER, 'http://127.0.0.1:8002'], capacity=2)
+
+    def reach(self, *server_urls):
+        for server_url in server_urls:
+            self.ledger.reconcile(server_url, [], time.monotonic())
+
+    def test_unreachable_backend_offers_no_slots(self):
+        self.reach(WORKER)
+
+        self.assertEqual(self.ledger.total_free_slots(), 2)
+        self.assertEqual(self.ledger.reserve([('a', 1), ('b', 2), ('c', 3)]), [('a', WORKER), ('b', WORKER)])
+
+    def test_reservations_spread_to_the_least_loaded_backend(self):
+        self.reach(WORKER, 'http://127.0.0.1:8002')
+
+        assignments = dict(self.ledger.reserve([('a', 1), ('b', 2)]))
+
+        self.assertEqual(set(assignments.values()), {WORKER, 'http://127.0.0.1:8002'})
+
+    def test_slot_is_held_from_reserve_until_release(self):
+        self.reach(WORKER)
+        self.ledger.reserve([('a', 1)])
+        self.assertEqual(self.ledger.free_slots(WORKER), 1)
+
+        self.ledger.confirm(WORKER, 'a', 7, 1)
+        self.assertEqual(self.ledger.free_slots(WORKER), 1)
+
+        self.assertTrue(self.ledger.release(7))
+        self.assertFalse(self.ledger.release(7))
+        self.assertEqual(self.ledger.free_slots(WORKER), 2)
+
+    def test_cancelled_reservation_frees_the_slot(self):
+        self.reach(WORKER)
+        self.ledger.reserve([('a', 1)])
+
+        self.ledger.cancel(WORKER, 'a')
+
+        self.assertEqual(self.ledger.free_slots(WORKER), 2)
+
+    def test_reconcile_replaces_stale_slots_with_the_backend_report(self):
+        self.reach(WORKER)
+        self.ledger.reserve([('a', 1), ('b', 2)])
+        self.ledger.confirm(WORKER, 'a', 7, 1)
+        probed_at = time.monotonic()
+
+        drift = self.ledger.reconcile(WORKER, [(8, 3)], probed_at)
+
+        # task 7 finished without a callback, 8 was unknown; the reservation is still being sent
+        self.assertEqual(drift, 2)
+        self.assertEqual(self.ledger.running_numbers(), {2, 3})
+        self.assertFalse(self.ledger.release(7))
+
+
+class SlotReleaseTests(SimpleTestCase):
+    def setUp(self):
+        self.ledger = SlotLedger([WORKER], capacity=2)
+        self.ledger.reconcile(WORKER, [], time.monotonic())
+        self.ledger.reserve([('a', 10)])
+        self.ledger.confirm(WORKER, 'a', 7, 10)
+        patcher = patch.object(load_balancer, 'slot_ledger', self.ledger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = start_balancer(self) + '/api/internal/slot-release/'
+
+    def release(self, token, duration=1.5, user_id=None):
+        headers = {'X-Internal-Token': token} if token is not None else {}
+        payload = {'task_id': 7, 'server_url': WORKER, 'status': 'completed', 'number': 10, 'duration': duration}
+        if user_id is not None:
+            payload['user_id'] = user_id
+        return requests.post(self.url, json=payload, headers=headers, timeout=5)
+
+    def test_release_without_the_internal_token_is_refused(self):
+        for token in (None, 'guess'):
+            self.assertEqual(self.release(token).status_code, 403)
+        self.assertEqual(self.ledger.free_slots(WORKER), 1)
+
+    def test_release_ends_the_users_quota_deferral(self):
+        with patch.object(load_balancer, 'deferred_users', {}):
+            load_balancer.defer_user(3)
+
+            self.release(settings.INTERNAL_API_TOKEN, user_id=3)
+
+            self.assertEqual(load_balancer.deferred_user_ids(), set())
+
+    def test_release_frees_the_slot_and_feeds_the_estimator(self):
+        with patch.object(load_balancer.wait_estimator, 'observe') as observe:
+            response = self.release(settings.INTERNAL_API_TOKEN)
+
+        self.assertEqual(response.json(), {'released': True})
+        self.assertEqual(self.ledger.free_slots(WORKER), 2)
+        observe.assert_called_once_with(10, 1.5)
+
+    def test_implausible_duration_is_not_observed(self):
+        with patch.object(load_balancer.wait_estimator, 'observe') as observe:
+            self.release(settings.INTERNAL_API_TOKEN, duration=-5)
+
+        observe.assert_not_called()
+
+
+class TaskQueueIndexTests(SimpleTestCase):
+    def test_per_user_count_follows_appends_and_pops(self):
+        queue = TaskQueue()
+        for user_id in (1, 2, 1):
+            queue.append(queue_entry(user_id))
+
+        self.assertEqual((queue.count_for_user(1), queue.count_for_user(2)), (2, 1))
+        queue.popleft()
+        self.assertEqual(queue.count_for_user(1), 1)
+        self.assertEqual(queue.count_for_user(3), 0)
+
+    def test_remove_user_leaves_other_users_in_order(self):
+        queue = TaskQueue()
+        for user_id in (1, 2, 1, 3):
+            queue.append(queue_entry(user_id))
+
+        removed = queue.remove_user(1)
+
+        self.assertEqual([entry['user_id'] for entry in removed], [1, 1])
+        self.assertEqual([queue.popleft()['user_id'] for _ in range(len(queue))], [2, 3])
+        self.assertEqual(queue.entries_for_user(1), [])
+
+    def test_claim_by_number_advances_the_fair_share_clock(self):
+        policy = FairSharePolicy()
+        store = memory_store(self, policy)
+        for number in (1, 2):
+            store.enqueue(queue_entry(1, number=number, cost=5.0), max_per_user=8)
+
+        store.claim_numbers({2})
+
+        self.assertEqual(policy.virtual_time, 5.0)
+
+
+class QueuePositionTests(SimpleTestCase):
+    def assert_positions_exact(self, queue):
+        ordered = sorted(queue, key=lambda entry: (entry['priority'], entry['seq']))
+        self.assertEqual(list(queue), ordered)
+        cost = 0
+        for position, entry in enumerate(ordered, 1):
+            self.assertEqual(queue.position(entry), position)
+            self.assertAlmostEqual(queue.cost_ahead(entry), cost)
+            cost += entry['cost']
+        self.assertAlmostEqual(queue.total_cost(), cost)
+
+    def test_positions_are_exact_under_every_policy(self):
+        rng = random.Random(15)
+        for policy in [FifoPolicy(), ShortestJobFirstPolicy(), AgingPolicy(rate=0.5), FairSharePolicy()]:
+            queue = TaskQueue(policy)
+            for i in range(200):
+                entry = queue_entry(rng.randint(1, 5), number=rng.randint(1, 50), cost=rng.random() * 3)
+                entry['queued_at'] = timezone.now() + timedelta(seconds=rng.random())
+                queue.append(entry)
+                if i % 7 == 0:
+                    queue.popleft()
+                if i % 11 == 5:
+                    queue.remove(rng.choice(list(queue))['dispatch_id'])
+            queue.remove_user(3)
+
+            self.assert_positions_exact(queue)
+
+    def test_requeued_entry_gets_its_place_back(self):
+        queue = TaskQueue(ShortestJobFirstPolicy())
+        for number in (30, 10, 20):
+            queue.append(queue_entry(1, number=number))
+
+        first = queue.popleft()
+        queue.requeue(first)
+
+        self.assertEqual([entry['number'] for entry in queue], [10, 20, 30])
+        self.assertEqual(queue.position(first), 1)
+
+
+class TokenTests(SimpleTestCase):
+    def test_valid_access_token(self):
+        self.assertEqual(token_user_id(bearer(5)), 5)
+
+    def test_forged_or_wrong_tokens_have_no_user(self):
+        header, _, signature = bearer(5)['Authorization'].split('.')
+        payload = bearer(6)['Authorization'].split('.')[1]
+        forged = f"{header}.{payload}.{signature}"
+
+        expired = AccessToken()
+        expired['user_id'] = 5
+        expired.set_exp(from_time=timezone.now() - timedelta(days=1))
+
+        for headers in (
+            {'Authorization': forged},
+            {'Authorization': f"Bearer {expired}"},
+            bearer(5, RefreshToken),
+            {'Authorization': 'Basic dXNlcjpwYXNz'},
+            {},
+        ):
+            self.assertIsNone(token_user_id(headers), headers)
+
+
+class TaskAdmissionTests(SimpleTestCase):
+    def setUp(self):
+        self.store = memory_store(self, FifoPolicy())
+        for patcher in (
+            patch.object(load_balancer, 'task_queue', self.store),
+            patch.object(LoadBalancer, 'forward_cached_task', return_value=False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = start_balancer(self)
+
+    def test_task_without_a_valid_token_is_refused(self):
+        response = requests.post(f"{self.url}/api/tasks/", json={'number': 5, 'user_id': 1}, timeout=5)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(self.store), 0)
+
+    def test_quota_is_counted_for_the_token_user_not_the_body(self):
+        response = requests.post(
+            f"{self.url}/api/tasks/", json={'number': 5, 'user_id': 99}, headers=bearer(5), timeout=5
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.store.queue.count_for_user(5), 1)
+        self.assertEqual(self.store.queue.count_for_user(99), 0)
+
+
+class QueueJournalTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'journal.sqlite3')
+
+    def journal(self, path=None):
+        journal = QueueJournal(path or self.path)
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_load_returns_undispatched_entries_in_acceptance_order(self):
+        journal = self.journal()
+        entries = [queue_entry(user_id) for user_id in (1, 2, 3)]
+        journal.record_enqueue_many(entries[:2])
+        journal.record_enqueue(entries[2])
+        self.assertTrue(journal.record_dequeue(entries[1]['dispatch_id']).wait(5))
+        journal.close()
+
+        loaded = QueueJournal(self.path).load()
+
+        self.assertEqual([entry['dispatch_id'] for entry in loaded], [entries[0]['dispatch_id'], entries[2]['dispatch_id']])
+        self.assertEqual(loaded[0]['body'], entries[0]['body'])
+        self.assertEqual(loaded[0]['queued_at'], entries[0]['queued_at'])
+
+    def test_journal_files_are_private(self):
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644))
+        journal = self.journal()
+
+        self.assertTrue(journal.record_enqueue(queue_entry(1)).wait(5))
+
+        for path in (self.path, self.path + '-wal'):
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600, path)
+
+    def test_failed_write_is_reported(self):
+        # a directory cannot be opened as a database
+        journal = self.journal(self.directory)
+
+        self.assertFalse(journal.record_enqueue(queue_entry(1)).wait(5))
+
+
+class JournalFailureTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.store = MemoryQueueStore(TaskQueue(FifoPolicy()), QueueJournal(directory))
+        self.addCleanup(self.store.close)
+        for patcher in (
+            patch.object(load_balancer, 'task_queue', self.store),
+            patch.object(LoadBalancer, 'forward_cached_task', return_value=False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = start_balancer(self)
+
+    def test_task_that_could_not_be_journaled_is_refused(self):
+        response = requests.post(f"{self.url}/api/tasks/", json={'number': 5}, headers=bearer(5), timeout=10)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.store), 0)
+
+    def test_batch_that_could_not_be_journaled_is_refused(self):
+        response = requests.post(f"{self.url}/api/tasks/bulk/", json={'numbers': [5, 6]}, headers=bearer(5), timeout=10)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.store), 0)
+
+    def test_claimed_entry_is_not_discarded(self):
+        entry = queue_entry(1)
+        self.store.enqueue(entry, max_per_user=8)
+        self.store.claim(1)
+
+        self.assertFalse(self.store.discard([entry]))
+
+
+class DispatchCycleTests(SimpleTestCase):
+    def setUp(self):
+        self.store = memory_store(self, FifoPolicy())
+        self.ledger = SlotLedger([WORKER, 'http://127.0.0.1:8002'], capacity=2)
+        for server_url in (WORKER, 'http://127.0.0.1:8002'):
+            self.ledger.reconcile(server_url, [], time.monotonic())
+        self.sent = []
+        self.sent_lock = Lock()
+
+        def record_send(server_url, tasks):
+            with self.sent_lock:
+                self.sent.append((server_url, [task['number'] for task in tasks]))
+
+        for patcher in (
+            patch.object(load_balancer, 'task_queue', self.store),
+            patch.object(load_balancer, 'slot_ledger', self.ledger),
+            patch.object(load_balancer, 'send_and_settle', record_send),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_cycle_fills_every_free_slot(self):
+        for user_id, number in ((1, 1), (1, 2), (2, 3), (2, 4), (3, 5)):
+            self.store.enqueue(queue_entry(user_id, number=number), max_per_user=8)
+
+        self.assertEqual(load_balancer.dispatch_cycle(), 4)
+
+        wait_for(lambda: sum(len(numbers) for _, numbers in self.sent) == 4)
+        self.assertEqual(self.ledger.total_free_slots(), 0)
+        self.assertEqual([entry['number'] for entry in self.store.claim(5)], [5])
+
+    def test_tasks_under_different_tokens_are_sent_apart(self):
+        first, second = queue_entry(1, number=1), queue_entry(1, number=2)
+        # the user id in the body says nothing: only the token the task came with counts
+        second['headers'] = {'authorization': 'Bearer token-2'}
+        for entry in (first, second):
+            self.store.enqueue(entry, max_per_user=8)
+        self.ledger.set_servers([WORKER])
+
+        load_balancer.dispatch_cycle()
+
+        wait_for(lambda: len(self.sent) == 2)
+        self.assertCountEqual([numbers for _, numbers in self.sent], [[1], [2]])
+
+    def test_tasks_of_one_user_for_one_backend_share_a_request(self):
+        for number in (1, 2, 3, 4):
+            self.store.enqueue(queue_entry(1, number=number), max_per_user=8)
+
+        load_balancer.dispatch_cycle()
+
+        wait_for(lambda: len(self.sent) == 2)
+        self.assertCountEqual([len(numbers) for _, numbers in self.sent], [2, 2])
+        self.assertEqual({server_url for server_url, _ in self.sent}, {WORKER, 'http://127.0.0.1:8002'})
+
+
+class StreamRecorder(BaseHTTPRequestHandler):
+    """Main-server stand-in that records each request's path and Authorization header and sends one event."""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        StreamRecorder.requests.append((self.path, self.headers.get('Authorization')))
+        body = b'event: tasks\ndata: {}\n\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StreamTokenTests(SimpleTestCase):
+    def setUp(self):
+        StreamRecorder.requests = []
+        main = ThreadingHTTPServer(('127.0.0.1', 0), StreamRecorder)
+        main.daemon_threads = True
+        main_url = serve(main)
+        self.addCleanup(stop, main)
+        patcher = patch.object(load_balancer, 'backend_registry', BackendRegistry(main_url, [], 3, 30))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = start_balancer(self)
+
+    def test_token_is_forwarded_as_a_header(self):
+        response = requests.get(f"{self.url}/api/tasks/stream/?token=secret-token&since=5", timeout=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'event: tasks\ndata: {}\n\n')
+        self.assertEqual(StreamRecorder.requests, [('/api/tasks/stream/?since=5', 'Bearer secret-token')])
+
+    def test_query_string_stays_out_of_the_log(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as log:
+            requests.get(f"{self.url}/api/queue-status/?token=secret-token", timeout=5)
+
+        self.assertIn('"GET /api/queue-status/ HTTP/1.1" 200', log.getvalue())
+        self.assertNotIn('secret-token', log.getvalue())
+
+
+class WaitTimeEstimatorTests(SimpleTestCase):
+    def test_costs_are_learned_per_bucket(self):
+        estimator = WaitTimeEstimator(default_cost=5.0, alpha=0.5)
+        self.assertEqual(estimator.cost(100), 5.0)
+
+        estimator.load({'7': {'count': 3, 'avg_seconds': 4.0}, '3': {'count': 0, 'avg_seconds': 0}})
+        estimator.observe(100, 8.0)
+
+        self.assertEqual(estimator.cost(100), 6.0)
+        # no data for the bucket of 5: the nearest one is borrowed
+        self.assertEqual(estimator.cost(5), 6.0)
+
+    def test_wait_spreads_queued_and_running_work_over_slots(self):
+        estimator = WaitTimeEstimator(default_cost=10.0)
+        started = time.monotonic() - 4
+
+        self.assertEqual(estimator.wait_seconds(0, [(100, started)], total_slots=2), 0.0)
+        self.assertAlmostEqual(estimator.wait_seconds(20, [(100, started)], total_slots=2), 13.0, places=1)
+        self.assertEqual(estimator.wait_seconds(20, [], total_slots=0), 20.0)
+
+
+class BalancerMetricsTests(SimpleTestCase):
+    def test_metrics_are_served(self):
+        url = start_balancer(self)
+
+        response = requests.get(f"{url}/metrics", timeout=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE lb_tasks_enqueued_total counter', response.text)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = patch('balancer.registry.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=2, open_seconds=10)
+
+    def open_breaker(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.record_failure())
+        self.clock.now += 10
+
+    def test_threshold_opens_for_open_seconds(self):
+        self.assertFalse(self.breaker.record_failure())
+        self.assertTrue(self.breaker.record_failure())
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.now += 10
+        self.assertEqual(self.breaker.state, 'half_open')
+
+    def test_half_open_lets_one_probe_through(self):
+        self.open_breaker()
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.breaker.allow()
+
+        self.assertTrue(self.breaker.record_failure())
+
+        self.clock.now += 9
+        self.assertFalse(self.breaker.allow())
+
+    def test_lost_probe_is_given_up_after_open_seconds(self):
+        self.open_breaker()
+        self.breaker.allow()
+
+        self.clock.now += 10
+
+        self.assertTrue(self.breaker.allow())
+
+
+class BreakerFeedTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = BackendRegistry('http://127.0.0.1:8000', [WORKER], failure_threshold=1, open_seconds=30)
+        patcher = patch.object(load_balancer, 'backend_registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self, base_url, error, **kwargs):
+        with patch.object(load_balancer.upstream, 'request', side_effect=error):
+            with self.assertRaises(type(error)):
+                load_balancer.backend_request('GET', base_url, '/api/tasks/', **kwargs)
+
+    def test_slow_read_on_the_main_server_does_not_open_it(self):
+        self.fail('http://127.0.0.1:8000', requests.ReadTimeout())
+
+        self.assertEqual(self.registry.get('http://127.0.0.1:8000').breaker.state, 'closed')
+
+    def test_connection_errors_and_failed_health_checks_open_it(self):
+        self.fail('http://127.0.0.1:8000', requests.ConnectionError())
+        self.assertEqual(self.registry.get('http://127.0.0.1:8000').breaker.state, 'open')
+
+        self.fail(WORKER, requests.ReadTimeout(), health_check=True)
+        self.assertEqual(self.registry.get(WORKER).breaker.state, 'open')
+
+
+class BackendRegistryTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        self.config_file = os.path.join(work_dir, 'backends.json')
+        self.write({'main': 'http://127.0.0.1:8000', 'workers': [WORKER, 'http://127.0.0.1:8002']})
+        self.registry = BackendRegistry(None, [], 3, 30, config_file=self.config_file)
+
+    def write(self, config):
+        with open(self.config_file, 'w', encoding='utf-8') as f:
+            f.write(config if isinstance(config, str) else json.dumps(config))
+        # a new mtime even on filesystems with coarse timestamps
+        stat = os.stat(self.config_file)
+        os.utime(self.config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_reload_applies_a_changed_file_and_keeps_breakers(self):
+        breaker = self.registry.get(WORKER).breaker
+        self.write({'main': 'http://127.0.0.1:8000', 'workers': [WORKER + '/', 'http://127.0.0.1:8003']})
+
+        added, removed = self.registry.reload()
+
+        self.assertEqual((added, removed), (['http://127.0.0.1:8003'], ['http://127.0.0.1:8002']))
+        self.assertIs(self.registry.get(WORKER).breaker, breaker)
+        self.assertEqual(self.registry.reload(), ([], []))
+
+    def test_invalid_file_keeps_the_previous_backends(self):
+        self.write({'main': 'http://127.0.0.1:8000'})
+
+        with self.assertRaises(ValueError):
+            self.registry.reload()
+
+        self.assertEqual(self.registry.worker_urls(), [WORKER, 'http://127.0.0.1:8002'])
+
+
+class ProxyTargetHandler(BaseHTTPRequestHandler):
+    """
+    Main-server stand-in: POST echoes what arrived (body size and headers) as a
+    gzipped JSON body; GET answers in chunks without a Content-Length.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        echo = gzip.compress(json.dumps({
+            'received': len(body),
+            'intact': body == b'x' * len(body),
+            'headers': {key.lower(): value for key, value in self.headers.items()},
+        }).encode('utf-8'))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(echo)))
+        self.end_headers()
+        self.wfile.write(echo)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for part in (b'first,', b'second,', b'third'):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(part), part))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class StreamingProxyTests(SimpleTestCase):
+    def setUp(self):
+        main = ThreadingHTTPServer(('127.0.0.1', 0), ProxyTargetHandler)
+        main.daemon_threads = True
+        main_url = serve(main)
+        self.addCleanup(stop, main)
+        patcher = patch.object(load_balancer, 'backend_registry', BackendRegistry(main_url, [], 3, 30))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = start_balancer(self)
+
+    def test_request_body_is_streamed_and_encoding_passed_through(self):
+        body = b'x' * (3 * settings.PROXY_CHUNK_SIZE + 17)
+
+        response = requests.post(
+            f"{self.url}/api/auth/login/",
+            data=body,
+            headers={'Accept-Encoding': 'gzip', 'Keep-Alive': 'timeout=5', 'Content-Type': 'application/json'},
+            stream=True,
+            timeout=5
+        )
+        raw = response.raw.read(decode_content=False)
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        echo = json.loads(gzip.decompress(raw))
+        self.assertEqual((echo['received'], echo['intact']), (len(body), True))
+        self.assertEqual(echo['headers']['content-length'], str(len(body)))
+        self.assertNotIn('transfer-encoding', echo['headers'])
+        self.assertNotIn('keep-alive', echo['headers'])
+
+    def test_chunked_response_is_relayed_until_the_end(self):
+        response = requests.get(f"{self.url}/api/tasks/1/progress/", timeout=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'first,second,third')
+        self.assertNotIn('Transfer-Encoding', response.headers)
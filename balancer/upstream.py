@@ -0,0 +1,152 @@
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RequestBody:
+    """
+    A client's request body of known length, read from rfile chunk_size bytes at
+    a time while it is being sent upstream. Having a length makes requests send
+    it with Content-Length rather than chunked.
+    """
+
+    def __init__(self, rfile, length, chunk_size):
+        self.rfile = rfile
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.rfile.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class UpstreamHost:
+    def __init__(self, pool_size, max_connections):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limit = BoundedSemaphore(max_connections)
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+
+
+class UpstreamPool:
+    """
+    Keep-alive connection pools, one requests.Session per backend origin.
+
+    pool_size       - idle connections kept open for reuse per backend
+    max_per_host    - hard limit of concurrent requests to one backend
+    idle_timeout    - a backend unused for this long has its connections closed
+    latency, errors - optional histogram and counter, labelled by backend
+    """
+
+    def __init__(self, pool_size, max_per_host, idle_timeout, latency=None, errors=None):
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.latency = latency
+        self.errors = errors
+        self._hosts = {}
+        self._lock = Lock()
+
+    def _checkout(self, base_url):
+        now = time.monotonic()
+
+        with self._lock:
+            self._close_idle(now)
+
+            host = self._hosts.get(base_url)
+            if host is None:
+                host = UpstreamHost(self.pool_size, self.max_per_host)
+                self._hosts[base_url] = host
+
+            host.in_flight += 1
+            host.last_used = now
+            return host
+
+    def _checkin(self, host):
+        with self._lock:
+            host.in_flight -= 1
+            host.last_used = time.monotonic()
+
+    def _close_idle(self, now):
+        for base_url, host in list(self._hosts.items()):
+            if host.in_flight == 0 and now - host.last_used > self.idle_timeout:
+                host.session.close()
+                del self._hosts[base_url]
+
+    def request(self, method, base_url, path, **kwargs):
+        host = self._checkout(base_url)
+        started = time.perf_counter()
+        try:
+            with host.limit:
+                return host.session.request(method, base_url + path, **kwargs)
+        except requests.RequestException:
+            if self.errors is not None:
+                self.errors.inc(backend=base_url)
+            raise
+        finally:
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started, backend=base_url)
+            self._checkin(host)
+
+    @contextmanager
+    def stream(self, method, base_url, path, **kwargs):
+        """
+        Streaming request (a proxied response, Server-Sent Events). The backend
+        stays checked out until the block exits and the request counts against
+        max_per_host while its body is being read; only a text/event-stream
+        response gives its place back once the headers arrive, so open streams
+        cannot starve regular requests. Latency is measured up to the response
+        headers.
+        """
+        host = self._checkout(base_url)
+        response = None
+        limited = False
+        started = time.perf_counter()
+        try:
+            host.limit.acquire()
+            limited = True
+            try:
+                response = host.session.request(method, base_url + path, stream=True, **kwargs)
+            except requests.RequestException:
+                if self.errors is not None:
+                    self.errors.inc(backend=base_url)
+                raise
+            finally:
+                if self.latency is not None:
+                    self.latency.observe(time.perf_counter() - started, backend=base_url)
+            if response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                host.limit.release()
+                limited = False
+            yield response
+        finally:
+            if response is not None:
+                response.close()
+            if limited:
+                host.limit.release()
+            self._checkin(host)
+
+    def get(self, base_url, path, **kwargs):
+        return self.request('GET', base_url, path, **kwargs)
+
+    def post(self, base_url, path, **kwargs):
+        return self.request('POST', base_url, path, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for host in self._hosts.values():
+                host.session.close()
+            self._hosts.clear()
@@ -0,0 +1,298 @@
+"""
+Benchmark for the load balancer against stand-in backends.
+
+    python -m benchmarks.run --workload smoke
+    python -m benchmarks.run --workload mixed --save benchmarks/baselines/mixed.json
+    python -m benchmarks.run --workload mixed --compare benchmarks/baselines/mixed.json
+
+Starts StubCluster with a main server on port 8000 and worker_servers workers
+on the ports after it, and load_balancer.py itself on port 3000 with those
+backends passed through BACKEND_REGISTRY_FILE, then replays the workload through
+the balancer: every simulated user submits its tasks, polls its active tasks
+and queue status until everything it submitted has finished, and cancels some
+running tasks on the way. Reports p50/p95/p99 latency per operation, accepted
+submissions per second and the time until the queue is drained.
+
+--compare exits with status 1 when p95/p99 latency or drain time got worse, or
+throughput got lower, by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+
+from .stub_backend import StubCluster, access_token
+from .workloads import WORKLOADS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BALANCER_URL = 'http://127.0.0.1:3000'
+MAIN_PORT = 8000
+MAX_TASKS_PER_SERVER = 2
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.counters = {}
+
+    def record(self, operation, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        operations = {}
+        for operation, values in self.latencies.items():
+            values = sorted(values)
+            operations[operation] = {
+                'count': len(values),
+                'errors': self.errors.get(operation, 0),
+                'mean_ms': round(sum(values) / len(values) * 1000, 2),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            }
+        return operations
+
+
+def timed(recorder, operation, session, method, path, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, f"{BALANCER_URL}{path}", timeout=30, **kwargs)
+    except requests.RequestException:
+        recorder.record(operation, time.perf_counter() - started, ok=False)
+        return None
+    recorder.record(operation, time.perf_counter() - started, ok=response.status_code < 500)
+    return response
+
+
+def run_user(user_id, workload, recorder, deadline, rng, signing_key):
+    session = requests.Session()
+    session.headers['Authorization'] = f"Bearer {access_token(user_id, signing_key)}"
+    submitted_at = time.monotonic()
+
+    for _ in range(workload['tasks_per_user']):
+        response = timed(recorder, 'submit', session, 'POST', '/api/tasks/', json={'number': rng.choice(workload['numbers'])})
+        recorder.count('submitted')
+        if response is not None and response.status_code in (201, 202):
+            recorder.count('accepted')
+        elif response is not None and response.status_code == 429:
+            recorder.count('rejected')
+        if workload['submit_interval']:
+            time.sleep(workload['submit_interval'])
+
+    submit_seconds = time.monotonic() - submitted_at
+    considered = set()
+
+    while time.monotonic() < deadline:
+        active = timed(recorder, 'active', session, 'GET', '/api/tasks/active/')
+        queue = timed(recorder, 'queue_status', session, 'GET', '/api/queue-status/')
+        active_tasks = active.json()['results'] if active is not None and active.status_code == 200 else []
+        queued = queue.json().get('user_queued', []) if queue is not None and queue.status_code == 200 else []
+
+        for task in active_tasks:
+            if task['id'] in considered:
+                continue
+            considered.add(task['id'])
+            if rng.random() < workload['cancel_probability']:
+                timed(recorder, 'cancel', session, 'POST', f"/api/tasks/{task['id']}/cancel/")
+
+        if active_tasks:
+            timed(recorder, 'progress', session, 'GET', f"/api/tasks/{active_tasks[0]['id']}/progress/")
+
+        if active is not None and queue is not None and not active_tasks and not queued:
+            return submit_seconds, time.monotonic()
+        time.sleep(workload['poll_interval'])
+
+    recorder.count('timed_out_users')
+    return submit_seconds, time.monotonic()
+
+
+def start_balancer(work_dir, ports, internal_token, signing_key):
+    registry_file = os.path.join(work_dir, 'backends.json')
+    with open(registry_file, 'w') as f:
+        json.dump({
+            'main': f"http://127.0.0.1:{ports[0]}",
+            'workers': [f"http://127.0.0.1:{port}" for port in ports[1:]],
+        }, f)
+
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    env['BENCHMARK_JOURNAL_PATH'] = os.path.join(work_dir, 'queue_journal.sqlite3')
+    env['BACKEND_REGISTRY_FILE'] = registry_file
+    env['INTERNAL_API_TOKEN'] = internal_token
+    env['BENCHMARK_SECRET_KEY'] = signing_key
+    env['PYTHONPATH'] = PROJECT_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    log = open(os.path.join(work_dir, 'load_balancer.log'), 'wb')
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(PROJECT_ROOT, 'load_balancer.py')],
+        cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"load_balancer.py exited, see {log.name}")
+        try:
+            requests.get(f"{BALANCER_URL}/api/queue-status/", timeout=1)
+            return process, log
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f"load_balancer.py did not start, see {log.name}")
+
+
+def run_workload(name, workload):
+    rng = random.Random(workload['seed'])
+    recorder = Recorder()
+    ports = [MAIN_PORT + i for i in range(workload['worker_servers'] + 1)]
+    internal_token = secrets.token_hex(16)
+    signing_key = secrets.token_hex(32)
+    cluster = StubCluster(
+        ports, BALANCER_URL, MAX_TASKS_PER_SERVER,
+        workload['base_seconds'], workload['seconds_per_number'], internal_token
+    )
+    work_dir = tempfile.mkdtemp(prefix='lb-benchmark-')
+    cluster.start()
+
+    try:
+        balancer, log = start_balancer(work_dir, ports, internal_token, signing_key)
+        try:
+            started = time.monotonic()
+            deadline = started + workload['max_duration']
+            user_rngs = [random.Random(rng.random()) for _ in range(workload['users'])]
+
+            with ThreadPoolExecutor(max_workers=workload['users']) as executor:
+                futures = [
+                    executor.submit(run_user, user_id, workload, recorder, deadline, user_rngs[user_id - 1], signing_key)
+                    for user_id in range(1, workload['users'] + 1)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            balancer.terminate()
+            balancer.wait(timeout=10)
+            log.close()
+    finally:
+        cluster.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    submit_seconds = max(seconds for seconds, _ in results)
+    drain_seconds = max(finished for _, finished in results) - started
+    accepted = recorder.counters.get('accepted', 0)
+
+    return {
+        'workload': name,
+        'config': workload,
+        'operations': recorder.summary(),
+        'submitted': recorder.counters.get('submitted', 0),
+        'accepted': accepted,
+        'rejected': recorder.counters.get('rejected', 0),
+        'accepted_per_second': round(accepted / submit_seconds, 2) if submit_seconds else None,
+        'drain_seconds': round(drain_seconds, 2),
+        'completed': cluster.finished['completed'],
+        'cancelled': cluster.finished['cancelled'],
+        'timed_out_users': recorder.counters.get('timed_out_users', 0),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns a list of human-readable regressions of result against baseline."""
+    regressions = []
+
+    def check(label, current, previous, higher_is_better=False):
+        if current is None or not previous:
+            return
+        change = (current - previous) / previous
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{label}: {previous} -> {current} ({change:+.0%})")
+
+    for operation, stats in result['operations'].items():
+        previous = baseline.get('operations', {}).get(operation)
+        if previous:
+            check(f"{operation} p95_ms", stats['p95_ms'], previous['p95_ms'])
+            check(f"{operation} p99_ms", stats['p99_ms'], previous['p99_ms'])
+    check('drain_seconds', result['drain_seconds'], baseline.get('drain_seconds'))
+    check('accepted_per_second', result['accepted_per_second'], baseline.get('accepted_per_second'), higher_is_better=True)
+    return regressions
+
+
+def print_report(result):
+    print(f"\nWorkload: {result['workload']}")
+    print(f"{'operation':<14}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation, stats in sorted(result['operations'].items()):
+        print(
+            f"{operation:<14}{stats['count']:>8}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        )
+    print(f"\nSubmitted: {result['submitted']}, accepted: {result['accepted']}, rejected: {result['rejected']}")
+    print(f"Accepted per second: {result['accepted_per_second']}")
+    print(f"Queue drained in: {result['drain_seconds']} s")
+    print(f"Completed: {result['completed']}, cancelled: {result['cancelled']}")
+    if result['timed_out_users']:
+        print(f"Users still waiting at max_duration: {result['timed_out_users']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workload', default='smoke', choices=sorted(WORKLOADS))
+    parser.add_argument('--workload-file', help='JSON file overriding the workload settings')
+    parser.add_argument('--save', help='write the result as a baseline JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default 0.2)')
+    args = parser.parse_args()
+
+    workload = dict(WORKLOADS['smoke'])
+    workload.update(WORKLOADS[args.workload])
+    name = args.workload
+    if args.workload_file:
+        with open(args.workload_file) as f:
+            workload.update(json.load(f))
+        name = os.path.splitext(os.path.basename(args.workload_file))[0]
+
+    result = run_workload(name, workload)
+    print_report(result)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
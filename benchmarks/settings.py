@@ -0,0 +1,16 @@
+# Settings for the load balancer process started by benchmarks.run: the real
+# settings with a throwaway queue journal, faster slot reconciliation, no
+# database server (the queue is kept in memory) and the key the benchmark
+# signs its users' access tokens with.
+import os
+import tempfile
+
+from backend.settings import *  # noqa: F401,F403
+
+QUEUE_JOURNAL_PATH = os.environ.get(
+    'BENCHMARK_JOURNAL_PATH',
+    os.path.join(tempfile.gettempdir(), 'benchmark_queue_journal.sqlite3')
+)
+BACKEND_HEALTH_CHECK_INTERVAL = 2
+SECRET_KEY = os.environ.get('BENCHMARK_SECRET_KEY', SECRET_KEY)  # noqa: F405
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
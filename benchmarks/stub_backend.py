@@ -0,0 +1,294 @@
+"""
+Stand-in backends for benchmarking the load balancer without Django or a database.
+
+One StubCluster serves several ports from the same process and shares one task
+store between them, the way the real backends share one database: a task
+created on a worker port can be polled and cancelled through the main port.
+Tasks "run" for a simulated time and are reported to the balancer through the
+same slot-release callback the real workers use. Like the real executor, a task
+for a number already running on the same port shares that computation: it
+finishes with it and takes no slot of its own.
+"""
+import base64
+import heapq
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Condition, Thread
+
+import jwt
+import requests
+
+TASK_PATH = re.compile(r'^/api/tasks/(\d+)/(progress|cancel)/$')
+
+
+def token_user_id(authorization):
+    """The stubs trust the token: the balancer in front of them has verified it."""
+    try:
+        payload = authorization.split(' ', 1)[1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get('user_id')
+    except Exception:
+        return None
+
+
+def access_token(user_id, signing_key):
+    """An access token as simplejwt issues it, signed with the balancer's SECRET_KEY."""
+    now = int(time.time())
+    return jwt.encode({
+        'token_type': 'access',
+        'exp': now + 3600,
+        'iat': now,
+        'jti': uuid.uuid4().hex,
+        'user_id': user_id,
+    }, signing_key, algorithm='HS256')
+
+
+class StubCluster:
+    def __init__(self, ports, balancer_url, max_tasks_per_server, base_seconds, seconds_per_number, internal_token):
+        self.ports = ports
+        self.balancer_url = balancer_url
+        self.internal_token = internal_token
+        self.max_tasks_per_server = max_tasks_per_server
+        self.base_seconds = base_seconds
+        self.seconds_per_number = seconds_per_number
+
+        self.tasks = {}
+        self.by_dispatch_id = {}
+        self.finished = {'completed': 0, 'cancelled': 0}
+        self._ids = count(1)
+        self._deadlines = []
+        self._cond = Condition()
+        self._servers = []
+        self._running = False
+        self._session = requests.Session()
+
+    def start(self):
+        self._running = True
+        for port in self.ports:
+            server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class(port))
+            server.daemon_threads = True
+            self._servers.append(server)
+            Thread(target=server.serve_forever, daemon=True).start()
+        Thread(target=self._finisher, daemon=True).start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def in_progress_count(self):
+        with self._cond:
+            return sum(1 for task in self.tasks.values() if task['status'] == 'in_progress')
+
+    def create_task(self, server_url, user_id, number, dispatch_id):
+        with self._cond:
+            if dispatch_id and dispatch_id in self.by_dispatch_id:
+                return self.tasks[self.by_dispatch_id[dispatch_id]]
+
+            task_id = next(self._ids)
+            leader = next((
+                task for task in self.tasks.values()
+                if task['status'] == 'in_progress' and task['server_url'] == server_url and task['number'] == number
+            ), None)
+            task = {
+                'id': task_id,
+                'number': number,
+                'status': 'in_progress',
+                'progress': 0,
+                'result': None,
+                'server_url': server_url,
+                'user_id': user_id,
+                'started': leader['started'] if leader else time.monotonic(),
+                'duration': leader['duration'] if leader else self.base_seconds + number * self.seconds_per_number,
+                'follower': leader is not None,
+            }
+            self.tasks[task_id] = task
+            if dispatch_id:
+                self.by_dispatch_id[dispatch_id] = task_id
+            heapq.heappush(self._deadlines, (task['started'] + task['duration'], task_id))
+            self._cond.notify()
+            return task
+
+    def cancel_task(self, task_id, user_id):
+        with self._cond:
+            task = self.tasks.get(task_id)
+            if task is None or task['user_id'] != user_id or task['status'] != 'in_progress':
+                return None
+            task['status'] = 'cancelled'
+            self.finished['cancelled'] += 1
+        self._release(task)
+        return task
+
+    def _finisher(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._deadlines or self._deadlines[0][0] > time.monotonic()):
+                    timeout = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+
+                _, task_id = heapq.heappop(self._deadlines)
+                task = self.tasks[task_id]
+                if task['status'] != 'in_progress':
+                    continue
+                task['status'] = 'completed'
+                task['progress'] = 100
+                task['result'] = 'stub'
+                self.finished['completed'] += 1
+
+            # a follower did not run the computation, so its run time says nothing about the cost
+            self._release(task, duration=None if task['follower'] else task['duration'])
+
+    def _release(self, task, duration=None):
+        payload = {
+            'task_id': task['id'],
+            'user_id': task['user_id'],
+            'server_url': task['server_url'],
+            'status': task['status'],
+            'number': task['number'],
+        }
+        if duration is not None:
+            payload['duration'] = duration
+        try:
+            self._session.post(
+                f"{self.balancer_url}/api/internal/slot-release/",
+                json=payload,
+                headers={'X-Internal-Token': self.internal_token},
+                timeout=2
+            )
+        except requests.RequestException:
+            pass
+
+    def describe(self, task):
+        progress = task['progress']
+        if task['status'] == 'in_progress' and task['duration'] > 0:
+            progress = min(99, int((time.monotonic() - task['started']) / task['duration'] * 100))
+        return {
+            'id': task['id'],
+            'number': task['number'],
+            'status': task['status'],
+            'progress': progress,
+            'result': task['result'],
+            'server_url': task['server_url'],
+        }
+
+    def _handler_class(self, port):
+        cluster = self
+        server_url = f"http://127.0.0.1:{port}"
+
+        class StubHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return self.rfile.read(length) if length else b''
+
+            def user_id(self):
+                return token_user_id(self.headers.get('Authorization', ''))
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+
+                if path == '/api/server-status/':
+                    with cluster._cond:
+                        tasks = [
+                            [task['id'], task['number']] for task in cluster.tasks.values()
+                            if task['status'] == 'in_progress' and task['server_url'] == server_url
+                        ]
+                    computations = len({number for _, number in tasks})
+                    data = {
+                        'busy': computations >= cluster.max_tasks_per_server,
+                        'in_progress_tasks': len(tasks),
+                        'available_slots': max(0, cluster.max_tasks_per_server - computations),
+                        'server_url': server_url,
+                        'max_tasks': cluster.max_tasks_per_server,
+                    }
+                    if 'tasks=1' in self.path:
+                        if self.headers.get('X-Internal-Token') != cluster.internal_token:
+                            return self.reply(403, {'error': 'Internal token required'})
+                        data['task_ids'] = [task_id for task_id, _ in tasks]
+                        data['tasks'] = tasks
+                    return self.reply(200, data)
+
+                if path == '/api/task-stats/':
+                    return self.reply(200, {'buckets': {}})
+
+                if path in ('/api/tasks/active/', '/api/tasks/history/'):
+                    user_id = self.user_id()
+                    active = path == '/api/tasks/active/'
+                    with cluster._cond:
+                        tasks = [
+                            cluster.describe(task) for task in cluster.tasks.values()
+                            if task['user_id'] == user_id and (task['status'] == 'in_progress') == active
+                        ]
+                    return self.reply(200, {'results': tasks, 'next': None})
+
+                match = TASK_PATH.match(path)
+                if match and match.group(2) == 'progress':
+                    with cluster._cond:
+                        task = cluster.tasks.get(int(match.group(1)))
+                        data = cluster.describe(task) if task and task['user_id'] == self.user_id() else None
+                    if data is None:
+                        return self.reply(404, {'detail': 'Not found.'})
+                    return self.reply(200, data)
+
+                self.reply(404, {'detail': 'Not found.'})
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                body = self.read_body()
+
+                if path == '/api/tasks/cached/':
+                    return self.reply(404, {'error': 'Result is not cached'})
+
+                if path == '/api/tasks/':
+                    try:
+                        number = int(json.loads(body.decode('utf-8'))['number'])
+                    except (ValueError, KeyError, TypeError):
+                        return self.reply(400, {'number': ['Invalid']})
+                    task = cluster.create_task(server_url, self.user_id(), number, self.headers.get('X-Dispatch-Id'))
+                    return self.reply(201, cluster.describe(task))
+
+                if path == '/api/tasks/bulk/':
+                    try:
+                        numbers = [int(number) for number in json.loads(body.decode('utf-8'))['numbers']]
+                    except (ValueError, KeyError, TypeError):
+                        return self.reply(400, {'numbers': ['Invalid']})
+                    dispatch_ids = self.headers.get('X-Dispatch-Ids', '').split(',')
+                    if len(dispatch_ids) != len(numbers):
+                        dispatch_ids = [None] * len(numbers)
+                    tasks = [
+                        cluster.create_task(server_url, self.user_id(), number, dispatch_id or None)
+                        for number, dispatch_id in zip(numbers, dispatch_ids)
+                    ]
+                    return self.reply(201, {'results': [cluster.describe(task) for task in tasks]})
+
+                match = TASK_PATH.match(path)
+                if match and match.group(2) == 'cancel':
+                    task = cluster.cancel_task(int(match.group(1)), self.user_id())
+                    if task is None:
+                        return self.reply(400, {'error': 'Task cannot be cancelled'})
+                    return self.reply(200, cluster.describe(task))
+
+                self.reply(404, {'detail': 'Not found.'})
+
+        return StubHandler
@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase
+
+from .run import Recorder, compare, percentile
+
+
+def result(p95_ms, drain_seconds, accepted_per_second):
+    return {
+        'operations': {'submit': {'p95_ms': p95_ms, 'p99_ms': p95_ms}},
+        'drain_seconds': drain_seconds,
+        'accepted_per_second': accepted_per_second,
+    }
+
+
+class CompareTests(SimpleTestCase):
+    def test_changes_within_tolerance_pass(self):
+        self.assertEqual(compare(result(105, 10.5, 95), result(100, 10, 100), tolerance=0.1), [])
+
+    def test_slower_latency_and_lower_throughput_regress(self):
+        regressions = compare(result(150, 9, 50), result(100, 10, 100), tolerance=0.1)
+
+        self.assertEqual(regressions, [
+            'submit p95_ms: 100 -> 150 (+50%)',
+            'submit p99_ms: 100 -> 150 (+50%)',
+            'accepted_per_second: 100 -> 50 (-50%)',
+        ])
+
+    def test_operations_missing_from_the_baseline_are_skipped(self):
+        self.assertEqual(compare(result(500, 10, 100), {'drain_seconds': 10}, tolerance=0.1), [])
+
+
+class RecorderTests(SimpleTestCase):
+    def test_summary_reports_percentiles_and_errors(self):
+        recorder = Recorder()
+        for ms in range(1, 101):
+            recorder.record('progress', ms / 1000, ok=ms != 50)
+
+        summary = recorder.summary()['progress']
+
+        self.assertEqual((summary['count'], summary['errors']), (100, 1))
+        self.assertEqual((summary['p50_ms'], summary['p95_ms'], summary['p99_ms']), (50.0, 95.0, 99.0))
+        self.assertIsNone(percentile([], 0.5))
@@ -0,0 +1,68 @@
+"""
+Workload presets for benchmarks.run. A workload file passed with --workload-file
+is a JSON object with the same keys; missing keys fall back to 'smoke'.
+
+users / tasks_per_user    simulated users, each submitting that many tasks
+numbers                   Fibonacci numbers to pick from at random
+submit_interval           pause between one user's submissions, seconds
+poll_interval             pause between one user's polls of active tasks and queue status
+cancel_probability        chance that a user cancels each running task it sees (once per task)
+base_seconds              simulated run time of every task on the stand-in backends
+seconds_per_number        extra simulated run time per unit of the number
+worker_servers            stand-in worker backends behind the balancer
+max_duration              hard stop for the whole run, seconds
+seed                      random seed, so runs are comparable
+"""
+
+WORKLOADS = {
+    'smoke': {
+        'users': 4,
+        'tasks_per_user': 3,
+        'numbers': [10, 100, 1000, 10000],
+        'submit_interval': 0.05,
+        'poll_interval': 0.5,
+        'cancel_probability': 0.0,
+        'base_seconds': 0.2,
+        'seconds_per_number': 0.00002,
+        'worker_servers': 2,
+        'max_duration': 60,
+        'seed': 1,
+    },
+    'burst': {
+        'users': 40,
+        'tasks_per_user': 8,
+        'numbers': [10, 100, 1000],
+        'submit_interval': 0,
+        'poll_interval': 1,
+        'cancel_probability': 0.0,
+        'base_seconds': 0.05,
+        'seconds_per_number': 0.0,
+        'max_duration': 120,
+        'seed': 2,
+    },
+    'mixed': {
+        'users': 12,
+        'tasks_per_user': 6,
+        'numbers': [10, 500, 5000, 50000, 100000],
+        'submit_interval': 0.2,
+        'poll_interval': 0.5,
+        'cancel_probability': 0.15,
+        'base_seconds': 0.1,
+        'seconds_per_number': 0.00002,
+        'max_duration': 180,
+        'seed': 3,
+    },
+    'wide': {
+        'users': 40,
+        'tasks_per_user': 6,
+        'numbers': [10, 100, 1000, 10000],
+        'submit_interval': 0,
+        'poll_interval': 1,
+        'cancel_probability': 0.0,
+        'base_seconds': 0.2,
+        'seconds_per_number': 0.00002,
+        'worker_servers': 16,
+        'max_duration': 120,
+        'seed': 4,
+    },
+}
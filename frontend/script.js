@@ -3,7 +3,11 @@
         
         let token = localStorage.getItem('token');
         let currentTab = 'all';
+        let nextTasksUrl = null;
         let autoRefreshInterval = null;
+        let taskStream = null;
+        let queueStream = null;
+        let taskStreamVersion = null;
         let taskCreationCooldown = false;
         const TASK_COOLDOWN_SECONDS = 5;
 
@@ -151,7 +155,7 @@
 
                 const data = await response.json();
 
-                if (response.status === 202) {
+                if (response.status === 202 || response.status === 201) {
                     document.getElementById('fibNumber').value = '';
                     loadTasks();
                 } else {
@@ -190,14 +194,18 @@
             }, 1000);
         }
 
-        async function loadTasks() {
-            let url = `${API_URL}/tasks/`;
-            
+        function tasksUrl() {
             if (currentTab === 'active') {
-                url = `${API_URL}/tasks/active/`;
+                return `${API_URL}/tasks/active/`;
             } else if (currentTab === 'history') {
-                url = `${API_URL}/tasks/history/`;
+                return `${API_URL}/tasks/history/`;
             }
+            return `${API_URL}/tasks/`;
+        }
+
+        async function loadTasks(append = false) {
+            const url = append ? nextTasksUrl : tasksUrl();
+            if (!url) return;
 
             try {
                 const response = await fetch(url, {
@@ -205,9 +213,12 @@
                 });
 
                 if (response.ok) {
-                    const tasks = await response.json();
-                    displayTasks(tasks);
-                    await updateQueueStatusBanner();
+                    const page = await response.json();
+                    nextTasksUrl = page.next ? `${tasksUrl()}?cursor=${encodeURIComponent(page.next)}` : null;
+                    displayTasks(page.results, append);
+                    if (!append) {
+                        await updateQueueStatusBanner();
+                    }
                 } else if (response.status === 401) {
                     logout();
                 }
@@ -218,41 +229,67 @@
 
         async function updateQueueStatusBanner() {
             try {
-                const response = await fetch(`${LOAD_BALANCER_URL}/queue-status/`); 
+                const response = await fetch(`${LOAD_BALANCER_URL}/queue-status/`, {
+                    headers: {'Authorization': `Bearer ${token}`}
+                });
                 if (response.ok) {
-                    const data = await response.json();
-                    const count = data.queue_length;
-                    const estimatedTime = data.estimated_wait_time;
-                    
-                    document.getElementById('queueCount').textContent = count;
-                    
-                    const bannerTextElement = document.getElementById('queueBannerText');
-                    const bannerTimeElement = document.getElementById('queueBannerTime');
-                    
-                    if (count > 0) {
-                        bannerTextElement.innerHTML = `Задач в черзі:`;
-                        bannerTimeElement.textContent = `Приблизно ${estimatedTime}`;
-                        bannerTimeElement.style.display = 'block';
-                        document.getElementById('queueBanner').style.display = 'flex';
-                    } else {
-                        document.getElementById('queueBanner').style.display = 'none';
-                        bannerTimeElement.style.display = 'none';
-                    }
+                    renderQueueStatus(await response.json());
                 }
             } catch (error) {
                 console.error('Error fetching queue status:', error);
             }
         }
 
-        function displayTasks(tasks) {
+        function renderQueueStatus(data) {
+            const count = data.queue_length;
+            const estimatedTime = data.estimated_wait_time;
+
+            document.getElementById('queueCount').textContent = count;
+
+            const bannerTextElement = document.getElementById('queueBannerText');
+            const bannerTimeElement = document.getElementById('queueBannerTime');
+
+            if (count > 0) {
+                bannerTextElement.innerHTML = `Задач в черзі:`;
+                const ownTask = (data.user_queued || [])[0];
+                bannerTimeElement.textContent = ownTask
+                    ? `Ваша задача: позиція ${ownTask.queue_position}, приблизно ${ownTask.estimated_wait_time}`
+                    : `Приблизно ${estimatedTime}`;
+                bannerTimeElement.style.display = 'block';
+                document.getElementById('queueBanner').style.display = 'flex';
+            } else {
+                document.getElementById('queueBanner').style.display = 'none';
+                bannerTimeElement.style.display = 'none';
+            }
+        }
+
+        function handleTaskStreamEvent(data) {
+            if (data.version !== taskStreamVersion) {
+                taskStreamVersion = data.version;
+                loadTasks();
+                return;
+            }
+
+            data.active.forEach(task => {
+                const fill = document.getElementById(`progress-${task.id}`);
+                if (fill) {
+                    fill.style.width = `${task.progress}%`;
+                    fill.textContent = `${task.progress}%`;
+                }
+            });
+        }
+
+        function displayTasks(tasks, append = false) {
             const container = document.getElementById('tasksList');
+            const loadMore = document.getElementById('loadMoreTasks');
+            if (loadMore) loadMore.remove();
 
-            if (tasks.length === 0) {
+            if (tasks.length === 0 && !append) {
                 container.innerHTML = '<p style="text-align: center; color: #999; padding: 40px;">Задач немає</p>';
                 return;
             }
 
-            container.innerHTML = tasks.map(task => {
+            const cards = tasks.map(task => {
                 const status = task.status;
                 const statusClass = status;
                 const displayStatus = status;
@@ -276,7 +313,7 @@
 
                     ${displayStatus === 'in_progress' ? `
                         <div class="progress-bar">
-                            <div class="progress-fill" style="width: ${task.progress}%">
+                            <div class="progress-fill" id="progress-${task.id}" style="width: ${task.progress}%">
                                 ${task.progress}%
                             </div>
                         </div>
@@ -302,6 +339,17 @@
                     </div>
                 </div>
             `}).join('');
+
+            if (append) {
+                container.insertAdjacentHTML('beforeend', cards);
+            } else {
+                container.innerHTML = cards;
+            }
+
+            if (nextTasksUrl) {
+                container.insertAdjacentHTML('beforeend',
+                    '<button id="loadMoreTasks" class="btn-secondary" onclick="loadTasks(true)">Завантажити ще</button>');
+            }
         }
 
         async function cancelTask(id) {
@@ -340,11 +388,49 @@
         }
 
         function startAutoRefresh() {
-            autoRefreshInterval = setInterval(loadTasks, 3000); 
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+
+            const query = `?token=${encodeURIComponent(token)}`;
+
+            taskStream = new EventSource(`${LOAD_BALANCER_URL}/tasks/stream/${query}`);
+            taskStream.addEventListener('tasks', event => handleTaskStreamEvent(JSON.parse(event.data)));
+            taskStream.onerror = () => {
+                // EventSource reconnects by itself; a closed stream means it was refused (e.g. 401)
+                if (taskStream.readyState === EventSource.CLOSED) {
+                    stopStreams();
+                    startPolling();
+                }
+            };
+
+            queueStream = new EventSource(`${LOAD_BALANCER_URL}/queue-status/stream/${query}`);
+            queueStream.addEventListener('queue', event => renderQueueStatus(JSON.parse(event.data)));
+        }
+
+        function startPolling() {
+            if (!autoRefreshInterval) {
+                autoRefreshInterval = setInterval(loadTasks, 3000);
+            }
+        }
+
+        function stopStreams() {
+            if (taskStream) {
+                taskStream.close();
+                taskStream = null;
+            }
+            if (queueStream) {
+                queueStream.close();
+                queueStream = null;
+            }
+            taskStreamVersion = null;
         }
 
         function stopAutoRefresh() {
+            stopStreams();
             if (autoRefreshInterval) {
                 clearInterval(autoRefreshInterval);
+                autoRefreshInterval = null;
             }
         }
\ No newline at end of file
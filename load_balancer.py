@@ -1,13 +1,19 @@
+from http import HTTPStatus
 from http.server import HTTPServer, BaseHTTPRequestHandler
-import requests
+import hmac
 import json
+import math
+import re
 import sys
 import os
-from collections import deque
-from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Event, Lock, Thread
 import time
 from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlsplit
 import traceback
+import uuid
 
 #коментар
 #коментар для тесту роботи правил друга частина
@@ -23,24 +29,293 @@ except Exception as _e:
     print(f"Django setup warning: {_e}")
 
 from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from requests import ConnectionError as BackendConnectionError, RequestException
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from backend.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, DURATION_BUCKETS, Registry, bucket_label
+from balancer.estimator import WaitTimeEstimator
+from balancer.journal import QueueJournal
+from balancer.ledger import SlotLedger
+from balancer.queue import TaskQueue
+from balancer.registry import BackendRegistry
+from balancer.scheduling import create_policy
+from balancer.store import MemoryQueueStore
+from balancer.upstream import RequestBody, UpstreamPool
 
-MAIN_DB_SERVER = 'http://127.0.0.1:8000'
+# headers that describe one connection, not the message; never forwarded either way
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
 
-BACKENDS = [
-    {'url': 'http://127.0.0.1:8001'},
-    {'url': 'http://127.0.0.1:8002'},
-]
+backend_registry = BackendRegistry(
+    settings.BACKEND_MAIN_SERVER,
+    settings.BACKEND_WORKERS,
+    failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+    open_seconds=settings.CIRCUIT_OPEN_SECONDS,
+    config_file=settings.BACKEND_REGISTRY_FILE
+)
+health_executor = ThreadPoolExecutor(
+    max_workers=settings.BACKEND_HEALTH_CHECK_CONCURRENCY,
+    thread_name_prefix='lb-health'
+)
+
+
+
+def create_queue_store():
+    policy = create_policy(settings.QUEUE_SCHEDULING_POLICY, settings.QUEUE_AGING_RATE)
+    if settings.QUEUE_BACKEND == 'database':
+        from balancer.shared_queue import DatabaseQueueStore
+        return DatabaseQueueStore(policy, lease_seconds=settings.QUEUE_LEASE_SECONDS)
+    if settings.QUEUE_BACKEND == 'memory':
+        return MemoryQueueStore(TaskQueue(policy), QueueJournal(settings.QUEUE_JOURNAL_PATH))
+    raise ValueError(f"Unknown QUEUE_BACKEND: {settings.QUEUE_BACKEND}")
+
+
+task_queue = create_queue_store()
+dispatch_wakeup = Event()
+# users a backend turned away with 429, with the monotonic time their deferral ends;
+# their queued tasks are passed over until one of their running tasks finishes
+deferred_users = {}
+deferred_users_lock = Lock()
+dispatch_executor = ThreadPoolExecutor(
+    max_workers=settings.DISPATCH_CONCURRENCY,
+    thread_name_prefix='lb-dispatch'
+)
+
+slot_ledger = SlotLedger(
+    backend_registry.worker_urls(),
+    capacity=settings.MAX_TASKS_PER_SERVER
+)
+
+wait_estimator = WaitTimeEstimator(default_cost=settings.AVERAGE_TASK_TIME)
+
+metrics = Registry()
+REQUEST_LATENCY = metrics.histogram('lb_request_duration_seconds', 'Time to handle a client request, by route')
+UPSTREAM_LATENCY = metrics.histogram('lb_upstream_duration_seconds', 'Time of requests to a backend')
+UPSTREAM_ERRORS = metrics.counter('lb_upstream_errors_total', 'Requests to a backend that failed without a response')
+TASKS_ENQUEUED = metrics.counter('lb_tasks_enqueued_total', 'Tasks accepted into the queue')
+TASKS_REJECTED = metrics.counter('lb_tasks_rejected_total', 'Tasks rejected by the per-user quota')
+TASKS_DISPATCHED = metrics.counter('lb_tasks_dispatched_total', 'Tasks placed on a backend')
+DISPATCH_FAILURES = metrics.counter('lb_dispatch_failures_total', 'Sends that put the task back in the queue')
+DISPATCH_DEFERRED = metrics.counter(
+    'lb_dispatch_deferred_total',
+    'Sends turned away by the user\'s running-task quota on the backend, left in the queue'
+)
+DISPATCH_CYCLES = metrics.counter('lb_dispatch_cycles_total', 'Queue processor loop iterations')
+SLOT_RELEASES = metrics.counter('lb_slot_releases_total', 'Finished tasks reported by backends, by status')
+TASK_DURATION = metrics.histogram(
+    'lb_task_duration_seconds',
+    'Run time of completed tasks by bit length of the number',
+    buckets=DURATION_BUCKETS
+)
+
+upstream = UpstreamPool(
+    pool_size=settings.UPSTREAM_POOL_SIZE,
+    max_per_host=settings.UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+    idle_timeout=settings.UPSTREAM_IDLE_TIMEOUT,
+    latency=UPSTREAM_LATENCY,
+    errors=UPSTREAM_ERRORS
+)
+
+
+def slot_gauge(field):
+    return {(('backend', url),): status[field] for url, status in slot_ledger.snapshot().items()}
+
+
+def slot_utilization():
+    snapshot = slot_ledger.snapshot()
+    capacity = slot_ledger.capacity * sum(1 for status in snapshot.values() if status['reachable'])
+    used = sum(status['in_progress'] for status in snapshot.values() if status['reachable'])
+    return used / capacity if capacity else 0
+
+
+metrics.gauge('lb_queue_depth', 'Tasks waiting in the queue', lambda: len(task_queue))
+metrics.gauge('lb_slots_in_use', 'Slots taken on each backend', lambda: slot_gauge('in_progress'))
+metrics.gauge('lb_slots_available', 'Free slots on each backend', lambda: slot_gauge('available_slots'))
+metrics.gauge('lb_slot_utilization', 'Share of slots in use on reachable backends', slot_utilization)
+metrics.gauge('lb_backend_up', 'Last health check of each backend passed', lambda: backend_gauge('healthy'))
+metrics.gauge('lb_circuit_open', 'Circuit breaker of each backend is open', lambda: backend_gauge('circuit'))
+
+
+class BackendUnavailable(RequestException):
+    pass
+
+
+class DispatchDeferred(Exception):
+    """The backend refused the tasks for now (429: the user has too many running); they wait in the queue."""
+
+
+def backend_gauge(field):
+    return {
+        (('backend', url),): int(state[field] == 'open' if field == 'circuit' else state[field])
+        for url, state in backend_registry.snapshot().items()
+    }
+
+
+def counts_against_breaker(base_url, error, health_check=False):
+    """
+    Whether a failed request says the backend is down. The main server also answers
+    every proxied read, where a slow query or a client that went away is no sign
+    of that: there only connection errors and health checks count.
+    """
+    return health_check or isinstance(error, BackendConnectionError) or base_url != backend_registry.main_url
+
+
+def backend_request(method, base_url, path, health_check=False, **kwargs):
+    """
+    upstream.request behind the backend's circuit breaker: fails at once with
+    BackendUnavailable while the breaker is open, and feeds the outcome back to it.
+    """
+    if not backend_registry.is_available(base_url):
+        raise BackendUnavailable(f"{base_url} недоступний (circuit open)")
+    try:
+        response = upstream.request(method, base_url, path, **kwargs)
+    except RequestException as e:
+        if counts_against_breaker(base_url, e, health_check) and backend_registry.record_failure(base_url):
+            print(f"Сервер {base_url} вимкнено з ротації на {settings.CIRCUIT_OPEN_SECONDS}с")
+        raise
+    backend_registry.record_success(base_url)
+    return response
+
+
+@contextmanager
+def backend_stream(method, base_url, path, **kwargs):
+    """upstream.stream behind the backend's circuit breaker, like backend_request."""
+    if not backend_registry.is_available(base_url):
+        raise BackendUnavailable(f"{base_url} недоступний (circuit open)")
+    connected = False
+    try:
+        with upstream.stream(method, base_url, path, **kwargs) as response:
+            connected = True
+            backend_registry.record_success(base_url)
+            yield response
+    except RequestException as e:
+        if not connected and counts_against_breaker(base_url, e) and backend_registry.record_failure(base_url):
+            print(f"Сервер {base_url} вимкнено з ротації на {settings.CIRCUIT_OPEN_SECONDS}с")
+        raise
+
+def token_user_id(headers):
+    """
+    User id of the request's access token, or None without a valid one. The
+    signature, expiry and token type are checked the way the backends check them.
+    """
+    auth = next((value for key, value in headers.items() if key.lower() == 'authorization'), '')
+    if not auth.startswith('Bearer '):
+        return None
+
+    try:
+        token = AccessToken(auth.split(' ', 1)[1])
+    except TokenError:
+        return None
+    return token.get(jwt_settings.USER_ID_CLAIM)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands every connection to a fixed pool of worker threads.
+    At most max_workers + max_pending connections are held at once; beyond that
+    the accept loop blocks and new clients wait in the listen backlog.
+
+    Long-lived streams (Server-Sent Events) are moved off the worker pool onto
+    their own pool of max_streams threads, so open browser tabs never hold the
+    workers that serve ordinary requests.
+    """
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers, max_pending, max_streams):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lb-worker')
+        self.slots = BoundedSemaphore(max_workers + max_pending)
+        self.stream_executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix='lb-stream')
+        self.stream_slots = BoundedSemaphore(max_streams)
+        self._detached = set()
+        self._detached_lock = Lock()
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        try:
+            self.executor.submit(self.process_request_worker, request, client_address)
+        except RuntimeError:
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._detached_lock:
+                detached = request in self._detached
+                self._detached.discard(request)
+            if not detached:
+                self.shutdown_request(request)
+            self.slots.release()
+
+    def start_stream(self, request, producer):
+        """
+        Runs producer(request) on a stream thread, which owns the connection from
+        then on and closes it when the producer returns. Returns False when
+        max_streams streams are already open.
+        """
+        if not self.stream_slots.acquire(blocking=False):
+            return False
+
+        with self._detached_lock:
+            self._detached.add(request)
+        self.stream_executor.submit(self.run_stream, request, producer)
+        return True
+
+    def run_stream(self, request, producer):
+        try:
+            producer(request)
+        except OSError:
+            pass
+        except Exception as e:
+            print(f"Помилка потоку подій: {e}")
+        finally:
+            self.shutdown_request(request)
+            self.stream_slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def send_stream_head(sock, status_code, reason, headers):
+    lines = [f"HTTP/1.0 {status_code} {reason}"]
+    lines += [f"{key}: {value}" for key, value in headers]
+    lines += [
+        'Access-Control-Allow-Origin: *',
+        'Access-Control-Allow-Credentials: true',
+        'Cache-Control: no-cache',
+        'Connection: close',
+    ]
+    sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
 
-task_queue = deque()
-queue_lock = Lock()
 
 class LoadBalancer(BaseHTTPRequestHandler):
+    timeout = 60
     
     def log_message(self, format, *args):
         sys.stdout.write("%s - - [%s] %s\n" %
                          (self.address_string(),
                           self.log_date_time_string(),
                           format%args))
+
+    def log_request(self, code='-', size='-'):
+        if isinstance(code, HTTPStatus):
+            code = code.value
+        # EventSource sends the access token as ?token=, so query strings stay out of the log
+        self.log_message('"%s" %s %s', re.sub(r'\?\S*', '', self.requestline), str(code), str(size))
     
     def do_GET(self):
         if self.path == '/favicon.ico':
@@ -70,9 +345,46 @@ class LoadBalancer(BaseHTTPRequestHandler):
     def is_task_creation_request(self):
         return self.path == '/api/tasks/' and self.command == 'POST'
     
+    def is_bulk_task_creation_request(self):
+        return self.path == '/api/tasks/bulk/' and self.command == 'POST'
+
     def is_queue_status_request(self):
         return self.path == '/api/queue-status/' and self.command == 'GET'
     
+    def is_queue_stream_request(self):
+        return self.path.split('?')[0] == '/api/queue-status/stream/' and self.command == 'GET'
+
+    def is_task_stream_request(self):
+        return self.path.split('?')[0] == '/api/tasks/stream/' and self.command == 'GET'
+
+    def is_user_queue_removal_request(self):
+        return self.path == '/api/queue/' and self.command == 'DELETE'
+
+    def is_slot_release_request(self):
+        return self.path == '/api/internal/slot-release/' and self.command == 'POST'
+
+    def is_metrics_request(self):
+        return self.path == '/metrics' and self.command == 'GET'
+
+    def route_name(self):
+        if self.is_task_creation_request():
+            return 'task_create'
+        if self.is_bulk_task_creation_request():
+            return 'task_bulk_create'
+        if self.is_queue_status_request():
+            return 'queue_status'
+        if self.is_queue_stream_request():
+            return 'queue_stream'
+        if self.is_task_stream_request():
+            return 'task_stream'
+        if self.is_user_queue_removal_request():
+            return 'queue_removal'
+        if self.is_slot_release_request():
+            return 'slot_release'
+        if self.is_metrics_request():
+            return 'metrics'
+        return 'proxy'
+
     def send_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, PATCH, OPTIONS')
@@ -80,54 +392,123 @@ class LoadBalancer(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Credentials', 'true')
     
     def proxy_request(self, method):
+        started = time.perf_counter()
+        try:
+            self.route_request(method)
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, route=self.route_name())
+
+    def read_body(self):
         content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length) if content_length > 0 else None
+        return self.rfile.read(content_length) if content_length > 0 else None
 
+    def route_request(self, method):
         headers = {}
         for key, value in self.headers.items():
-            if key.lower() not in ['host', 'connection']:
+            if key.lower() != 'host' and key.lower() not in HOP_BY_HOP_HEADERS:
                 headers[key] = value
 
         if self.is_queue_status_request():
             self.handle_queue_status_request()
             return
 
+        if self.is_queue_stream_request():
+            self.handle_queue_stream()
+            return
+
+        if self.is_task_stream_request():
+            self.handle_task_stream(headers)
+            return
+
+        if self.is_user_queue_removal_request():
+            self.handle_user_queue_removal()
+            return
+
+        if self.is_slot_release_request():
+            self.handle_slot_release(self.read_body())
+            return
+
         if self.is_task_creation_request():
-            self.handle_task_creation(body, headers)
+            self.handle_task_creation(self.read_body(), headers)
             return
 
-        backend = MAIN_DB_SERVER
-        
+        if self.is_bulk_task_creation_request():
+            self.handle_bulk_task_creation(self.read_body(), headers)
+            return
+
+        if self.is_metrics_request():
+            self.handle_metrics()
+            return
+
+        self.proxy_to_main(method, headers)
+
+    def proxy_to_main(self, method, headers):
+        """
+        Forwards the request to the main server without buffering either body:
+        the request body is sent as it is read from the client, and the response
+        is relayed PROXY_CHUNK_SIZE bytes at a time as it arrives, still encoded
+        (Content-Encoding is passed through). A response without Content-Length,
+        e.g. a chunked one, is relayed until the upstream ends and the client
+        connection is closed after it.
+        """
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = RequestBody(self.rfile, content_length, settings.PROXY_CHUNK_SIZE) if content_length > 0 else None
+        # otherwise requests asks for gzip on the client's behalf
+        headers.setdefault('Accept-Encoding', 'identity')
+        head_sent = False
+
         try:
-            response = requests.request(
-                method=method,
-                url=backend + self.path,
+            with backend_stream(
+                method,
+                backend_registry.main_url,
+                self.path,
                 data=body,
                 headers=headers,
-                timeout=300,
+                timeout=(5, settings.PROXY_READ_TIMEOUT),
                 allow_redirects=False
-            )
-            
-            self.send_response(response.status_code)
-            self.send_cors_headers()
+            ) as response:
+                self.send_response(response.status_code)
+                self.send_cors_headers()
+                for key, value in response.headers.items():
+                    if key.lower() not in HOP_BY_HOP_HEADERS:
+                        self.send_header(key, value)
+                if 'Content-Length' not in response.headers:
+                    self.close_connection = True
+                self.end_headers()
+                head_sent = True
 
-            for key, value in response.headers.items():
-                if key.lower() not in ['content-encoding', 'transfer-encoding', 'connection']:
-                    self.send_header(key, value)
-            self.end_headers()
-            self.wfile.write(response.content)
-            
+                # a 304 to a forwarded If-None-Match carries no body
+                if response.status_code == 304:
+                    return
+                while True:
+                    chunk = response.raw.read1(settings.PROXY_CHUNK_SIZE, decode_content=False)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+
+        except BackendUnavailable as e:
+            self.send_error(503, f"Service Unavailable: {str(e)}")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
         except Exception as e:
-            self.send_error(502, f"Bad Gateway: {str(e)}")
             print(f"Error: {e}")
+            if head_sent:
+                # the status line is out; all that is left is to cut the response short
+                self.close_connection = True
+            else:
+                self.send_error(502, f"Bad Gateway: {str(e)}")
     
     def handle_task_creation(self, body, headers):
         print(f"\nНОВИЙ ЗАПИТ НА СТВОРЕННЯ ЗАДАЧІ\n")
-        
+
+        user_id = token_user_id(headers)
+        if user_id is None:
+            self.send_json_response(401, {'detail': 'Authentication credentials were not provided.'})
+            return
+
         try:
             task_data = json.loads(body.decode('utf-8'))
             number = task_data.get('number')
-            user_id = task_data.get('user_id')
             
             if number is None or number < 0 or number > 100000:
                 self.send_response(400)
@@ -137,23 +518,10 @@ class LoadBalancer(BaseHTTPRequestHandler):
                     'error': 'Invalid number. Must be between 0 and 100,000'
                 }, ensure_ascii=False).encode('utf-8'))
                 return
-                
-            with queue_lock:
-                user_tasks_in_queue = [
-                    t for t in task_queue
-                    if json.loads(t['body'].decode('utf-8')).get('user_id') == user_id
-                ]
-                
-                if len(user_tasks_in_queue) >= settings.MAX_TASKS_PER_USER:
-                    self.send_response(429)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
-                        'error': f'Максимальна кількість задач для користувача ({user_id}) досягнута',
-                        'current_tasks': len(user_tasks_in_queue)
-                    }, ensure_ascii=False).encode('utf-8'))
-                    return
 
+            if self.forward_cached_task(body, headers):
+                return
+                
         except Exception as e:
             self.send_response(400)
             self.send_header('Content-Type', 'application/json')
@@ -161,16 +529,45 @@ class LoadBalancer(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({'error': 'Invalid request'}).encode('utf-8'))
             return
 
-        with queue_lock:
-            task_queue.append({
-                'body': body,
-                'headers': headers,
-                'queued_at': datetime.now(),
-                'number': number
-            })
-            queue_position = len(task_queue)
-        
-        wait_time = self.estimate_wait_time(queue_position)
+        entry = {
+            'body': body,
+            'headers': headers,
+            'queued_at': datetime.now(),
+            'number': number,
+            'user_id': user_id,
+            'dispatch_id': uuid.uuid4().hex,
+            'cost': wait_estimator.cost(number)
+        }
+        try:
+            queued = task_queue.enqueue(entry, settings.MAX_TASKS_PER_USER)
+        except DatabaseError as e:
+            print(f"Помилка запису в спільну чергу: {e}")
+            self.send_error(503, "Service Unavailable: queue is not available")
+            return
+
+        if not queued['accepted']:
+            TASKS_REJECTED.inc()
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({
+                'error': f'Максимальна кількість задач для користувача ({user_id}) досягнута',
+                'current_tasks': queued['user_tasks']
+            }, ensure_ascii=False).encode('utf-8'))
+            return
+
+        # an entry already claimed for dispatch in the meantime no longer needs the journal
+        if not queued['durable'].wait(timeout=5) and task_queue.discard([entry]):
+            print(f"Журнал черги не підтвердив запис задачі {entry['dispatch_id']}, задачу відхилено")
+            self.send_error(503, "Service Unavailable: queue journal is not available")
+            return
+
+        TASKS_ENQUEUED.inc()
+        dispatch_wakeup.set()
+
+        queue_position = queued['position']
+        queue_length = queued['queue_length']
+        wait_time = self.format_wait_time(estimate_wait_seconds(queued['cost_ahead']))
         
         print(f"\nДАНІ ВАЛІДНІ")
         print(f"Fibonacci({number})")
@@ -187,7 +584,7 @@ class LoadBalancer(BaseHTTPRequestHandler):
             'status': 'queued',
             'message': 'Задача прийнята і додана в чергу обробки',
             'queue_position': queue_position,
-            'queue_length': queue_position,
+            'queue_length': queue_length,
             'estimated_wait_time': wait_time,
             'queued_at': datetime.now().isoformat(),
             'number': number
@@ -195,34 +592,301 @@ class LoadBalancer(BaseHTTPRequestHandler):
         
         self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
     
-    def handle_queue_status_request(self):
-        with queue_lock:
-            queue_length = len(task_queue)
+    def handle_bulk_task_creation(self, body, headers):
+        """
+        Queues every number of {'numbers': [...]} or none of them: the whole list
+        is validated first, then enqueued in one step against the user's quota.
+        Each accepted number gets its own dispatch id and queue position.
+        """
+        user_id = token_user_id(headers)
+        if user_id is None:
+            self.send_json_response(401, {'detail': 'Authentication credentials were not provided.'})
+            return
+
+        try:
+            task_data = json.loads(body.decode('utf-8'))
+            numbers = task_data['numbers']
+        except Exception:
+            self.send_json_response(400, {'error': 'Invalid request'})
+            return
+
+        if not isinstance(numbers, list) or not numbers:
+            self.send_json_response(400, {'error': 'numbers must be a non-empty list'})
+            return
+
+        invalid = [
+            index for index, number in enumerate(numbers)
+            if not isinstance(number, int) or isinstance(number, bool)
+            or number < 0 or number > settings.MAX_FIBONACCI_NUMBER
+        ]
+        if invalid:
+            self.send_json_response(400, {
+                'error': f'Invalid number. Must be between 0 and {settings.MAX_FIBONACCI_NUMBER:,}',
+                'invalid_indexes': invalid
+            })
+            return
+
+        if len(numbers) > settings.MAX_TASKS_PER_USER:
+            TASKS_REJECTED.inc(len(numbers))
+            self.send_json_response(429, {
+                'error': f'Максимальна кількість задач для користувача ({user_id}) досягнута',
+                'max_tasks': settings.MAX_TASKS_PER_USER
+            })
+            return
+
+        # every entry is sent on its own by the single-task path, so it gets its own body
+        entry_headers = {key: value for key, value in headers.items() if key.lower() != 'content-length'}
+        queued_at = datetime.now()
+        entries = [
+            {
+                'body': json.dumps({'number': number}).encode('utf-8'),
+                'headers': entry_headers,
+                'queued_at': queued_at,
+                'number': number,
+                'user_id': user_id,
+                'dispatch_id': uuid.uuid4().hex,
+                'cost': wait_estimator.cost(number)
+            }
+            for number in numbers
+        ]
+        try:
+            queued = task_queue.enqueue_many(entries, settings.MAX_TASKS_PER_USER)
+        except DatabaseError as e:
+            print(f"Помилка запису в спільну чергу: {e}")
+            self.send_error(503, "Service Unavailable: queue is not available")
+            return
+
+        if not queued['accepted']:
+            TASKS_REJECTED.inc(len(entries))
+            self.send_json_response(429, {
+                'error': f'Максимальна кількість задач для користувача ({user_id}) досягнута',
+                'current_tasks': queued['user_tasks']
+            })
+            return
+
+        if not queued['durable'].wait(timeout=5) and task_queue.discard(entries):
+            print(f"Журнал черги не підтвердив запис {len(entries)} задач, пакет відхилено")
+            self.send_error(503, "Service Unavailable: queue journal is not available")
+            return
+
+        TASKS_ENQUEUED.inc(len(entries))
+        dispatch_wakeup.set()
+
+        print(f"\nДОДАНО В ЧЕРГУ ПАКЕТ З {len(entries)} ЗАДАЧ")
+        print(f"Позиції в черзі: {', '.join(str(position) for position in queued['positions'])}\n")
+
+        self.send_json_response(202, {
+            'status': 'queued',
+            'message': 'Задачі прийняті і додані в чергу обробки',
+            'queue_length': queued['queue_length'],
+            'queued_at': queued_at.isoformat(),
+            'tasks': [
+                {
+                    'dispatch_id': entry['dispatch_id'],
+                    'number': entry['number'],
+                    'queue_position': position,
+                    'estimated_wait_time': self.format_wait_time(estimate_wait_seconds(cost_ahead))
+                }
+                for entry, position, cost_ahead in zip(entries, queued['positions'], queued['costs_ahead'])
+            ]
+        })
+
+    def send_json_response(self, status_code, data):
+        self.send_response(status_code)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def forward_cached_task(self, body, headers):
+        try:
+            response = backend_request(
+                'POST',
+                backend_registry.main_url,
+                '/api/tasks/cached/',
+                data=body,
+                headers=headers,
+                timeout=5
+            )
+        except Exception as e:
+            print(f"Помилка перевірки кешу: {e}")
+            return False
+
+        if response.status_code != 201:
+            return False
+
+        print(f"Результат знайдено в кеші, задача завершена без черги\n")
+
+        self.send_response(201)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(response.content)
+        return True
+
+    def handle_slot_release(self, body):
+        token = self.headers.get('X-Internal-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'), settings.INTERNAL_API_TOKEN.encode('utf-8')):
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            task_id = payload['task_id']
+            duration = float(payload['duration']) if payload.get('duration') is not None else None
+        except Exception:
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        SLOT_RELEASES.inc(status=str(payload.get('status')))
+        if duration is not None and math.isfinite(duration) and duration >= 0 and payload.get('number') is not None:
+            wait_estimator.observe(payload['number'], duration)
+            TASK_DURATION.observe(duration, bucket=bucket_label(payload['number']))
+
+        released = slot_ledger.release(task_id)
+        if released:
+            print(f"Задача #{task_id} завершена, слот звільнено")
+            dispatch_wakeup.set()
+        if payload.get('user_id') is not None and undefer_user(payload['user_id']):
+            dispatch_wakeup.set()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'released': released}).encode('utf-8'))
+
+    def handle_metrics(self):
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def request_user_id(self):
+        token = parse_qs(urlsplit(self.path).query).get('token')
+        if token:
+            return token_user_id({'Authorization': f"Bearer {token[0]}"})
+        return token_user_id(self.headers)
+
+    def queue_status(self, user_id):
+        in_flight = slot_ledger.in_flight()
+        total_slots = slot_ledger.total_slots()
+
+        queue_length, total_cost, user_entries = task_queue.status(user_id)
+
+        user_queued = []
+        for entry, position, cost_ahead in user_entries:
+            description = self.describe_queued_task(entry)
+            description['queue_position'] = position
+            description['estimated_wait_time'] = self.format_wait_time(
+                wait_estimator.wait_seconds(cost_ahead, in_flight, total_slots)
+            )
+            user_queued.append(description)
 
         if queue_length > 0:
-            estimated_wait_time = self.estimate_wait_time(queue_length)
+            estimated_wait_time = self.format_wait_time(
+                wait_estimator.wait_seconds(total_cost, in_flight, total_slots)
+            )
         else:
             estimated_wait_time = "0 секунд"
+
+        return {
+            'queue_length': queue_length,
+            'estimated_wait_time': estimated_wait_time,
+            'user_queued': user_queued,
+        }
+
+    def handle_queue_status_request(self):
+        response_data = self.queue_status(self.request_user_id())
+        response_data['timestamp'] = datetime.now().isoformat()
         
         self.send_response(200)
         self.send_cors_headers()
         self.send_header('Content-Type', 'application/json')
         self.end_headers()
         
-        response_data = {
-            'queue_length': queue_length,
-            'estimated_wait_time': estimated_wait_time,
-            'timestamp': datetime.now().isoformat()
-        }
-        
         self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
-    
-    def estimate_wait_time(self, queue_position):
-        num_servers = len(BACKENDS)
-        avg_time = settings.AVERAGE_TASK_TIME
-        
-        estimated_seconds = (queue_position / (num_servers * settings.MAX_TASKS_PER_SERVER)) * avg_time
-        
+
+    def handle_queue_stream(self):
+        user_id = self.request_user_id()
+
+        def produce(sock):
+            send_stream_head(sock, 200, 'OK', [('Content-Type', 'text/event-stream')])
+            started = last_beat = time.monotonic()
+            last_status = None
+
+            while time.monotonic() - started < settings.TASK_STREAM_MAX_DURATION:
+                status = self.queue_status(user_id)
+                if status != last_status:
+                    last_status = status
+                    last_beat = time.monotonic()
+                    sock.sendall(format_event('queue', status))
+                elif time.monotonic() - last_beat >= 15:
+                    last_beat = time.monotonic()
+                    sock.sendall(b": ping\n\n")
+                time.sleep(1)
+
+        if not self.server.start_stream(self.request, produce):
+            self.send_error(503, "Too many open streams")
+
+    def handle_task_stream(self, headers):
+        # the backend gets the ?token= as a header, keeping it out of its access log too
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        token = query.pop('token', None)
+        if token:
+            headers['Authorization'] = f"Bearer {token[0]}"
+        path = url.path + (f"?{urlencode(query, doseq=True)}" if query else '')
+
+        def produce(sock):
+            head_sent = False
+            try:
+                with backend_stream('GET', backend_registry.main_url, path, headers=headers, timeout=(5, 60)) as response:
+                    content_type = response.headers.get('Content-Type', 'text/event-stream')
+                    send_stream_head(sock, response.status_code, response.reason, [('Content-Type', content_type)])
+                    head_sent = True
+                    while True:
+                        chunk = response.raw.read1(8192)
+                        if not chunk:
+                            break
+                        sock.sendall(chunk)
+            except RequestException as e:
+                print(f"Помилка проксування потоку: {e}")
+                if not head_sent:
+                    send_stream_head(sock, 502, 'Bad Gateway', [('Content-Length', '0')])
+
+        if not self.server.start_stream(self.request, produce):
+            self.send_error(503, "Too many open streams")
+
+    def handle_user_queue_removal(self):
+        user_id = token_user_id(self.headers)
+        if user_id is None:
+            self.send_json_response(401, {'detail': 'Authentication credentials were not provided.'})
+            return
+
+        removed = task_queue.remove_user(user_id)
+
+        print(f"Користувач {user_id} прибрав з черги задач: {len(removed)}")
+
+        self.send_response(200)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({
+            'removed': [self.describe_queued_task(entry) for entry in removed]
+        }, ensure_ascii=False).encode('utf-8'))
+
+    def describe_queued_task(self, entry):
+        return {
+            'dispatch_id': entry['dispatch_id'],
+            'number': entry['number'],
+            'queued_at': entry['queued_at'].isoformat()
+        }
+
+    def format_wait_time(self, estimated_seconds):
         if estimated_seconds < 60:
             return f"{int(estimated_seconds)} секунд"
         elif estimated_seconds < 3600:
@@ -234,18 +898,41 @@ class LoadBalancer(BaseHTTPRequestHandler):
             return f"{hours} год {minutes} хв"
 
 
-def get_server_status(server_url):
+def estimate_wait_seconds(cost_ahead):
+    return wait_estimator.wait_seconds(cost_ahead, slot_ledger.in_flight(), slot_ledger.total_slots())
+
+
+def load_task_stats():
+    """Seeds the wait-time estimator with the run times of recently completed tasks."""
+    try:
+        response = backend_request('GET', backend_registry.main_url, '/api/task-stats/', timeout=5)
+        if response.status_code == 200:
+            wait_estimator.load(response.json().get('buckets', {}))
+    except Exception as e:
+        print(f"Не вдалося отримати статистику задач: {e}")
+
+
+def get_server_status(server_url, with_tasks=False):
+    """The backend's load; 'tasks' is its in-progress (task_id, number) list with with_tasks, else None."""
     try:
-        response = requests.get(
-            f"{server_url}/api/server-status/",
-            timeout=3
+        response = backend_request(
+            'GET',
+            server_url,
+            '/api/server-status/?tasks=1' if with_tasks else '/api/server-status/',
+            health_check=True,
+            headers={'X-Internal-Token': settings.INTERNAL_API_TOKEN} if with_tasks else None,
+            timeout=settings.BACKEND_HEALTH_CHECK_TIMEOUT
         )
         if response.status_code == 200:
             data = response.json()
+            tasks = None
+            if with_tasks:
+                tasks = data.get('tasks') or [[task_id, None] for task_id in data.get('task_ids', [])]
             return {
                 'busy': data.get('busy', False),
                 'in_progress': data.get('in_progress_tasks', 0),
                 'available_slots': data.get('available_slots', 0),
+                'tasks': tasks,
             }
         return None
     except Exception as e:
@@ -253,121 +940,355 @@ def get_server_status(server_url):
         return None
 
 
-def find_least_loaded_server():
-    available_servers = []
+def reload_backends():
+    try:
+        added, removed = backend_registry.reload()
+    except (OSError, ValueError) as e:
+        print(f"Не вдалося перечитати конфігурацію серверів: {e}")
+        return
 
-    for backend in BACKENDS:
-        server_url = backend['url']
-        status = get_server_status(server_url)
-        if status:
-            active_tasks = status.get('in_progress', 0)
-            available_slots = status.get('available_slots', 0)
-            if available_slots > 0:
-                available_servers.append((server_url, active_tasks))
+    if added or removed:
+        slot_ledger.set_servers(backend_registry.worker_urls())
+        print(f"Конфігурацію серверів оновлено, додано: {added}, видалено: {removed}")
+
+
+def probe_backend(backend):
+    probed_at = time.monotonic()
+    return backend.url, probed_at, get_server_status(backend.url)
+
+
+def reconcile_slots():
+    """
+    One health check round: picks up a changed backend configuration and probes
+    all backends concurrently (skipping those whose circuit is open). A worker
+    whose task count matches the ledger is only marked reachable; on a mismatch
+    its task list is fetched and replaces the worker's slot entries.
+    """
+    reload_backends()
+    workers = set(backend_registry.worker_urls())
+
+    for server_url, probed_at, status in health_executor.map(probe_backend, backend_registry.due_for_check()):
+        if server_url not in workers:
+            continue
+
+        if status is None:
+            slot_ledger.mark_unreachable(server_url)
+            continue
+
+        if status['in_progress'] == slot_ledger.task_count(server_url):
+            slot_ledger.mark_reachable(server_url)
+            continue
+
+        probed_at = time.monotonic()
+        status = get_server_status(server_url, with_tasks=True)
+        if status is None:
+            slot_ledger.mark_unreachable(server_url)
+            continue
+
+        drift = slot_ledger.reconcile(server_url, status['tasks'], probed_at)
+        if drift:
+            print(f"Звірка слотів {server_url}: виправлено розбіжностей: {drift}")
+
+    dispatch_wakeup.set()
 
-    if not available_servers:
-        return None
 
-    server_url, _ = min(available_servers, key=lambda x: x[1])
-    return server_url
+def health_checker():
+    stats_loaded_at = time.monotonic()
+
+    while True:
+        time.sleep(settings.BACKEND_HEALTH_CHECK_INTERVAL)
+        try:
+            reconcile_slots()
+            if time.monotonic() - stats_loaded_at >= settings.TASK_STATS_REFRESH_INTERVAL:
+                stats_loaded_at = time.monotonic()
+                load_task_stats()
+        except Exception as e:
+            print(f"Помилка перевірки серверів: {e}")
+            traceback.print_exc()
+
+
+def defer_user(user_id):
+    with deferred_users_lock:
+        deferred_users[user_id] = time.monotonic() + settings.DISPATCH_DEFER_SECONDS
+
+
+def undefer_user(user_id):
+    """Ends the user's deferral; True if there was one."""
+    with deferred_users_lock:
+        return deferred_users.pop(user_id, None) is not None
+
+
+def deferred_user_ids():
+    """Users whose queued tasks wait; a deferral that was never ended runs out after DISPATCH_DEFER_SECONDS."""
+    now = time.monotonic()
+    with deferred_users_lock:
+        for user_id, until in list(deferred_users.items()):
+            if until <= now:
+                del deferred_users[user_id]
+        return set(deferred_users)
+
+
+def claim_tasks(limit):
+    return task_queue.claim(limit, skip_users=deferred_user_ids())
+
+
+def claim_tasks_for_numbers(numbers):
+    return task_queue.claim_numbers(numbers, skip_users=deferred_user_ids())
+
+
+def requeue_task(task):
+    requeue_tasks([task])
+
+
+def requeue_tasks(tasks):
+    task_queue.requeue(tasks)
+
+
+def complete_task(task):
+    task_queue.complete(task)
+
+
+def restore_queue():
+    return task_queue.restore(wait_estimator.cost)
+
+
+def send_task(server_url, task):
+    """
+    Returns (placed, task_data). placed is True when the task reached the backend
+    (created or rejected for good), False when it has to go back to the queue.
+    Retries are safe: the backend deduplicates on X-Dispatch-Id, so a send that
+    timed out after the task was created is not created a second time. Raises
+    DispatchDeferred when the backend turns the user away with 429.
+    """
+    headers = dict(task['headers'])
+    headers['X-Dispatch-Id'] = task['dispatch_id']
+
+    try:
+        response = backend_request(
+            'POST',
+            server_url,
+            '/api/tasks/',
+            data=task['body'],
+            headers=headers,
+            timeout=30
+        )
+    except Exception as e:
+        print(f"Помилка відправки задачі: {e}")
+        return False, None
+
+    if response.status_code == 201:
+        task_data = response.json()
+        print(f"Задача #{task_data.get('id', '?')} успішно створена на {server_url}")
+        return True, task_data
+
+    if response.status_code == 429:
+        raise DispatchDeferred(response.text)
+
+    print(f"Помилка створення задачі: [{response.status_code}]")
+    print(f"Відповідь: {response.text}")
+    return response.status_code < 500, None
+
+
+def send_task_group(server_url, tasks):
+    """
+    send_task for several tasks of one user in a single bulk request. Returns
+    (placed, [task_data, ...]) with the task data in the order of tasks.
+    """
+    headers = {
+        key: value for key, value in tasks[0]['headers'].items()
+        if key.lower() not in ('content-length', 'content-type')
+    }
+    headers['X-Dispatch-Ids'] = ','.join(task['dispatch_id'] for task in tasks)
+
+    try:
+        response = backend_request(
+            'POST',
+            server_url,
+            '/api/tasks/bulk/',
+            json={'numbers': [task['number'] for task in tasks]},
+            headers=headers,
+            timeout=30
+        )
+    except Exception as e:
+        print(f"Помилка відправки задач: {e}")
+        return False, [None] * len(tasks)
+
+    if response.status_code == 201:
+        results = response.json()['results']
+        task_ids = ', '.join(f"#{data.get('id', '?')}" for data in results)
+        print(f"Задачі {task_ids} успішно створені на {server_url}")
+        return True, results
+
+    if response.status_code == 429:
+        raise DispatchDeferred(response.text)
+
+    print(f"Помилка створення задач: [{response.status_code}]")
+    print(f"Відповідь: {response.text}")
+    return response.status_code < 500, [None] * len(tasks)
+
+
+def settle_task(server_url, task, placed, task_data):
+    if task_data and task_data.get('status') == 'in_progress':
+        slot_ledger.confirm(server_url, task['dispatch_id'], task_data.get('id'), task['number'])
+    else:
+        slot_ledger.cancel(server_url, task['dispatch_id'])
+
+    if placed:
+        TASKS_DISPATCHED.inc(backend=server_url)
+        complete_task(task)
+    else:
+        DISPATCH_FAILURES.inc(backend=server_url)
+        # the backend is down or erroring: stop sending to it until the next reconciliation
+        slot_ledger.mark_unreachable(server_url)
+        requeue_task(task)
+
+
+def send_and_settle(server_url, tasks):
+    try:
+        if len(tasks) == 1:
+            placed, task_data = send_task(server_url, tasks[0])
+            results = [task_data]
+        else:
+            placed, results = send_task_group(server_url, tasks)
+    except DispatchDeferred as e:
+        # the backend is fine, the user is at their limit: their tasks stay queued
+        # but are passed over until one of their tasks finishes, and the slot goes
+        # to whoever is next
+        print(f"Задачі відкладено до звільнення квоти користувача: {e}")
+        DISPATCH_DEFERRED.inc(backend=server_url)
+        for user_id in {task['user_id'] for task in tasks}:
+            defer_user(user_id)
+        for task in tasks:
+            slot_ledger.cancel(server_url, task['dispatch_id'])
+        requeue_tasks(tasks)
+        dispatch_wakeup.set()
+        return
+    except Exception as e:
+        print(f"Помилка в Queue Processor: {e}")
+        traceback.print_exc()
+        placed, results = False, [None] * len(tasks)
+
+    for task, task_data in zip(tasks, results):
+        settle_task(server_url, task, placed, task_data)
+
+    dispatch_wakeup.set()
+
+
+def print_server_statuses(server_statuses):
+    print("\n СТАН СЕРВЕРІВ:")
+    for i, (server_url, status) in enumerate(server_statuses.items(), 1):
+        if not status['reachable']:
+            continue
+
+        print(f"Сервер {i} ({server_url}):")
+        print(f"В процесі: {status['in_progress']}/{settings.MAX_TASKS_PER_SERVER}")
+        print(f"Доступно слотів: {status['available_slots']}")
+        print(f"Статус: {'зайнятий' if status['available_slots'] == 0 else 'вільний'}")
+
+
+def authorization_header(headers):
+    return next((value for key, value in headers.items() if key.lower() == 'authorization'), None)
+
+
+def dispatch_cycle():
+    """
+    Fills every free slot across the worker backends in one pass: claims that many tasks in
+    the order chosen by the scheduling policy, plus every queued task for a number
+    already in flight, reserves a slot for each (shared per number) and sends
+    them all concurrently, the tasks of one user bound for one backend in a
+    single bulk request. Returns the number of tasks sent.
+    """
+    free_slots = slot_ledger.total_free_slots()
+    tasks = claim_tasks(free_slots) if free_slots else []
+
+    # queued tasks for a number that is being computed, or is about to be, ride along
+    # to that backend from wherever they are in the queue and take no slot of their own
+    numbers = slot_ledger.running_numbers() | {task['number'] for task in tasks}
+    if numbers:
+        tasks += claim_tasks_for_numbers(numbers)
+    if not tasks:
+        return 0
+
+    assignments = dict(slot_ledger.reserve([(task['dispatch_id'], task['number']) for task in tasks]))
+    assigned = [task for task in tasks if task['dispatch_id'] in assignments]
+    requeue_tasks([task for task in tasks if task['dispatch_id'] not in assignments])
+
+    if not assigned:
+        return 0
+
+    # one request per backend and token: a group goes to the bulk endpoint under the
+    # Authorization header all its tasks were submitted with, never another one
+    groups = {}
+    for task in assigned:
+        server_url = assignments[task['dispatch_id']]
+        authorization = authorization_header(task['headers'])
+        group_key = (server_url, authorization) if authorization else (server_url, task['dispatch_id'])
+        groups.setdefault(group_key, []).append(task)
+
+    print_server_statuses(slot_ledger.snapshot())
+    print(f"\nВідправка задач: {len(assigned)}")
+    for (server_url, _), group in groups.items():
+        for task in group:
+            print(f"Fibonacci({task['number']}) → {server_url}")
+        dispatch_executor.submit(send_and_settle, server_url, group)
+
+    return len(assigned)
 
 
 def queue_processor():
+    """
+    The queue store only guards the queue itself: tasks are claimed in one step,
+    every POST happens outside it, and a task that could not be placed is put
+    back with its original priority in one step.
+
+    The processor sleeps until something can change the outcome of a cycle:
+    a new task, a released slot, a finished send or a slot reconciliation.
+    With the shared database queue, tasks queued by other balancers are picked
+    up at the latest after DISPATCH_IDLE_TIMEOUT.
+    """
     print("\nQueue Processor")
-    
-    check_counter = 0
 
     while True:
-        try:
-            if not task_queue:
-                time.sleep(0.5)
-                continue
-            check_counter += 1
-
-            if check_counter % 15 == 0:
-                with queue_lock:
-                    queue_len = len(task_queue)
-                print(f"Queue Processor працює... (в черзі: {queue_len})")
-            
-            with queue_lock:
-                if not task_queue:
-                    continue
+        dispatch_wakeup.wait(timeout=settings.DISPATCH_IDLE_TIMEOUT)
+        dispatch_wakeup.clear()
+        DISPATCH_CYCLES.inc()
+        # no request cycle closes this thread's connection to the shared queue
+        close_old_connections()
 
-                print(f"   Задач в черзі: {len(task_queue)}\n")
-                
-                print("\n СТАН СЕРВЕРІВ:")
-                server_statuses = {}
-                for i, backend in enumerate(BACKENDS, 1):
-                    server_url = backend['url']
-                    status = get_server_status(server_url)
-                    
-                    if status:
-                        server_statuses[server_url] = status
-                        in_progress = status['in_progress']
-                        available = status['available_slots']
-                        
-                        print(f"Сервер {i} ({server_url}):")
-                        print(f"В процесі: {in_progress}/{settings.MAX_TASKS_PER_SERVER}")
-                        print(f"Доступно слотів: {available}")
-                        print(f"Статус: {'зайнятий' if status['busy'] else 'вільний'}")
-
-                if task_queue:
-                    task = task_queue[0]
-                    
-                    print(f"\nЗадача в черзі:")
-                    print(f"Fibonacci({task['number']})")
-                    
-                    free_server = find_least_loaded_server()
-                    
-                    if free_server:
-                        task_queue.popleft()
-                        remaining = len(task_queue)
-
-                        print(f"Сервер: {free_server}")
-                        print(f"Залишилось в черзі: {remaining}")
-                        
-                        try:
-                            
-                            response = requests.post(
-                                f"{free_server}/api/tasks/",
-                                data=task['body'],
-                                headers=task['headers'],
-                                timeout=30
-                            )
-                            
-                            if response.status_code == 201:
-                                task_data = response.json()
-                                task_id = task_data.get('id', '?')
-                                print(f"Задача #{task_id} успішно створена на {free_server}")
-                            else:
-                                print(f"Помилка створення задачі: [{response.status_code}]")
-                                print(f"Відповідь: {response.text}")
-                                
-                        except Exception as e:
-                            print(f"Помилка відправки задачі: {e}")
-                            task_queue.appendleft(task)
-                    
-                    else:
-                        print(f"\nВСІ СЕРВЕРИ ЗАЙНЯТІ")
-                        print(f"8001: {server_statuses.get(BACKENDS[0]['url'], {}).get('in_progress', '?')}/2 задач")
-                        print(f"8002: {server_statuses.get(BACKENDS[1]['url'], {}).get('in_progress', '?')}/2 задач")
-                        print(f"Задача залишається в черзі, очікує звільнення...\n")
-                
-                
+        try:
+            sent = dispatch_cycle()
         except Exception as e:
             print(f"Помилка в Queue Processor: {e}")
             traceback.print_exc()
+            continue
+
+        if sent:
+            print(f"Залишилось в черзі: {len(task_queue)}\n")
 
 
 if __name__ == '__main__':
-    PORT = 3000
+    PORT = settings.LOAD_BALANCER_PORT
     print(f"LOAD BALANCER")
     print(f"URL: http://localhost:{PORT}")
-    print(f"\nBACKEND СЕРВЕРИ:")
-    for i, backend in enumerate(BACKENDS, 1):
-        print(f"   {i+1}. {backend['url']}")
+    print(f"\nОСНОВНИЙ СЕРВЕР: {backend_registry.main_url}")
+    print(f"BACKEND СЕРВЕРИ:")
+    for i, server_url in enumerate(backend_registry.worker_urls(), 1):
+        print(f"   {i}. {server_url}")
+    if settings.BACKEND_REGISTRY_FILE:
+        print(f"Конфігурація серверів: {settings.BACKEND_REGISTRY_FILE}")
     print(f"Максимум задач на сервер: {settings.MAX_TASKS_PER_SERVER}")
     print(f"Середній час виконання: {settings.AVERAGE_TASK_TIME}с")
+    print(f"Потоків обробки запитів: {settings.LOAD_BALANCER_WORKERS}")
+
+    print("Перевірка серверів...")
+    reconcile_slots()
+    load_task_stats()
+    health_thread = Thread(target=health_checker, daemon=True)
+    health_thread.start()
+
+    restored = restore_queue()
+    print(f"Відновлено задач з журналу черги: {restored}")
+    dispatch_wakeup.set()
 
     print("Запуск Queue Processor...")
     queue_thread = Thread(target=queue_processor, daemon=True)
@@ -377,9 +1298,18 @@ if __name__ == '__main__':
     print("\nРобота запущена\n")
     
     try:
-        server = HTTPServer(('0.0.0.0', PORT), LoadBalancer)
+        server = ThreadPoolHTTPServer(
+            ('0.0.0.0', PORT),
+            LoadBalancer,
+            max_workers=settings.LOAD_BALANCER_WORKERS,
+            max_pending=settings.LOAD_BALANCER_MAX_PENDING,
+            max_streams=settings.LOAD_BALANCER_MAX_STREAMS
+        )
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n\nLoad Balancer зупинено!")
-        print(f"Задач залишилось в черзі: {len(task_queue)}")
-        server.shutdown()
\ No newline at end of file
+        print(f"Задач збережено в журналі черги: {len(task_queue)}")
+        server.server_close()
+        dispatch_executor.shutdown(wait=False)
+        upstream.close()
+        task_queue.close()
\ No newline at end of file
@@ -9,9 +9,4 @@ Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd C:\Users\ells\
 Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd C:\Users\ells\Desktop\prog\web-project; `$env:SERVER_PORT='8002'; python manage.py runserver 127.0.0.1:8002"
 Start-Sleep -Seconds 5
 
-Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd C:\Users\ells\Desktop\prog\web-project; `$env:SERVER_PORT='8001'; python manage.py process_tasks"
-
-Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd C:\Users\ells\Desktop\prog\web-project; `$env:SERVER_PORT='8002'; python manage.py process_tasks"
-Start-Sleep -Seconds 3
-
 Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd C:\Users\ells\Desktop\prog\web-project; python load_balancer.py"
\ No newline at end of file
@@ -6,44 +6,28 @@ class TasksConfig(AppConfig):
     name = 'tasks'
 
     def ready(self):
-        from django.utils import timezone
-        from .models import Task
+        import multiprocessing
+        import os
         import sys
 
-        if 'runserver' in sys.argv or 'waitress-serve' in ' '.join(sys.argv) or 'gunicorn' in sys.argv[0]:
-            
-            try:
-                stuck_tasks = Task.objects.filter(status='in_progress')
-                count = stuck_tasks.count()
-
-                if count > 0:
-                    print(f'Знайдено {count} завислих задач')
-
-                    stuck_tasks.update(
-                        status='failed',
-                        completed_at=timezone.now()
-                    )
-                    
-                    print(f'Оновлено {count} задач → status=failed')
-                else:
-                    print('Завислих задач не знайдено')
+        # executor worker processes inherit the server's argv but must not touch its tasks
+        if multiprocessing.parent_process() is not None:
+            return
 
-                try:
-                    from background_task.models import Task as BackgroundTask, CompletedTask
+        # runserver's autoreloader parent only watches files; the child it starts serves
+        if 'runserver' in sys.argv and '--noreload' not in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
 
-                    in_progress__count = BackgroundTask.objects.count()
-                    completed_count = CompletedTask.objects.count()
-
-                    if in_progress__count > 0:
-                        BackgroundTask.objects.all().delete()
-                        print(f' Видалено {in_progress__count} Progress Tasks')
+        if 'runserver' in sys.argv or 'waitress-serve' in ' '.join(sys.argv) or 'gunicorn' in sys.argv[0]:
 
-                    if completed_count > 0:
-                        CompletedTask.objects.all().delete()
-                        print(f' Видалено {completed_count} Completed Tasks')
+            try:
+                from .executor import reclaim_stale_tasks, resume_tasks, start_reclaimer
 
-                except ImportError:
-                    print('django-background-tasks не встановлено')
+                server_port = os.getenv("SERVER_PORT", "unknown")
+                server_url = f"http://127.0.0.1:{server_port}"
+                resume_tasks(server_url)
+                reclaim_stale_tasks(server_url)
+                start_reclaimer(server_url)
             except Exception as e:
                 if 'no such table' not in str(e).lower():
-                    print(f'Помилка очищення background tasks: {e}')
\ No newline at end of file
+                    print(f'Помилка відновлення перерваних задач: {e}')
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from .models import FibonacciResult
+
+
+def get_cached_result(number):
+    entry = FibonacciResult.objects.filter(number=number).only('id', 'result').first()
+    if entry is None:
+        return None
+
+    FibonacciResult.objects.filter(id=entry.id).update(
+        hits=F('hits') + 1,
+        last_used_at=timezone.now()
+    )
+    return entry.result
+
+
+def get_cached_results(numbers):
+    """{number: result} for the numbers that are cached, in one query."""
+    entries = list(FibonacciResult.objects.filter(number__in=set(numbers)).only('id', 'number', 'result'))
+    if entries:
+        FibonacciResult.objects.filter(id__in=[entry.id for entry in entries]).update(
+            hits=F('hits') + 1,
+            last_used_at=timezone.now()
+        )
+    return {entry.number: entry.result for entry in entries}
+
+
+def store_result(number, result):
+    try:
+        FibonacciResult.objects.update_or_create(
+            number=number,
+            defaults={'result': result, 'last_used_at': timezone.now()}
+        )
+    except IntegrityError:
+        # another server stored the same number first; the value is identical
+        return
+
+    evict_stale_results()
+
+
+def evict_stale_results():
+    stale_ids = list(
+        FibonacciResult.objects.order_by('-last_used_at')
+        .values_list('id', flat=True)[settings.FIBONACCI_CACHE_SIZE:]
+    )
+    if stale_ids:
+        FibonacciResult.objects.filter(id__in=stale_ids).delete()
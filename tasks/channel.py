@@ -0,0 +1,66 @@
+"""
+Side channel between the API and running workers for the things that change
+often: a task's live progress, a cancellation request and the tasks attached
+to a running computation (see tasks.executor). Backed by the
+TASK_CHANNEL_CACHE cache (file-based by default, so separate worker processes on
+the same host see the same values). The database copy of progress is only
+refreshed every TASK_PROGRESS_FLUSH_INTERVAL seconds.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[settings.TASK_CHANNEL_CACHE]
+
+
+def _progress_key(task_id):
+    return f"task:{task_id}:progress"
+
+
+def _cancel_key(task_id):
+    return f"task:{task_id}:cancel"
+
+
+def _followers_key(task_id):
+    return f"task:{task_id}:followers"
+
+
+def publish_progress(task_id, progress):
+    _cache().set(_progress_key(task_id), progress)
+
+
+def read_progress(task_id):
+    return _cache().get(_progress_key(task_id))
+
+
+def read_progress_many(task_ids):
+    values = _cache().get_many([_progress_key(task_id) for task_id in task_ids])
+    return {
+        task_id: values[_progress_key(task_id)]
+        for task_id in task_ids if _progress_key(task_id) in values
+    }
+
+
+def request_cancel(task_id):
+    _cache().set(_cancel_key(task_id), True)
+
+
+def is_cancel_requested(task_id):
+    return bool(_cache().get(_cancel_key(task_id)))
+
+
+def clear(task_id):
+    _cache().delete_many([_progress_key(task_id), _cancel_key(task_id)])
+
+
+def set_followers(task_id, follower_ids):
+    _cache().set(_followers_key(task_id), list(follower_ids))
+
+
+def read_followers(task_id):
+    return _cache().get(_followers_key(task_id)) or []
+
+
+def clear_followers(task_id):
+    _cache().delete(_followers_key(task_id))
@@ -0,0 +1,133 @@
+"""
+Conditional GET and delta sync for the polled task endpoints.
+
+Every write to a Task bumps its updated_at (see TaskQuerySet.update) and every
+delete leaves a DeletedTask tombstone, so the user's most recently changed task
+and most recent tombstone are a version stamp for their whole task set that
+costs two index probes. ETags are built from that stamp plus the live
+progress of running tasks, which lives in the task channel rather than the
+database; a matching If-None-Match is answered with 304 before any list
+query or serialization happens.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .counters import user_in_progress
+from .models import DeletedTask, Task
+from .pagination import decode_cursor, encode_cursor, page_size, requested_fields
+from . import channel
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def task_set_version(user_id):
+    """(updated_at, id) of the user's most recently changed task and (deleted_at, task_id) of their last delete."""
+    changed = (
+        Task.objects.filter(user_id=user_id)
+        .order_by('-updated_at', '-id')
+        .values_list('updated_at', 'id')
+        .first()
+    )
+    deleted = (
+        DeletedTask.objects.filter(user_id=user_id)
+        .order_by('-deleted_at', '-task_id')
+        .values_list('deleted_at', 'task_id')
+        .first()
+    )
+    return changed, deleted
+
+
+def delete_task(task):
+    """Deletes the task and leaves its tombstone in the same transaction."""
+    with transaction.atomic():
+        DeletedTask.objects.create(user_id=task.user_id, task_id=task.id)
+        task.delete()
+
+
+def running_progress(user_id):
+    """Live progress of the user's running tasks, skipped when the counter says there are none."""
+    if not user_in_progress(user_id):
+        return []
+    task_ids = list(
+        Task.objects.filter(user_id=user_id, status='in_progress').order_by('id').values_list('id', flat=True)
+    )
+    return sorted(channel.read_progress_many(task_ids).items())
+
+
+def task_list_etag(request, live_progress=False):
+    user_id = request.user.id
+    version = task_set_version(user_id)
+    live = running_progress(user_id) if live_progress else None
+    return make_etag('tasks', user_id, request.get_full_path(), version, live)
+
+
+def conditional_response(request, etag, build):
+    """304 if the client already has etag, otherwise a 200 with build()'s data."""
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(build())
+    response['ETag'] = etag
+    # the browser keeps the body and revalidates every poll with If-None-Match
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def task_changes(request, queryset):
+    """
+    Tasks changed after the ?since= token, oldest change first, as
+    {'results': [...], 'deleted': [task ids], 'since': token for the next call,
+    'has_more': bool}. Without a token, starts from the beginning (a full sync)
+    and there is nothing to delete. A deletion can be listed on more than one
+    call; deleting again is harmless for the client.
+    """
+    fields = requested_fields(request)
+    size = page_size(request)
+
+    queryset = queryset.order_by('updated_at', 'id')
+    since = request.query_params.get('since')
+    deleted = DeletedTask.objects.none()
+    if since:
+        value, pk = decode_cursor(since)
+        queryset = queryset.filter(Q(updated_at__gt=value) | Q(updated_at=value, id__gt=pk))
+        deleted = DeletedTask.objects.filter(user_id=request.user.id, deleted_at__gte=value)
+
+    # stamps are taken before commit, so a slow transaction can land slightly in the
+    # past; the token stays TASK_SYNC_LAG behind now and such rows are sent again
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_SYNC_LAG)
+
+    columns = list(dict.fromkeys(fields + ['updated_at', 'id', 'status']))
+    rows = list(queryset.values(*columns)[:size + 1])
+    has_more = len(rows) > size
+    rows = rows[:size]
+
+    if has_more:
+        anchor = rows[-1]
+    else:
+        anchor = next((row for row in reversed(rows) if row['updated_at'] <= cutoff), None)
+    next_since = encode_cursor(anchor['updated_at'], anchor['id']) if anchor else since
+    if has_more:
+        # the rest are listed again from the next token
+        deleted = deleted.filter(deleted_at__lte=anchor['updated_at'])
+
+    if 'progress' in fields:
+        running = {row['id']: row for row in rows if row['status'] == 'in_progress'}
+        for task_id, progress in channel.read_progress_many(list(running)).items():
+            running[task_id]['progress'] = progress
+
+    return {
+        'results': [{field: row[field] for field in fields} for row in rows],
+        'deleted': list(deleted.order_by('deleted_at', 'task_id').values_list('task_id', flat=True)),
+        'since': next_since,
+        'has_more': has_more,
+    }
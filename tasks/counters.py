@@ -0,0 +1,90 @@
+"""
+Per-backend and per-user counts of in-progress tasks, so server_status and quota
+checks read one row instead of counting Task rows.
+
+Every change of a task into or out of 'in_progress' goes through start_task(),
+create_tasks() or finish_task(), and every move of a running task to another
+backend through reassign_task(), which adjust the counters in the same
+transaction as the change. finish_task() is a conditional UPDATE, so a task that is cancelled and
+completes at the same moment is only counted out once.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ServerTaskCounter, Task, UserTaskCounter
+
+
+def _adjust(model, lookup, delta):
+    if model.objects.filter(**lookup).update(in_progress=F('in_progress') + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(in_progress=max(0, delta), **lookup)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(in_progress=F('in_progress') + delta)
+
+
+def _adjust_counters(server_url, user_id, delta):
+    if server_url:
+        _adjust(ServerTaskCounter, {'server_url': server_url}, delta)
+    _adjust(UserTaskCounter, {'user_id': user_id}, delta)
+
+
+def start_task(**fields):
+    """Creates an in-progress Task and counts it."""
+    with transaction.atomic():
+        task = Task.objects.create(status='in_progress', **fields)
+        _adjust_counters(task.server_url, task.user_id, 1)
+    return task
+
+
+def create_tasks(tasks):
+    """Inserts unsaved Tasks in one statement and counts the in-progress ones."""
+    with transaction.atomic():
+        tasks = Task.objects.bulk_create(tasks)
+        running = Counter((task.server_url, task.user_id) for task in tasks if task.status == 'in_progress')
+        for (server_url, user_id), count in running.items():
+            _adjust_counters(server_url, user_id, count)
+    return tasks
+
+
+def finish_task(task, **fields):
+    """
+    Moves an in-progress task to fields['status'] (plus any other fields) if it is
+    still in progress. Returns False when someone else finished it first.
+    """
+    with transaction.atomic():
+        updated = Task.objects.filter(id=task.id, status='in_progress').update(**fields)
+        if updated:
+            _adjust_counters(task.server_url, task.user_id, -1)
+    return bool(updated)
+
+
+def reassign_task(task_id, from_url, updated_at, to_url):
+    """
+    Moves an in-progress task from backend from_url to to_url, provided it was not
+    written since updated_at. Returns False when it was, or someone else moved it first.
+    """
+    with transaction.atomic():
+        updated = Task.objects.filter(
+            id=task_id,
+            status='in_progress',
+            server_url=from_url,
+            updated_at=updated_at
+        ).update(server_url=to_url)
+        if updated:
+            if from_url:
+                _adjust(ServerTaskCounter, {'server_url': from_url}, -1)
+            _adjust(ServerTaskCounter, {'server_url': to_url}, 1)
+    return bool(updated)
+
+
+def server_in_progress(server_url):
+    return ServerTaskCounter.objects.filter(server_url=server_url).values_list('in_progress', flat=True).first() or 0
+
+
+def user_in_progress(user_id):
+    return UserTaskCounter.objects.filter(user_id=user_id).values_list('in_progress', flat=True).first() or 0
+
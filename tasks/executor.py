@@ -0,0 +1,256 @@
+"""
+In-process task executor: a pool of TASK_EXECUTOR_WORKERS worker processes per
+backend, fed directly by TaskViewSet.create. Workers are spawned (not forked) so
+they never inherit the server's threads or database connections.
+
+Computations are single-flight per number: a task for a number that is already
+queued or running here attaches to that computation as a follower instead of
+taking a worker. The worker publishes its progress to the followers and keeps
+going while any of them is still running, even if the task it was started for
+is cancelled; when it ends, the followers still in progress get its result, or
+are submitted again if it produced none.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from functools import partial
+from threading import Lock, Thread
+
+import requests
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import channel
+
+_executor = None
+_executor_lock = Lock()
+_pending = set()
+# number -> {'leader': task_id, 'followers': [task_id, ...], 'future': Future}
+_flights = {}
+_flights_lock = Lock()
+
+
+def _init_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def _run_fibonacci_task(task_id, n):
+    from .tasks import calculate_fibonacci_task
+    return calculate_fibonacci_task(task_id, n)
+
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.TASK_EXECUTOR_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return _executor
+
+
+def _reset_executor(broken):
+    global _executor
+
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_task(task_id, n):
+    with _flights_lock:
+        _pending.add(task_id)
+        flight = _flights.get(n)
+        if flight is not None:
+            flight['followers'].append(task_id)
+            channel.set_followers(flight['leader'], flight['followers'])
+            return flight['future']
+
+        executor = get_executor()
+        try:
+            future = executor.submit(_run_fibonacci_task, task_id, n)
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            executor = get_executor()
+            future = executor.submit(_run_fibonacci_task, task_id, n)
+        flight = _flights[n] = {'leader': task_id, 'followers': [], 'future': future}
+
+    # outside the lock: the callback runs right away if the future is already done
+    future.add_done_callback(partial(_on_task_done, flight, n, executor))
+    return future
+
+
+def pending_count():
+    return len(_pending)
+
+
+def running_computations():
+    """Computations queued or running in this process, each taking one worker slot."""
+    return len(_flights)
+
+
+def resume_tasks(server_url):
+    """
+    Submits the tasks left in progress on server_url by a previous run of this
+    backend, oldest first; each continues from its checkpoint if it has one.
+    """
+    from .models import Task
+
+    interrupted_tasks = list(
+        Task.objects.filter(status='in_progress', server_url=server_url)
+        .order_by('created_at')
+        .values_list('id', 'number', 'checkpoint')
+    )
+
+    if not interrupted_tasks:
+        print('Перерваних задач не знайдено')
+        return 0
+
+    print(f'Знайдено {len(interrupted_tasks)} перерваних задач')
+    for task_id, number, checkpoint in interrupted_tasks:
+        submit_task(task_id, number)
+        origin = 'з контрольної точки' if checkpoint else 'з початку'
+        print(f'Задача {task_id} Fibonacci({number}) відновлена {origin}')
+    return len(interrupted_tasks)
+
+
+def _backend_answers(server_url):
+    try:
+        requests.get(f"{server_url}/api/server-status/", timeout=2)
+    except requests.RequestException:
+        return False
+    return True
+
+
+def reclaim_stale_tasks(server_url):
+    """
+    Takes over the tasks left in progress by a backend that is gone: not written
+    for TASK_STALE_AFTER seconds (a running task is flushed every
+    TASK_PROGRESS_FLUSH_INTERVAL) on a backend that no longer answers. Each is
+    moved to server_url and submitted here, continuing from its checkpoint.
+    """
+    from .counters import reassign_task
+    from .models import Task
+
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_STALE_AFTER)
+    stale_tasks = list(
+        Task.objects.filter(status='in_progress', updated_at__lt=cutoff)
+        .exclude(server_url=server_url)
+        .order_by('created_at')
+        .values_list('id', 'number', 'server_url', 'updated_at')
+    )
+
+    answering = {}
+    reclaimed = 0
+    for task_id, number, owner, updated_at in stale_tasks:
+        if owner and owner not in answering:
+            answering[owner] = _backend_answers(owner)
+        if owner and answering[owner]:
+            continue
+        if reassign_task(task_id, owner, updated_at, server_url):
+            submit_task(task_id, number)
+            print(f'Задача {task_id} Fibonacci({number}) перейшла з {owner} на {server_url}')
+            reclaimed += 1
+    return reclaimed
+
+
+def start_reclaimer(server_url):
+    """Runs reclaim_stale_tasks every TASK_RECLAIM_INTERVAL seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(settings.TASK_RECLAIM_INTERVAL)
+            try:
+                reclaim_stale_tasks(server_url)
+            except Exception as e:
+                print(f'Помилка перевірки покинутих задач: {e}')
+            finally:
+                connection.close()
+
+    Thread(target=run, name='task-reclaimer', daemon=True).start()
+
+
+def _on_task_done(flight, n, executor, future):
+    task_id = flight['leader']
+    with _flights_lock:
+        if _flights.get(n) is flight:
+            del _flights[n]
+        followers = list(flight['followers'])
+        _pending.discard(task_id)
+        _pending.difference_update(followers)
+    if followers:
+        channel.clear_followers(task_id)
+
+    exception = None if future.cancelled() else future.exception()
+    stats = future.result() if exception is None and not future.cancelled() else None
+
+    if exception is None and not future.cancelled():
+        if stats is not None:
+            from .metrics import record_task_run
+            record_task_run(stats)
+    else:
+        if future.cancelled():
+            error = 'Task was cancelled before it started'
+        else:
+            error = str(exception) or exception.__class__.__name__
+
+        # the worker itself records normal failures; this only catches a worker that died
+        from .models import Task
+        from .counters import finish_task
+        from .notify import notify_task_finished
+
+        task = Task.objects.filter(id=task_id).first()
+        if task and finish_task(task, status='failed', error_message=error, completed_at=timezone.now()):
+            task.status = 'failed'
+            notify_task_finished(task)
+
+        if isinstance(exception, BrokenProcessPool):
+            _reset_executor(executor)
+
+    if followers:
+        _finish_followers(followers, n, stats.get('result') if stats else None)
+
+
+def _finish_followers(follower_ids, n, result):
+    """
+    Completes the followers still in progress with the computation's result; a
+    cancelled follower is left alone. Without a result (the leader failed, or
+    was cancelled with no follower running at the time) they are submitted
+    again, and the first of them starts a new computation.
+    """
+    from .models import Task
+    from .counters import finish_task
+    from .notify import notify_task_finished
+
+    for task_id in follower_ids:
+        channel.clear(task_id)
+    tasks = list(Task.objects.filter(id__in=follower_ids, status='in_progress').order_by('id'))
+
+    if result is None:
+        for task in tasks:
+            submit_task(task.id, n)
+        return
+
+    completed_at = timezone.now()
+    for task in tasks:
+        completed = finish_task(
+            task,
+            result=result,
+            progress=100,
+            status='completed',
+            checkpoint=None,
+            completed_at=completed_at
+        )
+        if completed:
+            task.status = 'completed'
+            task.completed_at = completed_at
+            notify_task_finished(task)
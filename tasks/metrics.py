@@ -0,0 +1,55 @@
+"""
+Backend metrics, rendered at /metrics. Each server process (and not each executor
+worker) has its own registry: workers report what they did through the result of
+their future, which is recorded in the server process by the executor.
+"""
+import time
+
+from django.http import HttpResponse
+
+from backend.metrics import CONTENT_TYPE, DURATION_BUCKETS, Registry, bucket_label
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram('backend_request_duration_seconds', 'Time to handle a request, by route')
+TASKS_FINISHED = registry.counter('backend_tasks_finished_total', 'Tasks finished by the executor, by status')
+TASK_DURATION = registry.histogram(
+    'backend_task_duration_seconds',
+    'Executor run time of finished tasks by bit length of the number',
+    buckets=DURATION_BUCKETS
+)
+WORKER_ITERATIONS = registry.counter('backend_worker_iterations_total', 'Fast-doubling steps run by executor workers')
+WORKER_BUSY_SECONDS = registry.counter('backend_worker_busy_seconds_total', 'Time executor workers spent running tasks')
+
+
+def _pending_tasks():
+    from .executor import pending_count
+    return pending_count()
+
+
+registry.gauge('backend_executor_pending_tasks', 'Tasks submitted to the executor and not finished yet', _pending_tasks)
+
+
+def record_task_run(stats):
+    TASKS_FINISHED.inc(status=stats['status'])
+    TASK_DURATION.observe(stats['seconds'], bucket=bucket_label(stats['number']))
+    WORKER_ITERATIONS.inc(stats['iterations'])
+    WORKER_BUSY_SECONDS.inc(stats['seconds'])
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+
+        match = request.resolver_match
+        route = (match.url_name or match.view_name) if match else 'unresolved'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route=route)
+        return response
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FibonacciResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField(unique=True)),
+                ('result', models.TextField()),
+                ('hits', models.IntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
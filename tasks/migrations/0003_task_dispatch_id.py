@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_fibonacci_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='dispatch_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
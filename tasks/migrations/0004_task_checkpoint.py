@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_task_dispatch_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='checkpoint',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_task_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
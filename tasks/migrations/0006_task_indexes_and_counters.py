@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_running_tasks(apps, schema_editor):
+    Task = apps.get_model('tasks', 'Task')
+    ServerTaskCounter = apps.get_model('tasks', 'ServerTaskCounter')
+    UserTaskCounter = apps.get_model('tasks', 'UserTaskCounter')
+    running = Task.objects.filter(status='in_progress').order_by()
+
+    ServerTaskCounter.objects.bulk_create([
+        ServerTaskCounter(server_url=row['server_url'], in_progress=row['count'])
+        for row in running.exclude(server_url=None).values('server_url').annotate(count=Count('id'))
+    ])
+    UserTaskCounter.objects.bulk_create([
+        UserTaskCounter(user_id=row['user'], in_progress=row['count'])
+        for row in running.values('user').annotate(count=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tasks', '0005_task_started_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerTaskCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('server_url', models.CharField(max_length=255, unique=True)),
+                ('in_progress', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserTaskCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='task_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('in_progress', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'in_progress')), fields=['server_url', 'created_at'], name='task_running_server_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'in_progress')), fields=['user', '-created_at'], name='task_running_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'in_progress'), _negated=True), fields=['user', '-completed_at'], name='task_finished_user_idx'),
+        ),
+        migrations.RunPython(count_running_tasks, migrations.RunPython.noop),
+    ]
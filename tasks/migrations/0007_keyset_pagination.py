@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_completed_at(apps, schema_editor):
+    # history pages are keyed on completed_at, so finished tasks must have one
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.exclude(status='in_progress').filter(completed_at__isnull=True).update(completed_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_task_indexes_and_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_running_user_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_finished_user_idx',
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'in_progress')), fields=['user', '-created_at', '-id'], name='task_running_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='task_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status', 'in_progress'), _negated=True), fields=['user', '-completed_at', '-id'], name='task_finished_user_idx'),
+        ),
+    ]
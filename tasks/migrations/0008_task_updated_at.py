@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    # AddField stamps every existing row with the migration time
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.update(updated_at=Coalesce(F('completed_at'), F('created_at')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_keyset_pagination'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='task_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_task_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dispatch_id', models.CharField(max_length=64, unique=True)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('number', models.IntegerField()),
+                ('body', models.BinaryField()),
+                ('headers', models.JSONField(default=dict)),
+                ('cost', models.FloatField(default=0)),
+                ('priority', models.FloatField()),
+                ('virtual_start', models.FloatField(default=0)),
+                ('queued_at', models.DateTimeField()),
+                ('lease_owner', models.CharField(blank=True, max_length=128, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['priority', 'id'], name='queued_task_order_idx'), models.Index(fields=['user_id', 'priority', 'id'], name='queued_task_user_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+class TaskQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # auto_now only applies to save(); every queryset update bumps the stamp too
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
 
 class Task(models.Model):
     STATUS_CHOICES = [
@@ -16,12 +25,112 @@ class Task(models.Model):
     result = models.TextField(null=True, blank=True)
     error_message = models.TextField(null=True, blank=True)
     server_url = models.CharField(max_length=255, null=True, blank=True)
+    dispatch_id = models.CharField(max_length=64, null=True, blank=True, unique=True)
+    checkpoint = models.TextField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TaskQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # server_status?tasks=1 and the restart resume in executor.resume_tasks
+            models.Index(
+                fields=['server_url', 'created_at'],
+                condition=models.Q(status='in_progress'),
+                name='task_running_server_idx'
+            ),
+            # active and the cursor-paginated lists
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                condition=models.Q(status='in_progress'),
+                name='task_running_user_idx'
+            ),
+            # all tasks, cursor-paginated
+            models.Index(fields=['user', '-created_at', '-id'], name='task_user_created_idx'),
+            # history, cursor-paginated
+            models.Index(
+                fields=['user', '-completed_at', '-id'],
+                condition=~models.Q(status='in_progress'),
+                name='task_finished_user_idx'
+            ),
+            # ETag version stamps and the changes (delta sync) endpoint
+            models.Index(fields=['user', 'updated_at', 'id'], name='task_user_updated_idx'),
+        ]
     
     def __str__(self):
-        return f"Task {self.id} - Fibonacci({self.number}) - {self.status}"
\ No newline at end of file
+        return f"Task {self.id} - Fibonacci({self.number}) - {self.status}"
+
+
+class DeletedTask(models.Model):
+    """Tombstone of a deleted task, so ETag versions and the changes endpoint see the deletion."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='deleted_tasks')
+    task_id = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'task_id'], name='deleted_task_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Task {self.task_id} deleted at {self.deleted_at}"
+
+
+class ServerTaskCounter(models.Model):
+    """In-progress task count per backend, kept in step with Task status changes by tasks.counters."""
+    server_url = models.CharField(max_length=255, unique=True)
+    in_progress = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.server_url}: {self.in_progress}"
+
+
+class UserTaskCounter(models.Model):
+    """In-progress task count per user, kept in step with Task status changes by tasks.counters."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='task_counter')
+    in_progress = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.in_progress}"
+
+
+class FibonacciResult(models.Model):
+    number = models.IntegerField(unique=True)
+    result = models.TextField()
+    hits = models.IntegerField(default=0)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Fibonacci({self.number}) = {self.result}"
+
+class QueuedTask(models.Model):
+    """
+    A task waiting in the load balancers' shared queue (QUEUE_BACKEND = 'database').
+    A balancer that claims a row leases it until lease_expires_at; a row whose
+    lease ran out is visible to every balancer again.
+    """
+    dispatch_id = models.CharField(max_length=64, unique=True)
+    user_id = models.IntegerField(null=True, blank=True)
+    number = models.IntegerField()
+    body = models.BinaryField()
+    headers = models.JSONField(default=dict)
+    cost = models.FloatField(default=0)
+    priority = models.FloatField()
+    virtual_start = models.FloatField(default=0)
+    queued_at = models.DateTimeField()
+    lease_owner = models.CharField(max_length=128, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['priority', 'id'], name='queued_task_order_idx'),
+            models.Index(fields=['user_id', 'priority', 'id'], name='queued_task_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Queued {self.dispatch_id} - Fibonacci({self.number})"
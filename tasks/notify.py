@@ -0,0 +1,30 @@
+from threading import Thread
+import requests
+from django.conf import settings
+
+
+def notify_task_finished(task):
+    """Tells the load balancer that the task no longer occupies a slot. Fire-and-forget:
+    a lost notification is corrected by the balancer's periodic slot reconciliation."""
+    payload = {
+        'task_id': task.id,
+        'user_id': task.user_id,
+        'server_url': task.server_url,
+        'status': task.status,
+        'number': task.number,
+    }
+    if task.status == 'completed' and task.started_at and task.completed_at:
+        payload['duration'] = (task.completed_at - task.started_at).total_seconds()
+    Thread(target=_post_slot_release, args=(payload,), daemon=True).start()
+
+
+def _post_slot_release(payload):
+    try:
+        requests.post(
+            f"{settings.LOAD_BALANCER_URL}/api/internal/slot-release/",
+            json=payload,
+            headers={'X-Internal-Token': settings.INTERNAL_API_TOKEN},
+            timeout=2
+        )
+    except requests.RequestException as e:
+        print(f"Не вдалося повідомити балансувальник про задачу {payload['task_id']}: {e}")
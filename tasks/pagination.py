@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination and column projection for the read-only task lists.
+
+Pages are ordered by (order_field, id), newest first; the cursor is the last row's
+(order_field, id), so every page is one index range scan however deep it is.
+Rows are loaded with .values() over the requested columns only and returned
+as-is, without going through TaskSerializer.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from . import channel
+
+LIST_FIELDS = [
+    'id', 'number', 'status', 'progress', 'result',
+    'error_message', 'server_url', 'created_at', 'completed_at'
+]
+
+
+def encode_cursor(value, pk):
+    data = json.dumps({'v': value.isoformat(), 'id': pk})
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value = parse_datetime(data['v'])
+        pk = int(data['id'])
+    except (ValueError, KeyError, TypeError):
+        value = None
+    if value is None:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return value, pk
+
+
+def requested_fields(request):
+    raw = request.query_params.get('fields')
+    if not raw:
+        return list(LIST_FIELDS)
+
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in LIST_FIELDS]
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+    return fields
+
+
+def page_size(request):
+    try:
+        size = int(request.query_params.get('page_size', settings.TASK_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({'page_size': 'Must be an integer'})
+    return max(1, min(size, settings.TASK_MAX_PAGE_SIZE))
+
+
+def paginate_tasks(request, queryset, order_field, live_progress=False):
+    """
+    Returns {'results': [...], 'next': cursor or None} for one page of queryset.
+    With live_progress, in-progress rows get their progress from the task channel.
+    """
+    fields = requested_fields(request)
+    size = page_size(request)
+
+    queryset = queryset.order_by(f'-{order_field}', '-id')
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{order_field}__lt': value}) | Q(**{order_field: value, 'id__lt': pk}))
+
+    columns = list(dict.fromkeys(fields + [order_field, 'id', 'status']))
+    rows = list(queryset.values(*columns)[:size + 1])
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1][order_field], rows[-1]['id'])
+
+    if live_progress and 'progress' in fields:
+        running = {row['id']: row for row in rows if row['status'] == 'in_progress'}
+        for task_id, progress in channel.read_progress_many(list(running)).items():
+            running[task_id]['progress'] = progress
+
+    return {
+        'results': [{field: row[field] for field in fields} for row in rows],
+        'next': next_cursor,
+    }
@@ -45,17 +45,10 @@ class TaskSerializer(serializers.ModelSerializer):
 
 class TaskCreateSerializer(serializers.Serializer):
     number = serializers.IntegerField(min_value=0, max_value=settings.MAX_FIBONACCI_NUMBER)
-    
-    def validate_tasks(self, value):
-        user = self.context['request'].user
-        active_tasks = Task.objects.filter(
-            user=user,
-            status__in=['in_progress']
-        ).count()
-        
-        if active_tasks >= settings.MAX_TASKS_PER_USER:
-            raise serializers.ValidationError(
-                f"Maximum active tasks ({settings.MAX_TASKS_PER_USER}) reached"
-            )
 
-        return value
\ No newline at end of file
+class TaskBulkCreateSerializer(serializers.Serializer):
+    numbers = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=settings.MAX_FIBONACCI_NUMBER),
+        allow_empty=False,
+        max_length=settings.MAX_TASKS_PER_USER
+    )
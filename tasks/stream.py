@@ -0,0 +1,161 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .conditional import task_set_version
+from .models import Task
+from . import channel
+
+HEARTBEAT_INTERVAL = 15
+
+
+def authenticate_stream(request):
+    """EventSource cannot send an Authorization header, so the token may come as ?token=."""
+    authentication = JWTAuthentication()
+    raw_token = request.GET.get('token')
+
+    if not raw_token:
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+    if not raw_token:
+        return None
+
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def task_snapshot(user):
+    """
+    Progress of the user's running tasks plus a version string that changes
+    whenever a task is added, finishes or is cancelled.
+    """
+    tasks = Task.objects.filter(user=user)
+    summary = tasks.aggregate(total=Count('id'), last_completed=Max('completed_at'))
+    active = list(
+        tasks.filter(status='in_progress').order_by('id').values('id', 'status', 'progress')
+    )
+
+    live_progress = channel.read_progress_many([task['id'] for task in active])
+    for task in active:
+        task['progress'] = live_progress.get(task['id'], task['progress'])
+
+    last_completed = summary['last_completed'].isoformat() if summary['last_completed'] else ''
+    active_ids = ','.join(str(task['id']) for task in active)
+
+    return {
+        'version': f"{summary['total']}:{last_completed}:{active_ids}",
+        'active': active,
+    }
+
+
+def refresh_progress(snapshot):
+    """snapshot with the running tasks' progress re-read from the task channel, without the database."""
+    live_progress = channel.read_progress_many([task['id'] for task in snapshot['active']])
+    return {
+        'version': snapshot['version'],
+        'active': [dict(task, progress=live_progress.get(task['id'], task['progress'])) for task in snapshot['active']],
+    }
+
+
+def poll_snapshot(user, state):
+    """
+    task_snapshot(user), queried again only when task_set_version (two index
+    probes) has moved since the last poll; in between, only live progress is read.
+    state is a dict the caller keeps between polls.
+    """
+    version = task_set_version(user.id)
+    if 'snapshot' not in state or state['version'] != version:
+        state['version'] = version
+        state['snapshot'] = task_snapshot(user)
+    else:
+        state['snapshot'] = refresh_progress(state['snapshot'])
+    return state['snapshot']
+
+
+def poll_and_release(user, state):
+    """
+    poll_snapshot, then the thread's database connection is closed, so a stream
+    holds a connection only while it polls and not for its whole lifetime.
+    """
+    try:
+        return poll_snapshot(user, state)
+    finally:
+        # closing would roll back an enclosing transaction (a TestCase's)
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def task_events(user):
+    started = last_beat = time.monotonic()
+    last_snapshot = None
+    state = {}
+
+    while time.monotonic() - started < settings.TASK_STREAM_MAX_DURATION:
+        snapshot = poll_and_release(user, state)
+        if snapshot != last_snapshot:
+            last_snapshot = snapshot
+            last_beat = time.monotonic()
+            yield format_event('tasks', snapshot)
+        elif time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+            last_beat = time.monotonic()
+            yield ": ping\n\n"
+
+        time.sleep(settings.TASK_STREAM_POLL_INTERVAL)
+
+
+async def async_task_events(user):
+    started = last_beat = time.monotonic()
+    last_snapshot = None
+    state = {}
+    # off the shared sync thread, so streams do not queue behind one another
+    snapshot_for = sync_to_async(poll_and_release, thread_sensitive=False)
+
+    while time.monotonic() - started < settings.TASK_STREAM_MAX_DURATION:
+        snapshot = await snapshot_for(user, state)
+        if snapshot != last_snapshot:
+            last_snapshot = snapshot
+            last_beat = time.monotonic()
+            yield format_event('tasks', snapshot)
+        elif time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+            last_beat = time.monotonic()
+            yield ": ping\n\n"
+
+        await asyncio.sleep(settings.TASK_STREAM_POLL_INTERVAL)
+
+
+def task_stream(request):
+    """
+    Server-Sent Events stream of the user's task progress. Served by an async
+    generator under ASGI (backend.asgi), by a regular one under WSGI/runserver,
+    where each open stream keeps a worker thread. Either way a database
+    connection is held only during a poll. Each stream ends after
+    TASK_STREAM_MAX_DURATION; EventSource reconnects.
+    """
+    user = authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    if isinstance(request, ASGIRequest):
+        events = async_task_events(user)
+    else:
+        events = task_events(user)
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,82 +1,255 @@
-from background_task import background
+from django.conf import settings
 from django.utils import timezone
 from .models import Task
+from .cache import store_result
+from .notify import notify_task_finished
+from .counters import finish_task
+from . import channel
+import json
+import math
 import time
-import os
 
 PROGRESS_UPDATES = 300
-CANCELLATION_CHECKS = 100
+MIN_SIMULATED_SLICE = 0.5
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def fibonacci(n, on_step=None, start=(0, 0, 1)):
+    """
+    Fast doubling: F(2k) = F(k) * (2F(k+1) - F(k)), F(2k+1) = F(k)^2 + F(k+1)^2.
+    Walks the bits of n from the top, so only O(log n) big-int steps are needed.
+    on_step(k, next_k, a, b) is called after every doubling step with the index
+    reached and a, b = F(next_k), F(next_k + 1).
+
+    start = (k, F(k), F(k+1)) resumes from a checkpoint, where k is a leading-bit
+    prefix of n (k == n >> s for some s).
+    """
+    k, a, b = start
+
+    for shift in range(n.bit_length() - k.bit_length() - 1, -1, -1):
+        c = a * (2 * b - a)
+        d = a * a + b * b
+
+        if (n >> shift) & 1:
+            a, b, next_k = d, c + d, 2 * k + 1
+        else:
+            a, b, next_k = c, d, 2 * k
+
+        if on_step:
+            on_step(k, next_k, a, b)
+        k = next_k
+
+    return a
+
+
+def encode_checkpoint(k, a, b):
+    return json.dumps({'k': k, 'a': hex(a), 'b': hex(b)})
+
+
+def decode_checkpoint(checkpoint, n):
+    """Returns a fibonacci() start state, or the initial one if the checkpoint is unusable."""
+    try:
+        data = json.loads(checkpoint)
+        k, a, b = data['k'], int(data['a'], 16), int(data['b'], 16)
+    except (TypeError, ValueError, KeyError):
+        return (0, 0, 1)
+
+    if type(k) is not int or k < 0 or k.bit_length() > n.bit_length():
+        return (0, 0, 1)
+    if n >> (n.bit_length() - k.bit_length()) != k:
+        return (0, 0, 1)
+    return (k, a, b)
+
+
+def format_result(value):
+    # str() of a huge int is quadratic and capped by sys.get_int_max_str_digits(),
+    # so only the 10 leading digits are ever converted.
+    if value < 10 ** 10:
+        return str(value)
+
+    exponent = int(value.bit_length() * math.log10(2))
+    while 10 ** exponent > value:
+        exponent -= 1
+    while 10 ** (exponent + 1) <= value:
+        exponent += 1
+
+    leading = str(value // 10 ** (exponent - 9))
+    return f"{leading[0]}.{leading[1:10]}E+{exponent}"
+
+
+class ProgressReporter:
+    """
+    Keeps a running task's progress in memory and publishes it on the task channel
+    every step. The database is touched only every TASK_PROGRESS_FLUSH_INTERVAL
+    seconds, with one conditional UPDATE that doubles as the cancellation check
+    for cancels the channel did not deliver (e.g. from another host).
+
+    The latest (k, F(k), F(k+1)) state rides along with a flush at most once per
+    TASK_CHECKPOINT_INTERVAL seconds, so a restarted backend can resume the task.
+
+    Tasks attached to this computation (see tasks.executor) get the same progress
+    and checkpoints. If the task itself is cancelled while some of them are still
+    running, it is finished as cancelled and the computation goes on for them.
+    """
+
+    def __init__(self, task, n):
+        self.task = task
+        self.n = n
+        self.progress = 0
+        self.last_flush = time.monotonic()
+        self.state = None
+        self.last_checkpoint = time.monotonic()
+        self.followers = []
+        self.cancelled = False
+
+    def report(self, k, state=None):
+        self.progress = min(int((k / self.n) * 100) if self.n else 100, 99)
+        if state is not None:
+            self.state = state
+        if not self.cancelled:
+            channel.publish_progress(self.task.id, self.progress)
+        for task_id in self.followers:
+            channel.publish_progress(task_id, self.progress)
+
+        if not self.cancelled and channel.is_cancel_requested(self.task.id):
+            self.stop()
+
+        if time.monotonic() - self.last_flush >= settings.TASK_PROGRESS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        fields = {'progress': self.progress}
+
+        now = time.monotonic()
+        if self.state is not None and now - self.last_checkpoint >= settings.TASK_CHECKPOINT_INTERVAL:
+            fields['checkpoint'] = encode_checkpoint(*self.state)
+            self.last_checkpoint = now
+            self.state = None
+
+        self.last_flush = now
+        running_followers = self.flush_followers(fields)
+        if self.cancelled:
+            if not running_followers:
+                raise TaskCancelled()
+            return
+
+        updated = Task.objects.filter(id=self.task.id, status='in_progress').update(**fields)
+        if not updated:
+            self.stop()
+
+    def flush_followers(self, fields):
+        """Writes fields to the followers still in progress and returns how many there are."""
+        self.followers = channel.read_followers(self.task.id)
+        if not self.followers:
+            return 0
+        return Task.objects.filter(id__in=self.followers, status='in_progress').update(**fields)
+
+    def stop(self):
+        if not self.cancelled:
+            Task.objects.filter(id=self.task.id).update(progress=self.progress, completed_at=timezone.now())
+            self.cancelled = True
+        if not self.flush_followers({'progress': self.progress}):
+            raise TaskCancelled()
+
+
+def simulate_work(reporter, k, next_k, n):
+    """
+    Optional artificial cost of SIMULATED_WORK_DELAY seconds per Fibonacci index,
+    so a task takes as long as the old linear loop did. Sleeps in slices to keep
+    progress and cancellation responsive (at most PROGRESS_UPDATES reports per task).
+    """
+    delay = settings.SIMULATED_WORK_DELAY
+    if delay <= 0 or next_k <= k:
+        return
+
+    slice_time = max(MIN_SIMULATED_SLICE, n * delay / PROGRESS_UPDATES)
+    total = (next_k - k) * delay
+    elapsed = 0
+
+    while elapsed < total:
+        step = min(slice_time, total - elapsed)
+        time.sleep(step)
+        elapsed += step
+        reporter.report(k + (next_k - k) * elapsed / total)
+
 
-@background(schedule=0)
 def calculate_fibonacci_task(task_id, n):
+    """
+    Returns {'status', 'number', 'iterations', 'seconds'} describing this run for
+    the server process's metrics, plus 'result' when the value was computed, or
+    None if the task no longer exists.
+    """
+    stats = {'status': 'failed', 'number': n, 'iterations': 0, 'seconds': 0}
+    started = time.monotonic()
+
     try:
         task = Task.objects.get(id=task_id)
+        if task.started_at is None:
+            task.started_at = timezone.now()
+            Task.objects.filter(id=task_id, started_at__isnull=True).update(started_at=task.started_at)
 
-        task.progress = 0
-        task.save()
-        
-        if n == 0:
-            result = "0"
-        elif n == 1:
-            result = "1"
-        else:
-            a, b = 0, 1
-            progress_interval = max(1, n // PROGRESS_UPDATES)
-            cancel_check_interval = max(1, n // CANCELLATION_CHECKS)
-            
-            for i in range(2, n + 1):
-                a, b = b, a + b
-                
-                time.sleep(0.1)
-
-                if i % progress_interval == 0:
-                    progress = int((i / n) * 100)
-                    task.refresh_from_db()
-                    
-                    if task.status == 'cancelled':
-                        task.progress = progress
-                        task.completed_at = timezone.now()
-                        task.save()
-                        return
-                    
-                    task.progress = min(progress, 99)
-                    task.save(update_fields=['progress'])
-                
-                if i % cancel_check_interval == 0:
-                    task.refresh_from_db()
-                    if task.status == 'cancelled':
-                        progress = int((i / n) * 100)
-                        task.progress = progress
-                        task.completed_at = timezone.now()
-                        task.save()
-                        return
-            
-            result = str(b)
-            
-            if len(result) > 10:
-                result = f"{result[0]}.{result[1:10]}E+{len(result) - 1}"
-        
-        task.refresh_from_db()
-        if task.status != 'cancelled':
-            task.result = result
-            task.progress = 100
+        reporter = ProgressReporter(task, n)
+        start = decode_checkpoint(task.checkpoint, n) if task.checkpoint else (0, 0, 1)
+
+        def on_step(k, next_k, a, b):
+            stats['iterations'] += 1
+            simulate_work(reporter, k, next_k, n)
+            reporter.report(next_k, state=(next_k, a, b))
+
+        try:
+            result = format_result(fibonacci(n, on_step, start))
+        except TaskCancelled:
+            stats['status'] = 'cancelled'
+            return stats
+
+        store_result(n, result)
+        # the executor completes the tasks attached to this computation with it
+        stats['result'] = result
+
+        completed_at = timezone.now()
+        completed = finish_task(
+            task,
+            result=result,
+            progress=100,
+            status='completed',
+            checkpoint=None,
+            completed_at=completed_at
+        )
+
+        if completed:
             task.status = 'completed'
-            task.completed_at = timezone.now()
-            task.save()
+            task.completed_at = completed_at
+            notify_task_finished(task)
+            stats['status'] = 'completed'
+        elif reporter.cancelled:
+            # cancelled earlier, the computation went on for the attached tasks
+            stats['status'] = 'completed'
         else:
-            task.completed_at = timezone.now()
-            task.save()
-        
+            Task.objects.filter(id=task_id).update(completed_at=completed_at)
+            stats['status'] = 'cancelled'
+
+        return stats
+
     except Task.DoesNotExist:
-        pass
+        return None
     except Exception as e:
         try:
             task = Task.objects.get(id=task_id)
-            task.status = 'failed'
-            task.error_message = str(e)
-            task.completed_at = timezone.now()
-            task.save()
-            server_port = os.getenv("SERVER_PORT", "unknown")
-            task.server_url = f"http://127.0.0.1:{server_port}"
+            failed = finish_task(
+                task,
+                status='failed',
+                error_message=str(e),
+                completed_at=timezone.now()
+            )
+            if failed:
+                task.status = 'failed'
+                notify_task_finished(task)
         except:
-            pass
\ No newline at end of file
+            pass
+        return stats
+    finally:
+        stats['seconds'] = time.monotonic() - started
+        channel.clear(task_id)
@@ -1,3 +1,943 @@
-from django.test import TestCase
+import io
+import uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from balancer.scheduling import FairSharePolicy, FifoPolicy
+from balancer.shared_queue import DatabaseQueueStore
+from . import channel, views
+from .cache import get_cached_result, store_result
+from .counters import finish_task, server_in_progress, start_task, user_in_progress
+from .executor import _finish_followers, pending_count, reclaim_stale_tasks, resume_tasks, submit_task
+from .models import FibonacciResult, QueuedTask, Task
+from .pagination import LIST_FIELDS
+from .stream import poll_and_release, poll_snapshot
+from .tasks import (
+    ProgressReporter, TaskCancelled, calculate_fibonacci_task, decode_checkpoint, encode_checkpoint, fibonacci,
+    format_result
+)
+
+SERVER_URL = 'http://127.0.0.1:8001'
+
+
+def slow_fibonacci(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+class FibonacciTests(SimpleTestCase):
+    def test_fast_doubling_matches_linear_definition(self):
+        for n in list(range(100)) + [127, 128, 1000, 4097]:
+            self.assertEqual(fibonacci(n), slow_fibonacci(n), n)
+
+    def test_steps_walk_the_bits_of_n(self):
+        steps = []
+        fibonacci(100, lambda k, next_k, a, b: steps.append((next_k, a, b)))
+
+        self.assertEqual([next_k for next_k, _, _ in steps], [1, 3, 6, 12, 25, 50, 100])
+        self.assertTrue(all(a == slow_fibonacci(k) and b == slow_fibonacci(k + 1) for k, a, b in steps))
+
+    def test_format_result(self):
+        self.assertEqual(format_result(0), '0')
+        self.assertEqual(format_result(9999999999), '9999999999')
+        self.assertEqual(format_result(10 ** 10), '1.000000000E+10')
+        self.assertEqual(format_result(fibonacci(100)), '3.542248481E+20')
+
+    def test_format_result_of_huge_values_skips_full_conversion(self):
+        value = fibonacci(200000)
+
+        self.assertEqual(format_result(value), '1.508568355E+41797')
+
+
+class CheckpointTests(SimpleTestCase):
+    def test_resumes_from_a_prefix_of_n(self):
+        start = decode_checkpoint(encode_checkpoint(0b101, 5, 8), 0b10110)
+
+        self.assertEqual(start, (0b101, 5, 8))
+        self.assertEqual(fibonacci(0b10110, start=start), slow_fibonacci(0b10110))
+
+    def test_unusable_checkpoints_start_over(self):
+        for checkpoint in [
+            'not json',
+            '[]',
+            '{"k": 3}',
+            encode_checkpoint(0b111, 13, 21),
+            '{"k": 2.5, "a": "0x1", "b": "0x1"}',
+            '{"k": true, "a": "0x1", "b": "0x1"}',
+            '{"k": -1, "a": "0x1", "b": "0x1"}',
+            encode_checkpoint(0b1011011, 1, 1),
+        ]:
+            self.assertEqual(decode_checkpoint(checkpoint, 0b10110), (0, 0, 1), checkpoint)
+
+
+@patch('tasks.tasks.notify_task_finished')
+class CalculateTaskTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('calculator', password='secret123')
+
+    def test_task_completes_with_formatted_result(self, notify):
+        task = start_task(user=self.user, number=100, server_url=SERVER_URL)
+
+        stats = calculate_fibonacci_task(task.id, 100)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.progress, task.result), ('completed', 100, '3.542248481E+20'))
+        self.assertEqual(stats['status'], 'completed')
+        self.assertEqual(stats['iterations'], 7)
+        notify.assert_called_once()
+
+    def test_cancelled_task_stops_without_result(self, notify):
+        task = start_task(user=self.user, number=100, server_url=SERVER_URL)
+        finish_task(task, status='cancelled')
+
+        stats = calculate_fibonacci_task(task.id, 100)
+
+        self.assertEqual(stats['status'], 'cancelled')
+        self.assertIsNone(Task.objects.get(id=task.id).result)
+
+
+@override_settings(TASK_PROGRESS_FLUSH_INTERVAL=3600)
+class ProgressReporterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', password='secret123')
+        self.task = start_task(user=self.user, number=100, server_url=SERVER_URL)
+        self.reporter = ProgressReporter(self.task, 100)
+        self.addCleanup(channel.clear, self.task.id)
+
+    def test_progress_is_published_without_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.reporter.report(30)
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(channel.read_progress(self.task.id), 30)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/tasks/{self.task.id}/progress/')
+        self.assertEqual(response.data['progress'], 30)
+
+    @patch('tasks.views.notify_task_finished')
+    def test_cancel_reaches_the_worker_through_the_channel(self, notify):
+        self.client.force_authenticate(self.user)
+        self.client.post(f'/api/tasks/{self.task.id}/cancel/')
+
+        with self.assertRaises(TaskCancelled):
+            self.reporter.report(50)
+
+    def test_flush_stops_a_task_cancelled_elsewhere(self):
+        Task.objects.filter(id=self.task.id).update(status='cancelled')
+        self.reporter.report(10)
+
+        with self.assertRaises(TaskCancelled):
+            self.reporter.flush()
+
+
+class TaskStatsTests(APITestCase):
+    def test_completed_run_times_are_averaged_per_bit_length(self):
+        user = User.objects.create_user('stats', password='secret123')
+        started = timezone.now()
+        for number, seconds in [(8, 1), (15, 3), (100, 10)]:
+            Task.objects.create(
+                user=user, number=number, status='completed',
+                started_at=started, completed_at=started + timedelta(seconds=seconds)
+            )
+        Task.objects.create(user=user, number=9, status='in_progress', started_at=started)
+
+        response = self.client.get('/api/task-stats/')
+
+        self.assertEqual(response.data['buckets'], {
+            '4': {'count': 2, 'avg_seconds': 2.0},
+            '7': {'count': 1, 'avg_seconds': 10.0},
+        })
+
+
+class MetricsViewTests(TestCase):
+    def test_requests_are_timed_per_route(self):
+        self.client.get('/api/task-stats/')
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('backend_request_duration_seconds_count{route="task_stats"}', response.content.decode())
+        self.assertIn('backend_executor_pending_tasks', response.content.decode())
+
+
+class ResultCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cacher', password='secret123')
+        self.client.force_authenticate(self.user)
+
+    def test_stored_result_is_returned_and_counted(self):
+        store_result(90, '2880067194370816120')
+
+        self.assertEqual(get_cached_result(90), '2880067194370816120')
+        self.assertEqual(FibonacciResult.objects.get(number=90).hits, 1)
+        self.assertIsNone(get_cached_result(91))
+
+    @override_settings(FIBONACCI_CACHE_SIZE=2)
+    def test_least_recently_used_result_is_evicted(self):
+        store_result(1, '1')
+        store_result(2, '1')
+        FibonacciResult.objects.filter(number=1).update(last_used_at=timezone.now() + timedelta(seconds=1))
+
+        store_result(3, '2')
+
+        self.assertCountEqual(FibonacciResult.objects.values_list('number', flat=True), [1, 3])
+
+    @patch('tasks.views.submit_task')
+    def test_cached_number_completes_without_computing(self, submit):
+        store_result(12, '144')
+
+        response = self.client.post('/api/tasks/', {'number': 12}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['status'], response.data['result']), ('completed', '144'))
+        submit.assert_not_called()
+
+    def test_cached_action_misses_with_404(self):
+        response = self.client.post('/api/tasks/cached/', {'number': 13}, format='json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Task.objects.exists())
+
+
+class TaskStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('streamer', password='secret123')
+        self.task = start_task(user=self.user, number=10, server_url=SERVER_URL)
+        self.addCleanup(channel.clear, self.task.id)
+
+    def test_unchanged_tasks_are_not_queried_again(self):
+        state = {}
+        first = poll_snapshot(self.user, state)
+        channel.publish_progress(self.task.id, 40)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = poll_snapshot(self.user, state)
+
+        # only the version stamp probes; progress comes from the task channel
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(second['version'], first['version'])
+        self.assertEqual(second['active'], [{'id': self.task.id, 'status': 'in_progress', 'progress': 40}])
+
+    @patch('tasks.views.notify_task_finished')
+    def test_cancelled_task_changes_the_snapshot(self, notify):
+        state = {}
+        first = poll_snapshot(self.user, state)
+        token = AccessToken.for_user(self.user)
+
+        response = self.client.post(f'/api/tasks/{self.task.id}/cancel/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        second = poll_snapshot(self.user, state)
+
+        self.assertEqual(response.status_code, 200)
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args.args[0].id, self.task.id)
+        self.assertNotEqual(second['version'], first['version'])
+        self.assertEqual(second['active'], [])
+
+    @patch('tasks.stream.connection')
+    def test_stream_gives_its_connection_back_after_each_poll(self, stream_connection):
+        stream_connection.in_atomic_block = False
+
+        poll_and_release(self.user, {})
+
+        stream_connection.close.assert_called_once_with()
+
+    @override_settings(TASK_STREAM_MAX_DURATION=0.5, TASK_STREAM_POLL_INTERVAL=0.1)
+    def test_stream_accepts_token_in_query_and_refuses_without(self):
+        self.assertEqual(self.client.get('/api/tasks/stream/').status_code, 401)
+
+        token = AccessToken.for_user(self.user)
+        response = self.client.get(f'/api/tasks/stream/?token={token}')
+
+        first_event = next(iter(response.streaming_content)).decode('utf-8')
+        response.close()
+        self.assertTrue(first_event.startswith('event: tasks\n'))
+        self.assertIn(f'"id": {self.task.id}', first_event)
+
+
+class QueryPlanTests(APITestCase):
+    """The Task queries the hot views run are answered from the indexes added in 0006."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(f'planner{i}', password='secret123') for i in range(20)]
+        cls.user = users[0]
+        now = timezone.now()
+
+        Task.objects.bulk_create([
+            Task(
+                user=users[i % len(users)],
+                number=i,
+                status='in_progress' if i % 10 == 0 else 'completed',
+                server_url=f'http://127.0.0.1:{8001 + i % 4}',
+                completed_at=None if i % 10 == 0 else now
+            )
+            for i in range(2000)
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        if connection.vendor == 'postgresql':
+            # on a table this small a sequential scan is always cheapest
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def task_queries(self, run):
+        """The SELECTs on tasks_task that run() issues, as executed."""
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "tasks_task"' in query['sql']
+        ]
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def assertQueriesUseIndex(self, run, index_name):
+        """No Task query run() issues scans the table, and one of them uses index_name."""
+        plans = [self.explain(sql) for sql in self.task_queries(run)]
+        for plan in plans:
+            self.assertNotRegex(plan, r'SCAN tasks_task(?! USING)|Seq Scan on tasks_task')
+        self.assertTrue(any(index_name in plan for plan in plans), plans)
+
+    def test_server_status_task_list_uses_running_server_index(self):
+        queries = self.task_queries(lambda: self.client.get(
+            '/api/server-status/?tasks=1',
+            SERVER_PORT='8001',
+            HTTP_X_INTERNAL_TOKEN=settings.INTERNAL_API_TOKEN
+        ))
+
+        self.assertEqual(len(queries), 1)
+        self.assertIn('task_running_server_idx', self.explain(queries[0]))
+
+    def test_server_status_reads_no_task_rows(self):
+        queries = self.task_queries(lambda: self.client.get('/api/server-status/', SERVER_PORT='8001'))
+
+        self.assertEqual(queries, [])
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    @patch('tasks.executor.submit_task')
+    def test_resume_uses_running_server_index(self, submit, stdout):
+        self.assertQueriesUseIndex(lambda: resume_tasks('http://127.0.0.1:8001'), 'task_running_server_idx')
+        self.assertEqual(submit.call_count, 100)
+
+    def test_active_uses_running_user_index(self):
+        self.assertQueriesUseIndex(lambda: self.client.get('/api/tasks/active/'), 'task_running_user_idx')
+
+    def test_history_uses_finished_user_index(self):
+        self.assertQueriesUseIndex(lambda: self.client.get('/api/tasks/history/'), 'task_finished_user_idx')
+
+    def test_next_page_uses_user_created_index(self):
+        next_page = self.client.get('/api/tasks/?page_size=10').data['next']
+
+        self.assertQueriesUseIndex(
+            lambda: self.client.get('/api/tasks/', {'page_size': 10, 'cursor': next_page}),
+            'task_user_created_idx'
+        )
+
+
+class InProgressCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('counter', password='secret123')
+
+    def test_start_and_finish_adjust_counters(self):
+        first = start_task(user=self.user, number=10, server_url=SERVER_URL)
+        start_task(user=self.user, number=20, server_url=SERVER_URL)
+
+        self.assertEqual(server_in_progress(SERVER_URL), 2)
+        self.assertEqual(user_in_progress(self.user.id), 2)
+
+        self.assertTrue(finish_task(first, status='completed', completed_at=timezone.now()))
+        self.assertEqual(server_in_progress(SERVER_URL), 1)
+        self.assertEqual(user_in_progress(self.user.id), 1)
+
+    def test_task_is_counted_out_once(self):
+        task = start_task(user=self.user, number=10, server_url=SERVER_URL)
+
+        self.assertTrue(finish_task(task, status='cancelled'))
+        self.assertFalse(finish_task(task, status='completed', completed_at=timezone.now()))
+
+        self.assertEqual(Task.objects.get(id=task.id).status, 'cancelled')
+        self.assertEqual(server_in_progress(SERVER_URL), 0)
+        self.assertEqual(user_in_progress(self.user.id), 0)
+
+    @patch('tasks.views.running_computations', return_value=1)
+    def test_server_status_reports_counter(self, running_computations):
+        start_task(user=self.user, number=10, server_url='http://127.0.0.1:80')
+        start_task(user=self.user, number=10, server_url='http://127.0.0.1:80')
+
+        response = self.client.get('/api/server-status/', SERVER_PORT='80')
+
+        self.assertEqual(response.json()['in_progress_tasks'], 2)
+        self.assertEqual(response.json()['available_slots'], settings.MAX_TASKS_PER_SERVER - 1)
+        self.assertNotIn('tasks', response.json())
+
+    def test_server_status_lists_tasks_on_request(self):
+        first = start_task(user=self.user, number=10, server_url='http://127.0.0.1:80')
+        second = start_task(user=self.user, number=10, server_url='http://127.0.0.1:80')
+
+        response = self.client.get(
+            '/api/server-status/?tasks=1',
+            SERVER_PORT='80',
+            HTTP_X_INTERNAL_TOKEN=settings.INTERNAL_API_TOKEN
+        )
+
+        self.assertCountEqual(response.json()['tasks'], [[first.id, 10], [second.id, 10]])
+
+    def test_task_list_needs_the_internal_token(self):
+        start_task(user=self.user, number=10, server_url='http://127.0.0.1:80')
+
+        for headers in ({}, {'HTTP_X_INTERNAL_TOKEN': 'guess'}):
+            response = self.client.get('/api/server-status/?tasks=1', SERVER_PORT='80', **headers)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn('tasks', response.json())
+
+
+@override_settings(MAX_TASKS_PER_USER=2)
+@patch('tasks.views.submit_task')
+class TaskQuotaTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('quota', password='secret123')
+        self.client.force_authenticate(self.user)
+        self.running = start_task(user=self.user, number=10, server_url=SERVER_URL, dispatch_id='d-1')
+
+    def test_create_past_the_limit_is_refused_with_429(self, submit):
+        self.assertEqual(self.client.post('/api/tasks/', {'number': 11}, format='json').status_code, 201)
+
+        response = self.client.post('/api/tasks/', {'number': 12}, format='json')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(user_in_progress(self.user.id), 2)
+
+    def test_retried_dispatch_and_cached_results_pass_at_the_limit(self, submit):
+        start_task(user=self.user, number=11, server_url=SERVER_URL)
+        store_result(12, '144')
+
+        retried = self.client.post('/api/tasks/', {'number': 10}, format='json', HTTP_X_DISPATCH_ID='d-1')
+        cached = self.client.post('/api/tasks/', {'number': 12}, format='json')
+
+        self.assertEqual((retried.status_code, retried.data['id']), (201, self.running.id))
+        self.assertEqual((cached.status_code, cached.data['status']), (201, 'completed'))
+
+    def test_bulk_past_the_limit_creates_nothing(self, submit):
+        response = self.client.post('/api/tasks/bulk/', {'numbers': [11, 12]}, format='json')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Task.objects.count(), 1)
+
+
+class TaskDeleteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('deleter', password='secret123')
+        self.client.force_authenticate(self.user)
+
+    def test_running_task_cannot_be_deleted(self):
+        task = start_task(user=self.user, number=10, server_url=SERVER_URL)
+
+        response = self.client.delete(f'/api/tasks/{task.id}/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(server_in_progress(SERVER_URL), 1)
+
+    def test_finished_task_is_deleted(self):
+        task = Task.objects.create(user=self.user, number=10, status='completed', result='55')
+
+        self.assertEqual(self.client.delete(f'/api/tasks/{task.id}/').status_code, 204)
+        self.assertFalse(Task.objects.exists())
+
+
+class TaskListPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager', password='secret123')
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        # equal timestamps, so pages have to break ties on id
+        Task.objects.bulk_create([
+            Task(user=self.user, number=i, status='completed', result=str(i), completed_at=now)
+            for i in range(7)
+        ])
+
+    def fetch_all(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids += [task['id'] for task in data['results']]
+            url = f"/api/tasks/history/?page_size=3&cursor={data['next']}" if data['next'] else None
+        return ids
+
+    def test_cursor_walks_every_task_once_newest_first(self):
+        ids = self.fetch_all('/api/tasks/history/?page_size=3')
+
+        expected = list(Task.objects.order_by('-completed_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_fields_projection(self):
+        data = self.client.get('/api/tasks/?fields=id,status').json()
+
+        self.assertEqual(len(data['results']), 7)
+        self.assertEqual(set(data['results'][0]), {'id', 'status'})
+
+    def test_default_fields_match_serializer(self):
+        data = self.client.get('/api/tasks/').json()
+
+        self.assertEqual(list(data['results'][0]), LIST_FIELDS)
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/tasks/?fields=id,user__password')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('poller', password='secret123')
+        self.client.force_authenticate(self.user)
+        self.running = start_task(user=self.user, number=10, server_url=SERVER_URL)
+        Task.objects.bulk_create([
+            Task(user=self.user, number=i, status='completed', result=str(i), completed_at=timezone.now())
+            for i in range(3)
+        ])
+
+    def test_unchanged_history_is_not_modified(self):
+        first = self.client.get('/api/tasks/history/')
+        second = self.client.get('/api/tasks/history/', HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_finished_task_changes_etag(self):
+        etag = self.client.get('/api/tasks/history/')['ETag']
+
+        finish_task(self.running, status='completed', result='55', completed_at=timezone.now())
+        response = self.client.get('/api/tasks/history/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_progress_is_not_modified_until_it_changes(self):
+        url = f'/api/tasks/{self.running.id}/progress/'
+        etag = self.client.get(url)['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Task.objects.filter(id=self.running.id).update(progress=40)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['progress'], 40)
+
+    def test_queryset_update_bumps_updated_at(self):
+        before = Task.objects.get(id=self.running.id).updated_at
+
+        Task.objects.filter(id=self.running.id).update(progress=40)
+
+        self.assertGreater(Task.objects.get(id=self.running.id).updated_at, before)
+
+    @override_settings(TASK_SYNC_LAG=0)
+    def test_changes_returns_only_tasks_changed_since_token(self):
+        full = self.client.get('/api/tasks/changes/').json()
+        self.assertEqual(len(full['results']), 4)
+
+        idle = self.client.get('/api/tasks/changes/', {'since': full['since']}).json()
+        self.assertEqual(idle['results'], [])
+
+        Task.objects.filter(id=self.running.id).update(progress=40)
+        delta = self.client.get('/api/tasks/changes/', {'since': idle['since']}).json()
+
+        self.assertEqual([task['id'] for task in delta['results']], [self.running.id])
+        self.assertFalse(delta['has_more'])
+
+    def test_deleted_task_changes_the_etag(self):
+        etag = self.client.get('/api/tasks/history/')['ETag']
+        finished = Task.objects.filter(user=self.user, status='completed').first()
+
+        self.assertEqual(self.client.delete(f'/api/tasks/{finished.id}/').status_code, 204)
+        response = self.client.get('/api/tasks/history/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    @override_settings(TASK_SYNC_LAG=0)
+    def test_changes_reports_deleted_tasks(self):
+        full = self.client.get('/api/tasks/changes/').json()
+        self.assertEqual(full['deleted'], [])
+        finished = Task.objects.filter(user=self.user, status='completed').first()
+
+        self.client.delete(f'/api/tasks/{finished.id}/')
+        delta = self.client.get('/api/tasks/changes/', {'since': full['since']}).json()
+
+        self.assertEqual(delta['results'], [])
+        self.assertEqual(delta['deleted'], [finished.id])
+
+
+class BulkCreateTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bulk', password='secret123')
+        self.client.force_authenticate(self.user)
+        FibonacciResult.objects.create(number=10, result='55', last_used_at=timezone.now())
+
+    @patch('tasks.views.submit_task')
+    def test_creates_tasks_in_request_order(self, submit):
+        response = self.client.post('/api/tasks/bulk/', {'numbers': [30, 10, 40]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([task['number'] for task in results], [30, 10, 40])
+        self.assertEqual([task['status'] for task in results], ['in_progress', 'completed', 'in_progress'])
+        self.assertEqual(results[1]['result'], '55')
+        self.assertEqual(submit.call_count, 2)
+        self.assertEqual(user_in_progress(self.user.id), 2)
+
+    @patch('tasks.views.submit_task')
+    def test_retried_dispatch_ids_are_not_created_again(self, submit):
+        headers = {'HTTP_X_DISPATCH_IDS': 'a1,b2'}
+        first = self.client.post('/api/tasks/bulk/', {'numbers': [30, 40]}, format='json', **headers)
+        second = self.client.post('/api/tasks/bulk/', {'numbers': [30, 40]}, format='json', **headers)
+
+        self.assertEqual(
+            [task['id'] for task in second.json()['results']],
+            [task['id'] for task in first.json()['results']]
+        )
+        self.assertEqual(Task.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(submit.call_count, 2)
+
+    @patch('tasks.views.submit_task')
+    def test_concurrent_retry_returns_the_winners_tasks(self, submit):
+        won = start_task(user=self.user, number=30, server_url=SERVER_URL, dispatch_id='a1')
+
+        # the other request inserted a1 between the lookup and the insert
+        with patch.object(views.TaskViewSet, 'tasks_by_dispatch_id', side_effect=[{}, {'a1': won}]):
+            response = self.client.post('/api/tasks/bulk/', {'numbers': [30]}, format='json', HTTP_X_DISPATCH_IDS='a1')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([task['id'] for task in response.json()['results']], [won.id])
+
+    @patch('tasks.views.submit_task')
+    def test_dispatch_id_of_another_user_conflicts(self, submit):
+        other = User.objects.create_user('other', password='secret123')
+        start_task(user=other, number=30, server_url=SERVER_URL, dispatch_id='a1')
+
+        bulk = self.client.post('/api/tasks/bulk/', {'numbers': [30, 40]}, format='json', HTTP_X_DISPATCH_IDS='a1,b2')
+        single = self.client.post('/api/tasks/', {'number': 30}, format='json', HTTP_X_DISPATCH_ID='a1')
+
+        self.assertEqual((bulk.status_code, bulk.json()['dispatch_ids']), (409, ['a1', 'b2']))
+        self.assertEqual(single.status_code, 409)
+        self.assertFalse(Task.objects.filter(user=self.user).exists())
+
+    def test_invalid_number_rejects_the_whole_list(self):
+        response = self.client.post(
+            '/api/tasks/bulk/', {'numbers': [5, settings.MAX_FIBONACCI_NUMBER + 1]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1', response.json()['numbers'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_list_longer_than_user_quota_is_rejected(self):
+        numbers = list(range(settings.MAX_TASKS_PER_USER + 1))
+
+        response = self.client.post('/api/tasks/bulk/', {'numbers': numbers}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('flight', password='secret123')
+        self.leader = start_task(user=self.user, number=10, server_url=SERVER_URL)
+        self.followers = [start_task(user=self.user, number=10, server_url=SERVER_URL) for _ in range(2)]
+        channel.set_followers(self.leader.id, [task.id for task in self.followers])
+
+    def tearDown(self):
+        channel.clear_followers(self.leader.id)
+        for task in [self.leader] + self.followers:
+            channel.clear(task.id)
+
+    def test_cancelled_leader_keeps_computing_for_followers(self):
+        reporter = ProgressReporter(self.leader, 10)
+        finish_task(self.leader, status='cancelled')
+        reporter.progress = 40
+
+        reporter.flush()
+
+        self.assertTrue(reporter.cancelled)
+        self.assertEqual(Task.objects.get(id=self.followers[0].id).progress, 40)
+
+        for task in self.followers:
+            finish_task(task, status='cancelled')
+        with self.assertRaises(TaskCancelled):
+            reporter.flush()
+
+    @patch('tasks.notify.notify_task_finished')
+    def test_followers_get_the_result_unless_cancelled(self, notify):
+        finish_task(self.followers[1], status='cancelled')
+
+        _finish_followers([task.id for task in self.followers], 10, '55')
+
+        self.assertEqual(Task.objects.get(id=self.followers[0].id).result, '55')
+        self.assertEqual(Task.objects.get(id=self.followers[1].id).status, 'cancelled')
+        self.assertEqual(notify.call_count, 1)
+        self.assertEqual(server_in_progress(SERVER_URL), 1)
+
+    @patch('tasks.executor.submit_task')
+    def test_followers_run_again_without_a_result(self, submit):
+        _finish_followers([task.id for task in self.followers], 10, None)
+
+        self.assertEqual([call.args for call in submit.call_args_list], [(task.id, 10) for task in self.followers])
+
+
+@patch('tasks.notify.notify_task_finished')
+class ExecutorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('executor', password='secret123')
+        self.executor = Mock()
+        self.executor.submit.side_effect = lambda *args: Future()
+        patcher = patch('tasks.executor.get_executor', return_value=self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, number=10):
+        task = start_task(user=self.user, number=number, server_url=SERVER_URL)
+        self.addCleanup(channel.clear, task.id)
+        return task, submit_task(task.id, number)
+
+    def test_same_number_shares_one_computation(self, notify):
+        leader, future = self.submit()
+        follower, follower_future = self.submit()
+        self.addCleanup(channel.clear_followers, leader.id)
+
+        self.assertIs(follower_future, future)
+        self.assertEqual(self.executor.submit.call_count, 1)
+        self.assertEqual(channel.read_followers(leader.id), [follower.id])
+
+        finish_task(leader, status='completed', result='55', progress=100, completed_at=timezone.now())
+        future.set_result({'status': 'completed', 'result': '55', 'number': 10, 'iterations': 4, 'seconds': 0.1})
+
+        self.assertEqual(Task.objects.get(id=follower.id).result, '55')
+        self.assertEqual(pending_count(), 0)
+
+    def test_dead_worker_fails_the_task(self, notify):
+        task, future = self.submit()
+
+        future.set_exception(BrokenProcessPool('worker died'))
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.error_message), ('failed', 'worker died'))
+        self.assertEqual(server_in_progress(SERVER_URL), 0)
+        self.executor.shutdown.assert_called_once()
+        notify.assert_called_once()
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+@patch('tasks.executor.submit_task')
+class TaskReclaimTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reclaimer', password='secret123')
+        self.task = start_task(user=self.user, number=10, server_url='http://127.0.0.1:8002')
+
+    def age(self, seconds):
+        Task.objects.filter(id=self.task.id).update(updated_at=timezone.now() - timedelta(seconds=seconds))
+
+    @patch('tasks.executor._backend_answers', return_value=False)
+    def test_stale_task_of_a_gone_backend_moves_here(self, answers, submit, stdout):
+        self.age(settings.TASK_STALE_AFTER + 1)
+
+        self.assertEqual(reclaim_stale_tasks(SERVER_URL), 1)
+
+        submit.assert_called_once_with(self.task.id, 10)
+        self.assertEqual(Task.objects.get(id=self.task.id).server_url, SERVER_URL)
+        self.assertEqual((server_in_progress('http://127.0.0.1:8002'), server_in_progress(SERVER_URL)), (0, 1))
+        # moved tasks are fresh again, so a second backend does not take them too
+        self.assertEqual(reclaim_stale_tasks('http://127.0.0.1:8003'), 0)
+
+    @patch('tasks.executor._backend_answers', return_value=True)
+    def test_task_of_an_answering_backend_stays(self, answers, submit, stdout):
+        self.age(settings.TASK_STALE_AFTER + 1)
+
+        self.assertEqual(reclaim_stale_tasks(SERVER_URL), 0)
+
+        answers.assert_called_once_with('http://127.0.0.1:8002')
+        submit.assert_not_called()
+
+    @patch('tasks.executor._backend_answers', return_value=False)
+    def test_recently_written_task_stays(self, answers, submit, stdout):
+        self.age(settings.TASK_STALE_AFTER - 60)
+
+        self.assertEqual(reclaim_stale_tasks(SERVER_URL), 0)
+        submit.assert_not_called()
+
+
+class SharedQueueTests(TestCase):
+    def entry(self, user_id, number=10, cost=1.0):
+        return {
+            'dispatch_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'number': number,
+            'cost': cost,
+            'body': b'{"number": %d}' % number,
+            'headers': {'Authorization': 'Bearer x'},
+            'queued_at': datetime.now(),
+        }
+
+    def test_quota_and_positions(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+
+        first = store.enqueue(self.entry(1), max_per_user=2)
+        second = store.enqueue(self.entry(2), max_per_user=2)
+        store.enqueue(self.entry(1), max_per_user=2)
+        rejected = store.enqueue(self.entry(1), max_per_user=2)
+
+        self.assertEqual((first['position'], second['position']), (1, 2))
+        self.assertEqual(second['cost_ahead'], 1.0)
+        self.assertFalse(rejected['accepted'])
+        self.assertEqual(rejected['user_tasks'], 2)
+
+        length, total_cost, user_entries = store.status(2)
+        self.assertEqual((length, total_cost), (3, 3.0))
+        self.assertEqual([position for _, position, _ in user_entries], [2])
+
+    @patch('balancer.shared_queue.connection')
+    def test_operations_drop_a_stale_connection_first(self, store_connection):
+        store_connection.in_atomic_block = False
+
+        DatabaseQueueStore(FifoPolicy(), lease_seconds=60).claim(0)
+
+        store_connection.close_if_unusable_or_obsolete.assert_called_once_with()
+
+    def test_claim_by_number_advances_the_fair_share_clock(self):
+        policy = FairSharePolicy()
+        store = DatabaseQueueStore(policy, lease_seconds=60)
+        for number in (1, 2):
+            store.enqueue(self.entry(1, number=number, cost=5.0), max_per_user=8)
+
+        store.claim_numbers({2})
+
+        self.assertEqual(policy.virtual_time, 5.0)
+
+    def test_claim_passes_over_deferred_users(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        store.enqueue(self.entry(1, number=1), max_per_user=8)
+        store.enqueue(self.entry(2, number=2), max_per_user=8)
+
+        self.assertEqual([entry['user_id'] for entry in store.claim(2, skip_users={1})], [2])
+        self.assertEqual(store.claim_numbers({1}, skip_users={1}), [])
+        self.assertEqual(len(store), 1)
+
+    def test_status_ranks_every_entry_in_two_queries(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        store.enqueue(self.entry(1, cost=5.0), max_per_user=8)
+        store.enqueue(self.entry(2, cost=2.0), max_per_user=8)
+        for _ in range(3):
+            store.enqueue(self.entry(3), max_per_user=8)
+        store.claim(1)
+
+        with CaptureQueriesContext(connection) as queries:
+            length, total_cost, user_entries = store.status(3)
+
+        self.assertEqual(len(queries), 2)
+        self.assertEqual((length, total_cost), (4, 5.0))
+        # the leased row of user 1 no longer counts
+        self.assertEqual([(position, cost_ahead) for _, position, cost_ahead in user_entries], [(2, 2.0), (3, 3.0), (4, 4.0)])
+
+    def test_claimed_rows_are_leased_until_requeued(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        other = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        for user_id in (1, 2, 3):
+            store.enqueue(self.entry(user_id), max_per_user=8)
+
+        claimed = store.claim(2)
+
+        self.assertEqual([entry['user_id'] for entry in claimed], [1, 2])
+        self.assertEqual([entry['user_id'] for entry in other.claim(5)], [3])
+        self.assertEqual(len(store), 0)
+
+        store.requeue(claimed[:1])
+        store.complete(claimed[1])
+
+        self.assertEqual([entry['user_id'] for entry in other.claim(5)], [1])
+        self.assertFalse(QueuedTask.objects.filter(dispatch_id=claimed[1]['dispatch_id']).exists())
+
+    def test_expired_lease_makes_row_visible_again(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        store.enqueue(self.entry(1), max_per_user=8)
+        claimed = store.claim(1)
+
+        QueuedTask.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        again = DatabaseQueueStore(FifoPolicy(), lease_seconds=60).claim(1)
+        self.assertEqual([entry['dispatch_id'] for entry in again], [claimed[0]['dispatch_id']])
+
+    def test_fair_share_keys_are_shared_between_balancers(self):
+        first, second = DatabaseQueueStore(FairSharePolicy(), 60), DatabaseQueueStore(FairSharePolicy(), 60)
+
+        first.enqueue(self.entry(1, cost=10), max_per_user=8)
+        first.enqueue(self.entry(1, cost=10), max_per_user=8)
+        second.enqueue(self.entry(2, cost=10), max_per_user=8)
+
+        # user 2 goes before user 1's second task although another balancer queued it
+        self.assertEqual([entry['user_id'] for entry in second.claim(3)], [1, 2, 1])
+
+    def test_remove_user(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        store.enqueue(self.entry(1), max_per_user=8)
+        store.enqueue(self.entry(2), max_per_user=8)
+
+        removed = store.remove_user(1)
+
+        self.assertEqual([entry['user_id'] for entry in removed], [1])
+        self.assertEqual(len(store), 1)
+
+    def test_enqueue_many_is_all_or_nothing(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        store.enqueue(self.entry(2), max_per_user=3)
+
+        queued = store.enqueue_many([self.entry(1, cost=2.0) for _ in range(3)], max_per_user=3)
+        rejected = store.enqueue_many([self.entry(2) for _ in range(3)], max_per_user=3)
+
+        self.assertEqual(queued['positions'], [2, 3, 4])
+        self.assertEqual(queued['costs_ahead'], [1.0, 3.0, 5.0])
+        self.assertFalse(rejected['accepted'])
+        self.assertEqual(len(store), 4)
+
+    def test_claim_numbers_takes_matching_entries_anywhere_in_the_queue(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        for user_id, number in ((1, 10), (2, 20), (3, 10)):
+            store.enqueue(self.entry(user_id, number=number), max_per_user=8)
+
+        claimed = store.claim_numbers({10})
+
+        self.assertEqual([entry['user_id'] for entry in claimed], [1, 3])
+        self.assertEqual([entry['number'] for entry in store.claim(5)], [20])
+
+    def test_discard_takes_back_only_unclaimed_rows(self):
+        store = DatabaseQueueStore(FifoPolicy(), lease_seconds=60)
+        first, second = self.entry(1), self.entry(2)
+        store.enqueue(first, max_per_user=8)
+        store.enqueue(second, max_per_user=8)
+        store.claim(1)
+
+        self.assertFalse(store.discard([first]))
+        self.assertTrue(store.discard([second]))
+        self.assertEqual(QueuedTask.objects.count(), 1)
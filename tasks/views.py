@@ -1,13 +1,40 @@
+import hmac
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.generics import get_object_or_404
 from .models import Task
-from .serializers import TaskSerializer, TaskCreateSerializer, UserRegistrationSerializer
-from .tasks import calculate_fibonacci_task
+from .serializers import TaskSerializer, TaskCreateSerializer, TaskBulkCreateSerializer, UserRegistrationSerializer
+from .executor import running_computations, submit_task
+from .cache import get_cached_result, get_cached_results
+from .notify import notify_task_finished
+from .counters import start_task, create_tasks, finish_task, server_in_progress, user_in_progress
+from .pagination import paginate_tasks
+from .conditional import conditional_response, delete_task, make_etag, task_changes, task_list_etag
+from . import channel
 from rest_framework.decorators import api_view, permission_classes
 
 from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_code = 'quota_exceeded'
+
+    def __init__(self):
+        super().__init__(f"Maximum active tasks ({settings.MAX_TASKS_PER_USER}) reached")
+
+
+def check_quota(user, new_tasks):
+    """Raises QuotaExceeded when new_tasks more running tasks would take user past MAX_TASKS_PER_USER."""
+    if new_tasks and user_in_progress(user.id) + new_tasks > settings.MAX_TASKS_PER_USER:
+        raise QuotaExceeded()
+
 
 class UserRegistrationView(viewsets.GenericViewSet):
     permission_classes = [AllowAny]
@@ -30,6 +57,13 @@ class TaskViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         return Task.objects.filter(user=self.request.user)
+
+    def list(self, request):
+        return conditional_response(
+            request,
+            task_list_etag(request, live_progress=True),
+            lambda: paginate_tasks(request, self.get_queryset(), 'created_at', live_progress=True)
+        )
     
     def create(self, request):
         serializer = TaskCreateSerializer(data=request.data, context={'request': request})
@@ -39,38 +73,200 @@ class TaskViewSet(viewsets.ModelViewSet):
         
         server_port = request.META.get('SERVER_PORT', 'unknown')
         server_url = f"http://127.0.0.1:{server_port}"
-        
-        task = Task.objects.create(
-            user=request.user,
-            number=serializer.validated_data['number'],
-            status='in_progress',
-            server_url=server_url
-        )
+
+        dispatch_id = request.headers.get('X-Dispatch-Id') or None
+        if dispatch_id:
+            existing_task = Task.objects.filter(user=request.user, dispatch_id=dispatch_id).first()
+            if existing_task:
+                return Response(TaskSerializer(existing_task).data, status=status.HTTP_201_CREATED)
+
+        cached_task = self.create_from_cache(request, serializer.validated_data['number'], server_url, dispatch_id)
+        if cached_task:
+            return Response(TaskSerializer(cached_task).data, status=status.HTTP_201_CREATED)
+
+        check_quota(request.user, 1)
+
+        try:
+            task = start_task(
+                user=request.user,
+                number=serializer.validated_data['number'],
+                server_url=server_url,
+                dispatch_id=dispatch_id
+            )
+        except IntegrityError:
+            # the same dispatch was retried concurrently and the other request won
+            existing_task = Task.objects.filter(user=request.user, dispatch_id=dispatch_id).first()
+            if existing_task is None:
+                return Response(
+                    {'error': 'Task could not be created', 'dispatch_ids': [dispatch_id]},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return Response(TaskSerializer(existing_task).data, status=status.HTTP_201_CREATED)
  
-        calculate_fibonacci_task(task.id, task.number)
+        submit_task(task.id, task.number)
 
         print(f"\nTask {task.id} created for user {request.user.username} on server {server_url}")
         
         return Response(TaskSerializer(task).data, status=status.HTTP_201_CREATED)
     
+    def create_from_cache(self, request, number, server_url, dispatch_id=None):
+        result = get_cached_result(number)
+        if result is None:
+            return None
+
+        task = Task.objects.create(
+            user=request.user,
+            number=number,
+            status='completed',
+            progress=100,
+            result=result,
+            server_url=server_url,
+            dispatch_id=dispatch_id,
+            completed_at=timezone.now()
+        )
+
+        print(f"\nTask {task.id} served from cache for user {request.user.username}")
+        return task
+
+    @action(detail=False, methods=['post'])
+    def cached(self, request):
+        serializer = TaskCreateSerializer(data=request.data, context={'request': request})
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        server_port = request.META.get('SERVER_PORT', 'unknown')
+        server_url = f"http://127.0.0.1:{server_port}"
+
+        task = self.create_from_cache(request, serializer.validated_data['number'], server_url)
+        if task is None:
+            return Response({'error': 'Result is not cached'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(TaskSerializer(task).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a task per number in {'numbers': [...]} with one INSERT and returns
+        them in the same order. The balancer sends its dispatch ids, one per
+        number, in X-Dispatch-Ids; numbers already created under their id are not
+        created again.
+        """
+        serializer = TaskBulkCreateSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        numbers = serializer.validated_data['numbers']
+        dispatch_ids = [d.strip() or None for d in request.headers.get('X-Dispatch-Ids', '').split(',')]
+        if dispatch_ids == [None]:
+            dispatch_ids = [None] * len(numbers)
+        if len(dispatch_ids) != len(numbers):
+            return Response(
+                {'error': 'X-Dispatch-Ids must list one id per number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        server_port = request.META.get('SERVER_PORT', 'unknown')
+        server_url = f"http://127.0.0.1:{server_port}"
+
+        existing = self.tasks_by_dispatch_id(request, dispatch_ids)
+        missing = [i for i, dispatch_id in enumerate(dispatch_ids) if dispatch_id not in existing]
+        cached = get_cached_results([numbers[i] for i in missing])
+
+        new_tasks = []
+        for i in missing:
+            result = cached.get(numbers[i])
+            fields = {'status': 'in_progress'} if result is None else {
+                'status': 'completed',
+                'progress': 100,
+                'result': result,
+                'completed_at': timezone.now()
+            }
+            new_tasks.append(Task(
+                user=request.user,
+                number=numbers[i],
+                server_url=server_url,
+                dispatch_id=dispatch_ids[i],
+                **fields
+            ))
+
+        check_quota(request.user, sum(1 for task in new_tasks if task.status == 'in_progress'))
+
+        try:
+            created = create_tasks(new_tasks)
+        except IntegrityError:
+            # the same batch was retried concurrently and the other request won
+            existing = self.tasks_by_dispatch_id(request, dispatch_ids)
+            created = []
+            missing = []
+            conflicting = [dispatch_id for dispatch_id in dispatch_ids if dispatch_id not in existing]
+            if conflicting:
+                # taken by some other request that is not this user's retry
+                return Response(
+                    {'error': 'Tasks could not be created', 'dispatch_ids': [d for d in conflicting if d]},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+        tasks = [existing.get(dispatch_id) for dispatch_id in dispatch_ids]
+        for i, task in zip(missing, created):
+            tasks[i] = task
+            if task.status == 'in_progress':
+                submit_task(task.id, task.number)
+
+        print(f"\n{len(created)} tasks created in bulk for user {request.user.username} on server {server_url}")
+
+        return Response({'results': TaskSerializer(tasks, many=True).data}, status=status.HTTP_201_CREATED)
+
+    def tasks_by_dispatch_id(self, request, dispatch_ids):
+        dispatch_ids = [dispatch_id for dispatch_id in dispatch_ids if dispatch_id]
+        if not dispatch_ids:
+            return {}
+        return {
+            task.dispatch_id: task
+            for task in Task.objects.filter(user=request.user, dispatch_id__in=dispatch_ids)
+        }
+
     @action(detail=False, methods=['get'])
     def active(self, request):
         tasks = Task.objects.filter(
             user=request.user,
-            status__in=['in_progress']
-        ).order_by('-created_at')
-        serializer = self.get_serializer(tasks, many=True)
-        return Response(serializer.data)
+            status='in_progress'
+        )
+        return conditional_response(
+            request,
+            task_list_etag(request, live_progress=True),
+            lambda: paginate_tasks(request, tasks, 'created_at', live_progress=True)
+        )
 
     @action(detail=False, methods=['get'])
     def history(self, request):
+        # every status but in_progress, spelled so the partial index applies
         tasks = Task.objects.filter(
-            user=request.user,
-            status__in=['completed', 'failed', 'cancelled']
-        ).order_by('-completed_at')
-        serializer = self.get_serializer(tasks, many=True)
-        return Response(serializer.data)
+            user=request.user
+        ).exclude(status='in_progress')
+        return conditional_response(
+            request,
+            task_list_etag(request),
+            lambda: paginate_tasks(request, tasks, 'completed_at')
+        )
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        return Response(task_changes(request, self.get_queryset()))
     
+    def destroy(self, request, pk=None):
+        # a running task holds a slot and the counters; it has to be cancelled first
+        task = self.get_object()
+        if task.status == 'in_progress':
+            return Response(
+                {'error': 'Task in progress cannot be deleted'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        delete_task(task)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         task = self.get_object()
@@ -81,39 +277,103 @@ class TaskViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        cancelled_at = timezone.now()
+        if not finish_task(task, status='cancelled', completed_at=cancelled_at):
+            return Response(
+                {'error': 'Task cannot be cancelled'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         task.status = 'cancelled'
-        task.save()
+        task.completed_at = cancelled_at
+        channel.request_cancel(task.id)
+        notify_task_finished(task)
         
         return Response(TaskSerializer(task).data)
     
     @action(detail=True, methods=['get'])
     def progress(self, request, pk=None):
-        task = self.get_object()
-        return Response({
-            'id': task.id,
-            'status': task.status,
-            'progress': task.progress,
-            'result': task.result
-        })
+        # the result can be a very long number; it is only loaded for a 200
+        task = get_object_or_404(self.get_queryset().defer('result', 'checkpoint'), pk=pk)
+
+        progress = task.progress
+        if task.status == 'in_progress':
+            live_progress = channel.read_progress(task.id)
+            if live_progress is not None:
+                progress = live_progress
+
+        return conditional_response(
+            request,
+            make_etag('progress', task.id, task.updated_at, progress),
+            lambda: {
+                'id': task.id,
+                'status': task.status,
+                'progress': progress,
+                'result': task.result
+            }
+        )
     
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def server_status(request):
+    """
+    This backend's load from its counter and its executor, without reading Task
+    rows. With ?tasks=1 the in-progress (id, number) pairs are listed too, for
+    the balancer to reconcile its slots against; that takes its X-Internal-Token.
+    """
     server_port = request.META.get('SERVER_PORT', 'unknown')
     server_url = f"http://127.0.0.1:{server_port}"
 
-    in_progress_count = Task.objects.filter(
-        status='in_progress',
-        server_url=server_url
-    ).count()
+    in_progress_count = server_in_progress(server_url)
 
-    available_slots = settings.MAX_TASKS_PER_SERVER - in_progress_count
-    busy = in_progress_count >= settings.MAX_TASKS_PER_SERVER
+    # tasks for the same number share one computation (see tasks.executor)
+    computations = running_computations()
+    available_slots = settings.MAX_TASKS_PER_SERVER - computations
+    busy = computations >= settings.MAX_TASKS_PER_SERVER
 
-    return Response({
+    data = {
         'busy': busy,
         'in_progress_tasks': in_progress_count,
         'available_slots': max(0, available_slots),
         'server_url': server_url,
-        'max_tasks': settings.MAX_TASKS_PER_SERVER
-    })
\ No newline at end of file
+        'max_tasks': settings.MAX_TASKS_PER_SERVER,
+    }
+    if request.query_params.get('tasks') == '1':
+        token = request.headers.get('X-Internal-Token', '')
+        if not hmac.compare_digest(token.encode('utf-8'), settings.INTERNAL_API_TOKEN.encode('utf-8')):
+            return Response({'error': 'Internal token required'}, status=status.HTTP_403_FORBIDDEN)
+
+        tasks = list(Task.objects.filter(
+            status='in_progress',
+            server_url=server_url
+        ).values_list('id', 'number'))
+        data['task_ids'] = [task_id for task_id, _ in tasks]
+        data['tasks'] = tasks
+
+    return Response(data)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def task_stats(request):
+    """Average run time of recently computed tasks, grouped by the bit length of the number."""
+    recent = Task.objects.filter(
+        status='completed',
+        started_at__isnull=False,
+        completed_at__isnull=False
+    ).order_by('-completed_at').values_list('number', 'started_at', 'completed_at')[:settings.TASK_STATS_SAMPLE_SIZE]
+
+    buckets = {}
+    for number, started_at, completed_at in recent:
+        bucket = buckets.setdefault(max(0, number).bit_length(), {'count': 0, 'total_seconds': 0.0})
+        bucket['count'] += 1
+        bucket['total_seconds'] += (completed_at - started_at).total_seconds()
+
+    return Response({
+        'buckets': {
+            str(bit_length): {
+                'count': bucket['count'],
+                'avg_seconds': bucket['total_seconds'] / bucket['count']
+            }
+            for bit_length, bucket in buckets.items()
+        }
+    })